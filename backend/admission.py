@@ -0,0 +1,212 @@
+"""Admission control for write routes, applied before any handler (and so before any DB session).
+
+- Per-client token bucket on the booking routes (RATE_LIMIT_ROUTES): RATE_LIMIT_RPS tokens per second,
+  RATE_LIMIT_BURST bucket size. Excess requests get 429 with Retry-After = time until the next token.
+  The client is the peer address. X-Forwarded-For is read only when the peer is one of
+  RATE_LIMIT_TRUSTED_PROXIES (IPs or CIDRs): the client is then the rightmost address in it that is
+  not a trusted proxy. X-Client-Id is a caller-chosen header, so it keys its own bucket only when it
+  is on the RATE_LIMIT_CLIENT_IDS allowlist; any other value is ignored.
+- Global concurrency limit on every write method (POST/PUT/PATCH/DELETE): at most WRITE_MAX_CONCURRENCY
+  in flight per process (each one holds a threadpool worker and a pooled connection). A request waits
+  up to WRITE_QUEUE_MS for a free slot, then gets 503 with Retry-After.
+
+Buckets live in-process by default. With RATE_LIMIT_REDIS_URL (needs the `redis` package), they are
+shared by all workers through one atomic Lua call per request; if Redis fails, the in-process
+buckets take over. Shed requests are counted in timing_instrumentation (GET /api/_debug/admission).
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+from backend.timing_instrumentation import record_shed
+
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_ROUTES = {
+    tuple(r.strip().split(None, 1))
+    for r in os.getenv("RATE_LIMIT_ROUTES", "POST /api/book,POST /api/bookings").split(",")
+    if r.strip()
+}
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "50000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+RATE_LIMIT_CLIENT_IDS = {c.strip() for c in os.getenv("RATE_LIMIT_CLIENT_IDS", "").split(",") if c.strip()}
+WRITE_MAX_CONCURRENCY = int(os.getenv("WRITE_MAX_CONCURRENCY", "16"))
+WRITE_QUEUE_MS = float(os.getenv("WRITE_QUEUE_MS", "100"))
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class LocalBuckets:
+    """Token buckets per client; the least recently seen clients are dropped past max_clients."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate, self.burst, self.max_clients = rate, burst, max_clients
+        self._b: OrderedDict[str, tuple[float, float]] = OrderedDict()  # client -> (tokens, last ts)
+
+    async def take(self, client: str) -> float:
+        """0 if admitted, else seconds until a token is available."""
+        now = time.monotonic()
+        tokens, ts = self._b.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - ts) * self.rate)
+        wait = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait = (1.0 - tokens) / self.rate
+        self._b[client] = (tokens, now)
+        while len(self._b) > self.max_clients:
+            self._b.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {"backend": "local", "clients": len(self._b)}
+
+
+_REDIS_BUCKET_LUA = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens, ts = tonumber(b[1]) or burst, tonumber(b[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Same buckets shared across workers/hosts; falls back to `local` while Redis is unreachable."""
+
+    def __init__(self, url: str, rate: float, burst: float, local: LocalBuckets):
+        import redis.asyncio as aioredis  # optional dependency
+        self.rate, self.burst, self.local = rate, burst, local
+        self._r = aioredis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self._script = self._r.register_script(_REDIS_BUCKET_LUA)
+        self.errors = 0
+
+    async def take(self, client: str) -> float:
+        try:
+            return float(await self._script(keys=[f"rl:{client}"], args=[self.rate, self.burst, time.time()]))
+        except Exception:
+            self.errors += 1
+            return await self.local.take(client)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "redis_errors": self.errors, "local_fallback_clients": len(self.local._b)}
+
+
+def make_buckets():
+    if RATE_LIMIT_RPS <= 0:
+        return None
+    local = LocalBuckets(RATE_LIMIT_RPS, max(1.0, RATE_LIMIT_BURST))
+    if RATE_LIMIT_REDIS_URL:
+        try:
+            return RedisBuckets(RATE_LIMIT_REDIS_URL, RATE_LIMIT_RPS, max(1.0, RATE_LIMIT_BURST), local)
+        except ImportError:
+            print("[admission] RATE_LIMIT_REDIS_URL set but `redis` is not installed; using in-process buckets")
+    return local
+
+
+def _trusted(addr: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(addr.strip())
+    except ValueError:
+        return False
+    return any(ip in net for net in RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def _client_id(scope) -> str:
+    """Bucket key: an allowlisted X-Client-Id, else the client address (never a free-form header)."""
+    client = scope.get("client")
+    addr = client[0] if client else "unknown"
+    forwarded = []
+    for k, v in scope.get("headers") or ():
+        if k == b"x-client-id" and v:
+            cid = v.decode("latin-1").strip()
+            if cid in RATE_LIMIT_CLIENT_IDS:
+                return f"id:{cid}"
+        elif k == b"x-forwarded-for":
+            forwarded += v.decode("latin-1").split(",")
+    if forwarded and _trusted(addr):
+        # walk back from our proxy; the first hop it did not add itself is the client
+        for hop in reversed(forwarded):
+            hop = hop.strip()
+            if hop and not _trusted(hop):
+                return hop[:64]
+    return addr
+
+
+def _shed(status: int, retry_after: float, detail: str) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail}, status_code=status,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware (no per-request task/body wrapping like BaseHTTPMiddleware)."""
+
+    def __init__(self, app, buckets=None, max_concurrency: int = WRITE_MAX_CONCURRENCY, queue_ms: float = WRITE_QUEUE_MS):
+        self.app = app
+        self.buckets = buckets if buckets is not None else make_buckets()
+        self.max_concurrency = max_concurrency
+        self.queue_s = queue_ms / 1000.0
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        ADMISSION["middleware"] = self
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            return await self.app(scope, receive, send)
+        method, path = scope["method"], scope["path"]
+        if self.buckets is not None and (method, path) in RATE_LIMIT_ROUTES:
+            wait = await self.buckets.take(_client_id(scope))
+            if wait > 0:
+                record_shed("rate_limited", f"{method} {path}")
+                return await _shed(429, wait, "Quá nhiều yêu cầu, vui lòng thử lại sau")(scope, receive, send)
+        if self.max_concurrency <= 0:
+            return await self.app(scope, receive, send)
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        admitted = True
+        if self.queue_s <= 0:
+            if self._sem.locked():
+                admitted = False
+            else:
+                await self._sem.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_s)
+            except asyncio.TimeoutError:
+                admitted = False
+        if not admitted:
+            record_shed("overloaded", f"{method} {path}")
+            return await _shed(503, 1, "Hệ thống đang quá tải, vui lòng thử lại sau")(scope, receive, send)
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        b = self.buckets
+        return {
+            "rate_limit": {"rps": b.rate, "burst": b.burst, "routes": sorted(" ".join(r) for r in RATE_LIMIT_ROUTES), **b.stats()}
+            if b is not None else {"backend": "off"},
+            "concurrency": {"limit": self.max_concurrency, "in_flight": self.in_flight, "queue_ms": self.queue_s * 1000.0},
+        }
+
+
+# the live middleware instance (Starlette builds it lazily), for /api/_debug/admission
+ADMISSION: dict = {"middleware": None}
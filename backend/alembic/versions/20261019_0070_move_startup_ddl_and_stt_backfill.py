@@ -0,0 +1,48 @@
+"""
+move startup DDL into migrations: windows unique index, appointments.stt + backfill
+
+Revision ID: 20261019_0070
+Revises: 20250828_0060
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0070'
+down_revision: Union[str, None] = '20250828_0060'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Previously created best-effort on every app startup
+    op.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_windows_doc_start_end_kind
+        ON schedule_windows (doctor_id, start, "end", kind)
+        """
+    )
+    op.execute("ALTER TABLE appointments ADD COLUMN IF NOT EXISTS stt integer")
+
+    # Backfill stt where null: daily sequence per doctor by appointment time
+    op.execute(
+        """
+        WITH ranked AS (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY doctor_id, DATE("when") ORDER BY "when" ASC, id ASC) AS rn
+            FROM appointments
+        )
+        UPDATE appointments a
+        SET stt = r.rn
+        FROM ranked r
+        WHERE a.id = r.id AND a.stt IS NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    # appointments.stt is kept: the startup code before this revision created and used it, so
+    # dropping it would lose the STT numbering; the backfill is not undone either
+    op.execute("DROP INDEX IF EXISTS ux_windows_doc_start_end_kind")
@@ -0,0 +1,42 @@
+"""
+add schedule_rules (recurring availability templates)
+
+Revision ID: 20261019_0080
+Revises: 20261019_0070
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0080'
+down_revision: Union[str, None] = '20261019_0070'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'schedule_rules',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('scope_kind', sa.String(length=16), nullable=False),
+        sa.Column('scope_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('weekdays', sa.Integer(), nullable=False, server_default=sa.text('127')),
+        sa.Column('start_minute', sa.Integer(), nullable=False),
+        sa.Column('end_minute', sa.Integer(), nullable=False),
+        sa.Column('date_from', sa.Date(), nullable=False),
+        sa.Column('date_to', sa.Date(), nullable=True),
+        sa.Column('exceptions', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_schedule_rules_scope', 'schedule_rules', ['scope_kind', 'scope_id', 'date_from'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_schedule_rules_scope', table_name='schedule_rules')
+    op.drop_table('schedule_rules')
@@ -0,0 +1,121 @@
+"""
+partition appointments by month on "when" (declarative range partitioning)
+
+- appointments becomes a partitioned table with one partition per month (appointments_pYYYY_MM)
+  plus appointments_default for rows outside every month partition, so inserts never fail; months are
+  created back to the oldest row but at most MONTHS_BACK, anything older stays in the default partition
+- primary key becomes (id, "when") (a partition key column must be part of every unique index);
+  id keeps its sequence, so ids stay unique in practice
+- appointments_ensure_partition(month) creates one month partition, moving matching rows out of the
+  default partition first; backend/partitions.py calls it for the months ahead
+- adds (doctor_id, "when") for the busy/STT lookups, which now prune to one partition
+
+Revision ID: 20261019_0090
+Revises: 20261019_0080
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0090'
+down_revision: Union[str, None] = '20261019_0080'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 12
+MONTHS_BACK = 36  # older rows (or outlier timestamps) stay in appointments_default
+
+INDEXES = [
+    ("ix_appointments_when", '("when")'),
+    ("ix_appointments_created_at", "(created_at)"),
+    ("ix_appointments_user_created_at", "(user_id, created_at DESC)"),
+    ("ix_appointments_user_when", '(user_id, "when")'),
+    ("ix_appointments_doctor_when", '(doctor_id, "when")'),
+]
+
+ENSURE_PARTITION_FN = r"""
+CREATE OR REPLACE FUNCTION appointments_ensure_partition(p_month date) RETURNS boolean
+LANGUAGE plpgsql AS $$
+DECLARE
+    lo timestamp := date_trunc('month', p_month);
+    hi timestamp := date_trunc('month', p_month) + interval '1 month';
+    part text := 'appointments_p' || to_char(p_month, 'YYYY_MM');
+BEGIN
+    -- serialize concurrent callers (several workers / cron)
+    PERFORM pg_advisory_xact_lock(hashtext('appointments_ensure_partition'));
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE appointments INCLUDING DEFAULTS)', part);
+    -- rows that landed in the default partition for this month move to the new partition
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM appointments_default WHERE "when" >= %L AND "when" < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved', lo, hi, part);
+    -- matching CHECK lets ATTACH skip its validation scan
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK ("when" >= %L AND "when" < %L)',
+                   part, part || '_bounds', lo, hi);
+    EXECUTE format('ALTER TABLE appointments ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, lo, hi);
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, part || '_bounds');
+    RETURN true;
+END
+$$;
+"""
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE appointments RENAME TO appointments_heap")
+    op.execute("ALTER TABLE appointments_heap RENAME CONSTRAINT appointments_pkey TO appointments_heap_pkey")
+    for name, _ in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER SEQUENCE appointments_id_seq OWNED BY NONE")
+
+    op.execute('CREATE TABLE appointments (LIKE appointments_heap INCLUDING DEFAULTS) PARTITION BY RANGE ("when")')
+    op.execute("CREATE TABLE appointments_default PARTITION OF appointments DEFAULT")
+    op.execute(ENSURE_PARTITION_FN)
+    # one partition per month from the oldest appointment (at most MONTHS_BACK back) up to MONTHS_AHEAD
+    # months from now; a stray old timestamp must not create thousands of partitions
+    op.execute(
+        f"""
+        SELECT appointments_ensure_partition(m::date)
+        FROM generate_series(
+            date_trunc('month', GREATEST(
+                COALESCE((SELECT min("when") FROM appointments_heap), now()),
+                now() - interval '{MONTHS_BACK} months'
+            )),
+            date_trunc('month', now()) + interval '{MONTHS_AHEAD} months',
+            interval '1 month'
+        ) AS m
+        """
+    )
+    op.execute("INSERT INTO appointments SELECT * FROM appointments_heap")
+    op.execute("DROP TABLE appointments_heap")
+    op.execute("ALTER SEQUENCE appointments_id_seq OWNED BY appointments.id")
+
+    # keys and indexes on the parent cascade to every partition (present and future)
+    op.execute('ALTER TABLE appointments ADD CONSTRAINT appointments_pkey PRIMARY KEY (id, "when")')
+    op.create_foreign_key('appointments_user_id_fkey', 'appointments', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('appointments_doctor_id_fkey', 'appointments', 'doctors', ['doctor_id'], ['id'])
+    for name, cols in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON appointments {cols}")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE appointments RENAME TO appointments_part")
+    for name, _ in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER TABLE appointments_part DROP CONSTRAINT appointments_pkey")
+    op.execute("ALTER SEQUENCE appointments_id_seq OWNED BY NONE")
+    op.execute("CREATE TABLE appointments (LIKE appointments_part INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO appointments SELECT * FROM appointments_part")
+    op.execute("DROP TABLE appointments_part CASCADE")
+    op.execute("DROP FUNCTION IF EXISTS appointments_ensure_partition(date)")
+    op.execute("ALTER SEQUENCE appointments_id_seq OWNED BY appointments.id")
+    op.execute("ALTER TABLE appointments ADD CONSTRAINT appointments_pkey PRIMARY KEY (id)")
+    op.create_foreign_key('appointments_user_id_fkey', 'appointments', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('appointments_doctor_id_fkey', 'appointments', 'doctors', ['doctor_id'], ['id'])
+    for name, cols in INDEXES:
+        if name != "ix_appointments_doctor_when":
+            op.execute(f"CREATE INDEX {name} ON appointments {cols}")
@@ -0,0 +1,53 @@
+"""
+add appointments_archive (cold storage for past months, one compressed pack per user per month)
+
+Revision ID: 20261019_0100
+Revises: 20261019_0090
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0100'
+down_revision: Union[str, None] = '20261019_0090'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'appointments_archive',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('n', sa.Integer(), nullable=False),
+        sa.Column('ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.Column('rows', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'month'),
+    )
+    op.create_index('ix_appointments_archive_month', 'appointments_archive', ['month'])
+    # booking detail by id for archived appointments
+    op.create_index('ix_appointments_archive_ids', 'appointments_archive', ['ids'], postgresql_using='gin')
+    # try to compress packs from ~256 bytes on (default target is ~2 kB), lz4 where the server has it (PG 14+)
+    op.execute("ALTER TABLE appointments_archive SET (toast_tuple_target = 256)")
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            ALTER TABLE appointments_archive ALTER COLUMN rows SET COMPRESSION lz4;
+        EXCEPTION WHEN others THEN
+            RAISE NOTICE 'lz4 compression unavailable, keeping pglz';
+        END
+        $$
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_appointments_archive_ids', table_name='appointments_archive')
+    op.drop_index('ix_appointments_archive_month', table_name='appointments_archive')
+    op.drop_table('appointments_archive')
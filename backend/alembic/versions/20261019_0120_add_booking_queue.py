@@ -0,0 +1,43 @@
+"""
+add booking_queue (durable queue for asynchronous booking ingest)
+
+Revision ID: 20261019_0120
+Revises: 20261019_0110
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0120'
+down_revision: Union[str, None] = '20261019_0110'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'booking_queue',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='queued'),
+        sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # workers claim the oldest queued rows; the partial index stays as small as the backlog
+    op.create_index('ix_booking_queue_queued', 'booking_queue', ['id'], postgresql_where=sa.text("status = 'queued'"))
+    # lets cleanup of old finished tickets use an index
+    op.create_index('ix_booking_queue_finished_at', 'booking_queue', ['finished_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_booking_queue_finished_at', table_name='booking_queue')
+    op.drop_index('ix_booking_queue_queued', table_name='booking_queue')
+    op.drop_table('booking_queue')
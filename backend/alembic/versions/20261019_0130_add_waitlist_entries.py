@@ -0,0 +1,47 @@
+"""
+add waitlist_entries (per doctor-day waitlist backfilled on cancellation)
+
+Revision ID: 20261019_0130
+Revises: 20261019_0120
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0130'
+down_revision: Union[str, None] = '20261019_0120'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'waitlist_entries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('need', sa.Text(), nullable=True),
+        sa.Column('symptoms', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='waiting'),
+        sa.Column('appointment_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('booked_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # a repack loads the waiting entries of its doctor-days; the partial index holds only those
+    op.create_index('ix_waitlist_entries_waiting', 'waitlist_entries', ['doctor_id', 'day'],
+                    postgresql_where=sa.text("status = 'waiting'"))
+    op.create_index('ix_waitlist_entries_user_id', 'waitlist_entries', ['user_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_waitlist_entries_user_id', table_name='waitlist_entries')
+    op.drop_index('ix_waitlist_entries_waiting', table_name='waitlist_entries')
+    op.drop_table('waitlist_entries')
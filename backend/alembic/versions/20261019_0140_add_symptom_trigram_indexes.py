@@ -0,0 +1,36 @@
+"""
+add trigram indexes on symptom text (ad-hoc ILIKE search) and conversations (user_id, created_at)
+
+- pg_trgm GIN indexes on appointments.symptoms and conversations.symptoms serve
+  GET /api/_admin/symptoms/search (ILIKE '%...%'); the one on the partitioned parent cascades to
+  every partition
+- conversations (user_id, created_at) serves the "latest conversation before booking" lookup of
+  backend/symptom_routing.py
+
+Revision ID: 20261019_0140
+Revises: 20261019_0130
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0140'
+down_revision: Union[str, None] = '20261019_0130'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_appointments_symptoms_trgm ON appointments USING gin (symptoms gin_trgm_ops)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_conversations_symptoms_trgm ON conversations USING gin (symptoms gin_trgm_ops)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_conversations_user_created_at ON conversations (user_id, created_at DESC)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_conversations_user_created_at")
+    op.execute("DROP INDEX IF EXISTS ix_conversations_symptoms_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_appointments_symptoms_trgm")
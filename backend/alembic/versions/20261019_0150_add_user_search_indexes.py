@@ -0,0 +1,53 @@
+"""
+add users.name_folded and the indexes behind GET /api/users/search
+
+- name_folded = textnorm.fold(name) (no accents, lowercase), COLLATE "C" so a plain btree on
+  (name_folded, id) serves LIKE 'prefix%' and the keyset ORDER BY; backfilled here in id batches,
+  then maintained by the ORM (User.name validator)
+- GIN trigram on name_folded for word prefixes inside the name ("an" in "nguyen van an")
+- (phone COLLATE "C", id) and (cccd COLLATE "C", id) for digit prefixes in keyset order
+
+Revision ID: 20261019_0150
+Revises: 20261019_0140
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+from backend.textnorm import fold
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0150'
+down_revision: Union[str, None] = '20261019_0140'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 5000
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS name_folded varchar(255) COLLATE "C"')
+    bind = op.get_bind()
+    last = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, name FROM users WHERE id > :last ORDER BY id LIMIT :n"), {"last": last, "n": BATCH}
+        ).all()
+        if not rows:
+            break
+        bind.execute(sa.text("UPDATE users SET name_folded = :f WHERE id = :id"), [{"id": i, "f": fold(n)} for i, n in rows])
+        last = rows[-1][0]
+    op.execute("CREATE INDEX IF NOT EXISTS ix_users_name_folded ON users (name_folded, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_users_name_folded_trgm ON users USING gin (name_folded gin_trgm_ops)")
+    op.execute('CREATE INDEX IF NOT EXISTS ix_users_phone_c ON users ((phone COLLATE "C"), id)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_users_cccd_c ON users ((cccd COLLATE "C"), id)')
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_users_cccd_c")
+    op.execute("DROP INDEX IF EXISTS ix_users_phone_c")
+    op.execute("DROP INDEX IF EXISTS ix_users_name_folded_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_users_name_folded")
+    op.execute("ALTER TABLE users DROP COLUMN IF EXISTS name_folded")
@@ -0,0 +1,115 @@
+"""
+add utilization facts (utilization_daily) and dirty-day tracking triggers
+
+- utilization_daily: one row per doctor-day with availability or bookings, keyed (day, doctor_id)
+  since reads are a day range over many doctors
+- utilization_dirty: appended by AFTER ROW triggers on every write path that changes capacity or
+  bookings (appointments, schedule_windows, schedule_rules, including bulk Core statements);
+  backend/utilization.py drains it and recomputes only those doctor-days
+- utilization_state: the day range the facts cover (filled by the first refresh)
+
+Revision ID: 20261019_0160
+Revises: 20261019_0150
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0160'
+down_revision: Union[str, None] = '20261019_0150'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MARK_DIRTY_FN = r"""
+CREATE OR REPLACE FUNCTION utilization_mark_dirty() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- TG_ARGV[0]: the logical table (row triggers on appointments run with the partition's name)
+    IF TG_ARGV[0] = 'appointments' THEN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES ('doctor', OLD.doctor_id, OLD."when"::date, OLD."when"::date);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES ('doctor', NEW.doctor_id, NEW."when"::date, NEW."when"::date);
+        END IF;
+    ELSIF TG_ARGV[0] = 'schedule_windows' THEN
+        -- "end" is exclusive: a window ending at midnight does not touch the next day
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES ('doctor', OLD.doctor_id, OLD.start::date, GREATEST(OLD.start, OLD."end" - interval '1 microsecond')::date);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES ('doctor', NEW.doctor_id, NEW.start::date, GREATEST(NEW.start, NEW."end" - interval '1 microsecond')::date);
+        END IF;
+    ELSE
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES (OLD.scope_kind, OLD.scope_id, OLD.date_from, OLD.date_to);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO utilization_dirty (scope_kind, scope_id, day_from, day_to)
+            VALUES (NEW.scope_kind, NEW.scope_id, NEW.date_from, NEW.date_to);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+TRIGGERS = [
+    # (trigger, table, events)
+    ("trg_appointments_utilization", "appointments", 'INSERT OR DELETE OR UPDATE OF doctor_id, "when"'),
+    ("trg_schedule_windows_utilization", "schedule_windows", 'INSERT OR DELETE OR UPDATE OF doctor_id, start, "end", kind'),
+    ("trg_schedule_rules_utilization", "schedule_rules", "INSERT OR DELETE OR UPDATE"),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'utilization_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('available_min', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('ooo_min', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('booked', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id']),
+        sa.PrimaryKeyConstraint('day', 'doctor_id'),
+    )
+    op.create_table(
+        'utilization_dirty',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('scope_kind', sa.String(length=16), nullable=False),
+        sa.Column('scope_id', sa.Integer(), nullable=False),
+        sa.Column('day_from', sa.Date(), nullable=False),
+        sa.Column('day_to', sa.Date(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'utilization_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('computed_from', sa.Date(), nullable=False),
+        sa.Column('computed_until', sa.Date(), nullable=False),
+        sa.Column('last_run_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(MARK_DIRTY_FN)
+    for name, table, events in TRIGGERS:
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {events} ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION utilization_mark_dirty('{table}')"
+        )
+
+
+def downgrade() -> None:
+    for name, table, _ in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS utilization_mark_dirty()")
+    op.drop_table('utilization_state')
+    op.drop_table('utilization_dirty')
+    op.drop_table('utilization_daily')
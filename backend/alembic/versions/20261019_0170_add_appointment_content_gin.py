@@ -0,0 +1,30 @@
+"""
+add GIN (content jsonb_path_ops) on appointments for snapshot containment filters
+
+- serves content @> '{"room_code": "P101"}' (GET /api/_admin/appointments); jsonb_path_ops only
+  supports @>, which is what the admin filters use, and is much smaller than the default jsonb_ops
+- content itself is compacted by `python -m backend.manage compact-content` (backend/content_snapshot.py),
+  not here, so the migration stays short and the job can report before/after numbers
+
+Revision ID: 20261019_0170
+Revises: 20261019_0160
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0170'
+down_revision: Union[str, None] = '20261019_0160'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE INDEX IF NOT EXISTS ix_appointments_content_path ON appointments USING gin (content jsonb_path_ops)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_appointments_content_path")
@@ -0,0 +1,35 @@
+"""
+add appointments.room_id, the room assigned by backend/rooms.py
+
+- nullable: NULL means not (yet) assigned, e.g. a department without rooms or a full day
+- (room_id, "when") serves per-room day lists; no exclusion constraint, since on a partitioned table
+  it would have to include the partition key, so rooms.py keeps rooms conflict-free under the
+  department's advisory lock instead
+- existing rows are assigned by `python -m backend.manage plan-rooms`
+
+Revision ID: 20261019_0180
+Revises: 20261019_0170
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0180'
+down_revision: Union[str, None] = '20261019_0170'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('appointments', sa.Column('room_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_appointments_room_id', 'appointments', 'rooms', ['room_id'], ['id'])
+    op.create_index('ix_appointments_room_when', 'appointments', ['room_id', 'when'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_appointments_room_when', table_name='appointments')
+    op.drop_constraint('fk_appointments_room_id', 'appointments', type_='foreignkey')
+    op.drop_column('appointments', 'room_id')
@@ -0,0 +1,117 @@
+"""
+add calendar_versions: per-doctor change counter for the .ics feeds
+
+- one row per doctor, bumped (version + 1, changed_at = now in UTC) by AFTER STATEMENT triggers with
+  transition tables on every write that changes what the doctor's feed shows: appointments,
+  schedule_windows, and schedule_rules of the doctor, its department or its hospital; Core bulk
+  statements included. Each statement bumps its distinct doctors once, in doctor id order, so a bulk
+  window write and a booking batch touching the same doctors cannot deadlock on the version rows
+- backend/calendar_feed.py derives the strong ETag and Last-Modified from it, so a poll that finds
+  nothing changed costs one primary-key lookup and gets 304
+- doctors without a row are at version 0
+
+Revision ID: 20261019_0190
+Revises: 20261019_0180
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0190'
+down_revision: Union[str, None] = '20261019_0180'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BUMP_FN = r"""
+CREATE OR REPLACE FUNCTION calendar_bump(doctor_ids int[]) RETURNS void
+LANGUAGE sql AS $$
+    -- one upsert per doctor, in doctor id order: concurrent statements lock version rows in the same order
+    INSERT INTO calendar_versions (doctor_id, version, changed_at)
+    SELECT x, 1, now() AT TIME ZONE 'utc'
+    FROM (SELECT DISTINCT x FROM unnest(doctor_ids) AS x WHERE x IS NOT NULL) s
+    ORDER BY x
+    ON CONFLICT (doctor_id) DO UPDATE
+    SET version = calendar_versions.version + 1, changed_at = EXCLUDED.changed_at
+$$;
+
+CREATE OR REPLACE FUNCTION calendar_mark_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    kinds text[];
+    scopes int[];
+BEGIN
+    -- statement level: old_rows / new_rows are the transition tables (only those of TG_OP exist)
+    IF TG_ARGV[0] <> 'schedule_rules' THEN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM calendar_bump(ARRAY(SELECT doctor_id FROM new_rows));
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM calendar_bump(ARRAY(SELECT doctor_id FROM old_rows));
+        ELSE
+            PERFORM calendar_bump(ARRAY(SELECT doctor_id FROM old_rows UNION SELECT doctor_id FROM new_rows));
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(scope_kind), array_agg(scope_id) INTO kinds, scopes FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(scope_kind), array_agg(scope_id) INTO kinds, scopes FROM old_rows;
+    ELSE
+        SELECT array_agg(k), array_agg(i) INTO kinds, scopes
+        FROM (SELECT scope_kind AS k, scope_id AS i FROM old_rows UNION SELECT scope_kind, scope_id FROM new_rows) s;
+    END IF;
+    PERFORM calendar_bump(ARRAY(
+        SELECT d.id
+        FROM unnest(kinds, scopes) AS s(k, i)
+        JOIN doctors d ON CASE s.k
+            WHEN 'doctor' THEN d.id = s.i
+            WHEN 'department' THEN d.department_id = s.i
+            ELSE d.department_id IN (SELECT p.id FROM departments p WHERE p.hospital_id = s.i)
+        END
+    ));
+    RETURN NULL;
+END
+$$;
+"""
+
+TABLES = [
+    # any column can show up in a feed (STT, room, window kind)
+    "appointments",
+    "schedule_windows",
+    "schedule_rules",
+]
+# transition tables allow a single event per trigger
+EVENTS = [
+    ("ins", "INSERT", "NEW TABLE AS new_rows"),
+    ("upd", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ("del", "DELETE", "OLD TABLE AS old_rows"),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'calendar_versions',
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('changed_at', sa.DateTime(), nullable=False, server_default=sa.text("(now() AT TIME ZONE 'utc')")),
+        sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id']),
+        sa.PrimaryKeyConstraint('doctor_id'),
+    )
+    op.execute(BUMP_FN)
+    for table in TABLES:
+        for suffix, event, referencing in EVENTS:
+            op.execute(
+                f"CREATE TRIGGER trg_{table}_calendar_{suffix} AFTER {event} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION calendar_mark_changed('{table}')"
+            )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        for suffix, _, _ in EVENTS:
+            op.execute(f"DROP TRIGGER IF EXISTS trg_{table}_calendar_{suffix} ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS calendar_mark_changed()")
+    op.execute("DROP FUNCTION IF EXISTS calendar_bump(int[])")
+    op.drop_table('calendar_versions')
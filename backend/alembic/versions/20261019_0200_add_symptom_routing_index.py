@@ -0,0 +1,50 @@
+"""
+add the shared symptom routing index (routing_terms, routing_state)
+
+- routing_terms: term -> department -> documents, keyed (term, department_id) so a query reads only
+  the posting lists of its own terms
+- routing_state: single row (id=1) with the document count, the created_at watermark, the ids indexed
+  inside the overlap window, and the last build/refresh times
+- backend/symptom_routing.py builds it in one worker at a time (advisory try-lock) and every worker
+  reads it, instead of each worker scanning appointments into its own in-memory copy
+
+Revision ID: 20261019_0200
+Revises: 20261019_0190
+Create Date: 2026-10-19
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '20261019_0200'
+down_revision: Union[str, None] = '20261019_0190'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'routing_terms',
+        sa.Column('term', sa.Text(), nullable=False),
+        sa.Column('department_id', sa.Integer(), nullable=False),
+        sa.Column('docs', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('term', 'department_id'),
+    )
+    op.create_table(
+        'routing_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('docs', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('watermark', sa.DateTime(), nullable=True),
+        sa.Column('recent', postgresql.JSONB(astext_type=sa.Text()), nullable=False, server_default=sa.text("'{}'::jsonb")),
+        sa.Column('built_at', sa.DateTime(), nullable=False),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('routing_state')
+    op.drop_table('routing_terms')
@@ -0,0 +1,166 @@
+"""Cold storage for past appointments.
+
+archive_before() packs every month older than the horizon into appointments_archive (one JSON array
+per user per month, TOAST-compressed) and drops that month's partition, so the live `appointments`
+table only holds the recent months the booking path works on. Detached partitions left in the
+archive schema by `manage.py partitions detach` are packed the same way.
+
+History endpoints read the archive only when the requested range starts before the archive
+watermark (first month still live); records come back as ArchivedAppointment, which has the same
+attributes as an Appointment row. The watermark is read on every call (max(month) on its index), so
+web workers see a month the moment the archive job, in another process, drops its partition.
+Reads across all users are bounded: they need a `since`, at most ARCHIVE_LIST_MAX_MONTHS archived
+months back; one user's history is read whole.
+"""
+import os
+import time
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, func, text
+
+from backend.db import engine
+from backend.models import AppointmentArchive
+from backend.partitions import (
+    ARCHIVE_SCHEMA, DEFAULT_PARTITION, PARENT, add_months, list_partitions, month_start, partition_name,
+)
+
+ARCHIVE_HORIZON_MONTHS = int(os.getenv("ARCHIVE_HORIZON_MONTHS", "24"))
+ARCHIVE_LIST_MAX_MONTHS = int(os.getenv("ARCHIVE_LIST_MAX_MONTHS", "3"))
+
+_PACK_SQL = """
+INSERT INTO appointments_archive (user_id, month, n, ids, rows, archived_at)
+SELECT a.user_id, date_trunc('month', a."when")::date, count(*),
+       array_agg(a.id ORDER BY a."when", a.id), jsonb_agg(to_jsonb(a) ORDER BY a."when", a.id), now()
+FROM {src} a
+GROUP BY a.user_id, date_trunc('month', a."when")
+ON CONFLICT (user_id, month) DO UPDATE SET
+    n = appointments_archive.n + EXCLUDED.n,
+    ids = appointments_archive.ids || EXCLUDED.ids,
+    rows = appointments_archive.rows || EXCLUDED.rows,
+    archived_at = EXCLUDED.archived_at
+"""
+
+
+class ArchivedAppointment(NamedTuple):
+    id: int
+    user_id: int
+    doctor_id: int
+    when: datetime
+    stt: Optional[int]
+    need: Optional[str]
+    symptoms: Optional[str]
+    created_at: Optional[datetime]
+    content: Optional[dict]
+
+
+def _dt(v) -> Optional[datetime]:
+    return datetime.fromisoformat(v) if v else None
+
+
+def _unpack(rows: list[dict]) -> list[ArchivedAppointment]:
+    return [
+        ArchivedAppointment(
+            id=r["id"], user_id=r["user_id"], doctor_id=r["doctor_id"], when=_dt(r["when"]), stt=r.get("stt"),
+            need=r.get("need"), symptoms=r.get("symptoms"), created_at=_dt(r.get("created_at")), content=r.get("content"),
+        )
+        for r in rows
+    ]
+
+
+# --------- archival job ---------
+def _pack_month_partition(conn, qualified: str) -> int:
+    conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+    n = conn.execute(text(f"SELECT count(*) FROM {qualified}")).scalar() or 0
+    if n:
+        conn.execute(text(_PACK_SQL.format(src=qualified)))
+    return int(n)
+
+
+def archive_before(cutoff: Optional[date] = None, dry_run: bool = False) -> dict:
+    """Move every appointment before `cutoff` (default: ARCHIVE_HORIZON_MONTHS ago, month-aligned)
+    into appointments_archive. One transaction per month: pack, then drop the month's partition."""
+    cutoff = month_start(cutoff or add_months(datetime.now().date(), -ARCHIVE_HORIZON_MONTHS))
+    t0 = time.perf_counter()
+    months = []
+    limit = partition_name(cutoff)
+    parts = [p["name"] for p in list_partitions() if p["name"] != DEFAULT_PARTITION and p["name"] < limit]
+    with engine.connect() as conn:
+        detached = conn.execute(
+            text("SELECT tablename FROM pg_tables WHERE schemaname = :s AND tablename LIKE :p ORDER BY tablename"),
+            {"s": ARCHIVE_SCHEMA, "p": f"{PARENT}\\_p%"},
+        ).scalars().all()
+    for name, qualified, attached in [(p, f'"{p}"', True) for p in parts] + [(d, f'"{ARCHIVE_SCHEMA}"."{d}"', False) for d in detached]:
+        if dry_run:
+            months.append({"partition": name, "attached": attached})
+            continue
+        with engine.begin() as conn:
+            n = _pack_month_partition(conn, qualified)
+            if attached:
+                conn.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION {qualified}'))
+            conn.execute(text(f"DROP TABLE {qualified}"))
+        months.append({"partition": name, "attached": attached, "archived": n})
+    # out-of-range rows parked in the default partition
+    stray = 0
+    if not dry_run:
+        with engine.begin() as conn:
+            conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            stray = conn.execute(
+                text(f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "when" < :cutoff RETURNING *) ' + _PACK_SQL.format(src="moved")),
+                {"cutoff": datetime.combine(cutoff, datetime.min.time())},
+            ).rowcount or 0
+    return {
+        "cutoff": cutoff.isoformat(),
+        "months": months,
+        "archived": sum(m.get("archived", 0) for m in months),
+        "default_partition_packs": int(stray),
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        "dry_run": dry_run,
+    }
+
+
+# --------- transparent reads ---------
+def watermark(db) -> Optional[date]:
+    """First month that is still live (everything before it is archived); None = nothing archived."""
+    last = db.execute(select(func.max(AppointmentArchive.month))).scalar()
+    return add_months(last, 1) if last else None
+
+
+def needs_archive(db, since: Optional[datetime] = None) -> bool:
+    wm = watermark(db)
+    return wm is not None and (since is None or since.date() < wm)
+
+
+def archived_appointments(db, user_id: Optional[int] = None, since: Optional[datetime] = None) -> list[ArchivedAppointment]:
+    """Archived appointments (optionally of one user, optionally from `since` on); [] without archive reads
+    when the range does not reach back past the watermark. Without a user, only from `since` and at most
+    ARCHIVE_LIST_MAX_MONTHS archived months (400 beyond that); no `since` means live months only."""
+    if user_id is None and since is None:
+        return []
+    wm = watermark(db)
+    if wm is None or (since is not None and since.date() >= wm):
+        return []
+    if user_id is None and month_start(since.date()) < add_months(wm, -ARCHIVE_LIST_MAX_MONTHS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"since may reach at most {ARCHIVE_LIST_MAX_MONTHS} archived months back ({add_months(wm, -ARCHIVE_LIST_MAX_MONTHS)}) without userId",
+        )
+    q = select(AppointmentArchive.rows)
+    if user_id is not None:
+        q = q.where(AppointmentArchive.user_id == int(user_id))
+    if since is not None:
+        q = q.where(AppointmentArchive.month >= month_start(since.date()))
+    out = []
+    for rows in db.execute(q).scalars():
+        out.extend(a for a in _unpack(rows) if since is None or a.when >= since)
+    return out
+
+
+def find_archived(db, appt_id: int) -> Optional[ArchivedAppointment]:
+    rows = db.execute(
+        select(AppointmentArchive.rows).where(AppointmentArchive.ids.contains([int(appt_id)])).limit(1)
+    ).scalar_one_or_none()
+    if not rows:
+        return None
+    return next((a for a in _unpack(rows) if a.id == int(appt_id)), None)
@@ -0,0 +1,183 @@
+"""Single-appointment booking shared by POST /api/book, POST /api/bookings, reschedule and the waitlist.
+
+book_slot() takes the doctor's transaction-scoped advisory lock (the same key the async queue workers
+and the waitlist repack use), validates the slot against the effective windows and the doctor's
+appointments, and inserts the appointment with the next STT of that doctor-day; rooms.assign() then
+gives it a room of the department. Batch writers (the async queue, the waitlist) use the same rules
+through Prefetch, which loads windows, busy slots and STT maxima of many doctors at once, and build
+rows with new_appointment() / external_fields() like the single path.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Date, select, func, text
+
+from backend import schedule_rules, queue_board, rooms, content_snapshot
+from backend.intervals import IntervalBatch, union, subtract, free_slots
+from backend.models import Appointment, Department, Doctor, Hospital, User
+
+SLOT = timedelta(minutes=15)
+
+
+def lock_doctors(db, doctor_ids) -> None:
+    """Serialize slot checks + inserts per doctor until the transaction ends."""
+    ids = sorted({int(d) for d in doctor_ids})
+    if ids:
+        db.execute(text("SELECT count(pg_advisory_xact_lock(hashtext('doctor:' || x))) FROM unnest(CAST(:ids AS int[])) AS x"), {"ids": ids})
+
+
+def check_slot(db, doctor_id: int, start_dt: datetime, end_dt: datetime, exclude_id: Optional[int] = None) -> Optional[str]:
+    """Return None if slot is valid, or an error message string otherwise."""
+    # Effective windows = concrete rows (overrides) + recurring templates for the slot's day(s)
+    wins = schedule_rules.effective_windows(db, [doctor_id], start_dt, end_dt).get(doctor_id, [])
+    # Must be fully covered by an available window and must not overlap an OOO window
+    err = schedule_rules.window_error(wins, start_dt, end_dt)
+    if err:
+        return err
+
+    # Must not overlap existing appointment (15-minute busy)
+    q = select(Appointment.id).where(
+        Appointment.doctor_id == doctor_id,
+        Appointment.when < end_dt,
+        Appointment.when > (start_dt - SLOT),
+    )
+    if exclude_id is not None:
+        q = q.where(Appointment.id != exclude_id)
+    if db.execute(q.limit(1)).scalar_one_or_none():
+        return schedule_rules.SLOT_BUSY
+    return None
+
+
+def next_stt(db, doctor_id: int, day: date) -> int:
+    """STT for the day per doctor: max + 1."""
+    cur = db.scalar(
+        select(func.coalesce(func.max(Appointment.stt), 0))
+        .where(Appointment.doctor_id == doctor_id,
+               Appointment.when >= datetime.combine(day, dtime.min), Appointment.when <= datetime.combine(day, dtime.max))
+    ) or 0
+    return int(cur) + 1
+
+
+def max_stt(db, pairs: list[tuple[int, date]]) -> dict[tuple[int, date], int]:
+    """Current STT maximum per (doctor_id, day) in one query (absent = no appointment yet)."""
+    if not pairs:
+        return {}
+    lo = datetime.combine(min(d for _, d in pairs), dtime.min)
+    hi = datetime.combine(max(d for _, d in pairs), dtime.max)
+    return {
+        (doc_id, day): int(mx)
+        for doc_id, day, mx in db.execute(
+            select(Appointment.doctor_id, func.date(Appointment.when, type_=Date), func.coalesce(func.max(Appointment.stt), 0))
+            .where(Appointment.doctor_id.in_({d for d, _ in pairs}), Appointment.when >= lo, Appointment.when <= hi)
+            .group_by(Appointment.doctor_id, func.date(Appointment.when, type_=Date))
+        )
+    }
+
+
+class Prefetch:
+    """check_slot() / next_stt() for many bookings of many doctors over [lo, hi), from one snapshot:
+    effective windows, busy appointment starts and STT maxima are loaded once, and take() records each
+    accepted slot so later checks of the batch see it. The caller holds lock_doctors() for the doctors."""
+
+    def __init__(self, db, doctor_ids, lo: datetime, hi: datetime):
+        doc_ids = sorted({int(d) for d in doctor_ids})
+        self.wins = schedule_rules.effective_windows(db, doc_ids, lo, hi)
+        self.busy: dict[int, list[datetime]] = defaultdict(list)
+        for doc_id, when in db.execute(
+            select(Appointment.doctor_id, Appointment.when)
+            .where(Appointment.doctor_id.in_(doc_ids), Appointment.when > lo - SLOT, Appointment.when < hi)
+        ):
+            self.busy[doc_id].append(when)
+        days = []
+        d = lo.date()
+        while d <= hi.date():
+            days.append(d)
+            d += timedelta(days=1)
+        self.stt = max_stt(db, [(doc, day) for doc in doc_ids for day in days])
+
+    def check(self, doctor_id: int, start: datetime) -> Optional[str]:
+        end = start + SLOT
+        err = schedule_rules.window_error(self.wins.get(doctor_id, []), start, end)
+        if not err and any(start - SLOT < b < end for b in self.busy.get(doctor_id, ())):
+            err = schedule_rules.SLOT_BUSY
+        return err
+
+    def take(self, doctor_id: int, start: datetime) -> int:
+        """Mark the slot busy and return its STT."""
+        self.busy[doctor_id].append(start)
+        key = (doctor_id, start.date())
+        self.stt[key] = n = self.stt.get(key, 0) + 1
+        return n
+
+
+def external_fields(payload: dict, when: datetime, user: User, hosp: Hospital, dep: Department, doc: Doctor) -> dict:
+    """need / symptoms / compact content snapshot of an external booking (POST /api/bookings, sync or queued)."""
+    room_code = payload.get("room_code")
+    symptoms = ", ".join(payload.get("symptoms") or []) or None
+    snapshot = {k: payload.get(k) for k in ("hospital", "patient_name", "phone_number", "doctor_name",
+                                            "department_name", "room_code", "time_slot")}
+    snapshot["symptoms"] = payload.get("symptoms") or []
+    # stored compact: fields equal to what the linked rows say are rebuilt on read (content_snapshot)
+    derived = content_snapshot.derived_values(when, symptoms, user.name, user.phone, doc.name, dep.name, hosp.name)
+    return {
+        "need": f"Khám tại phòng {room_code}" if room_code else "Đặt lịch khám",
+        "symptoms": symptoms,
+        "content": content_snapshot.compact(snapshot, derived),
+    }
+
+
+def new_appointment(doctor_id: int, when: datetime, stt: int, **fields) -> Appointment:
+    """The row every write path inserts (fields: user or user_id, need, symptoms, content)."""
+    return Appointment(doctor_id=doctor_id, when=when, stt=stt, **fields)
+
+
+def create_appointment(db, doctor_id: int, when: datetime, stt: int, **fields) -> Appointment:
+    """Insert an already validated appointment (fields: user or user_id, need, symptoms, content)."""
+    appt = new_appointment(doctor_id, when, stt, **fields)
+    db.add(appt)
+    db.flush()
+    queue_board.note_booked(db, doctor_id, when, appt.stt, appt.id)
+    return appt
+
+
+def book_slot(db, doctor_id: int, when: datetime, **fields) -> Appointment:
+    """Lock, validate and insert; 409 with the rule's message if the slot is not bookable."""
+    lock_doctors(db, [doctor_id])
+    err = check_slot(db, doctor_id, when, when + SLOT)
+    if err:
+        raise HTTPException(status_code=409, detail=err)
+    appt = create_appointment(db, doctor_id, when, next_stt(db, doctor_id, when.date()), **fields)
+    rooms.assign(db, (doctor_id, when))
+    return appt
+
+
+def free_slot_starts(db, spans: list[tuple[int, datetime, datetime]]) -> dict[int, list[datetime]]:
+    """Bookable 15-minute slot starts inside each (doctor_id, lo, hi) span, keyed by span index, in time
+    order: available windows minus OOO minus appointments for all spans at once (intervals batch ops),
+    each candidate also passing window_error() like check_slot(). 3 queries at most."""
+    if not spans:
+        return {}
+    doc_ids = sorted({d for d, _, _ in spans})
+    lo_all = min(lo for _, lo, _ in spans)
+    hi_all = max(hi for _, _, hi in spans)
+    wins = schedule_rules.effective_windows(db, doc_ids, lo_all, hi_all)
+    busy: dict[int, list[datetime]] = defaultdict(list)
+    for doc_id, when in db.execute(
+        select(Appointment.doctor_id, Appointment.when)
+        .where(Appointment.doctor_id.in_(doc_ids), Appointment.when > lo_all - SLOT, Appointment.when < hi_all)
+    ):
+        busy[doc_id].append(when)
+    av: dict[int, list] = {}
+    blocked: dict[int, list] = {}
+    for k, (doc_id, lo, hi) in enumerate(spans):
+        ws = wins.get(doc_id, [])
+        av[k] = [(max(w["start"], lo), min(w["end"], hi)) for w in ws if w["kind"] == "available" and w["end"] > lo and w["start"] < hi]
+        blocked[k] = [(w["start"], w["end"]) for w in ws if w["kind"] == "ooo"] + [(b, b + SLOT) for b in busy[doc_id]]
+    free = subtract(union(IntervalBatch.from_pairs(av)), union(IntervalBatch.from_pairs(blocked)))
+    out: dict[int, list[datetime]] = {}
+    for k, slots in free_slots(free, SLOT).to_pairs().items():
+        ws = wins.get(spans[k][0], [])
+        out[k] = [s for s, e in slots if schedule_rules.window_error(ws, s, e) is None]
+    return out
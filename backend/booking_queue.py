@@ -0,0 +1,262 @@
+"""Asynchronous booking ingest: POST /api/bookings?async=1 enqueues, workers book in micro-batches.
+
+The queue is the booking_queue table. enqueue() is one INSERT in the request, and the ticket is
+the row id. Workers claim up to BOOKING_QUEUE_BATCH queued rows with FOR UPDATE SKIP LOCKED and
+book them in the same transaction that marks them done/failed: a crashed worker simply releases its
+rows. One batch resolves hospitals/departments/doctors/users with one query per level, loads the
+effective windows, busy appointments and STT maxima of every doctor involved at once, then
+checks the items in ticket order (earlier tickets win a contested slot) with booking.Prefetch, the
+batched form of the checks book_slot() runs; rows and snapshots come from the same booking helpers as
+the synchronous POST /api/bookings. Rooms are planned once per department-day of the batch
+(rooms.plan_department_days()).
+
+If a batch raises, its items are retried one by one in savepoints, so one bad item does not block
+the rest. An item that keeps raising is marked failed after BOOKING_QUEUE_MAX_ATTEMPTS.
+Back-pressure: enqueue is refused (503) once BOOKING_QUEUE_MAX_DEPTH items are waiting.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, func, text
+
+from backend import queue_board, booking, rooms
+from backend.db import get_session
+from backend.models import BookingQueueItem, Department, Doctor, Hospital, User
+
+QUEUE_WORKERS = int(os.getenv("BOOKING_QUEUE_WORKERS", "2"))
+QUEUE_BATCH = int(os.getenv("BOOKING_QUEUE_BATCH", "50"))
+QUEUE_MAX_DEPTH = int(os.getenv("BOOKING_QUEUE_MAX_DEPTH", "10000"))
+QUEUE_POLL_MS = float(os.getenv("BOOKING_QUEUE_POLL_MS", "200"))
+MAX_ATTEMPTS = int(os.getenv("BOOKING_QUEUE_MAX_ATTEMPTS", "3"))
+SLOT = booking.SLOT
+
+_wake = threading.Event()
+_depth = {"at": 0.0, "value": 0}
+
+
+# --------- producer side ---------
+def depth(max_age_s: float = 1.0) -> int:
+    """Queued items; cached per worker for max_age_s so enqueue stays one statement under load."""
+    now = time.monotonic()
+    if now - _depth["at"] > max_age_s:
+        with get_session() as db:
+            _depth.update(at=now, value=int(db.scalar(select(func.count()).where(BookingQueueItem.status == "queued")) or 0))
+    return _depth["value"]
+
+
+def enqueue(db, payload: dict) -> BookingQueueItem:
+    item = BookingQueueItem(status="queued", payload=payload, attempts=0)
+    db.add(item)
+    db.flush()
+    _depth["value"] += 1
+    _wake.set()
+    return item
+
+
+def ticket_status(db, ticket: int) -> Optional[dict]:
+    it = db.get(BookingQueueItem, ticket)
+    if not it:
+        return None
+    out = {
+        "ticket": it.id,
+        "status": it.status,
+        "attempts": it.attempts,
+        "created_at": it.created_at.isoformat() if it.created_at else None,
+        "finished_at": it.finished_at.isoformat() if it.finished_at else None,
+    }
+    if it.status == "queued":
+        out["position"] = int(db.scalar(
+            select(func.count()).where(BookingQueueItem.status == "queued", BookingQueueItem.id < it.id)
+        ) or 0)
+    if it.result is not None:
+        out["result"] = it.result
+    if it.error:
+        out["error"] = it.error
+    return out
+
+
+# --------- batch processing ---------
+def _lock_names(db, kind: str, names) -> None:
+    # serialize creation of the same entity across workers (names are not unique in the schema)
+    keys = sorted({f"{kind}:{n}" for n in names})
+    if keys:
+        db.execute(text("SELECT count(pg_advisory_xact_lock(hashtext(x))) FROM unnest(CAST(:keys AS text[])) AS x"), {"keys": keys})
+
+
+def _resolve_entities(db, items: list[dict]) -> None:
+    """Fill hosp/dep/doc/user on every parsed item: one SELECT per level plus inserts for the missing."""
+    hnames = {it["hospital"].lower() for it in items}
+    _lock_names(db, "hospital", hnames)
+    hosps: dict[str, Hospital] = {}
+    for h in db.execute(select(Hospital).where(func.lower(Hospital.name).in_(hnames)).order_by(Hospital.id)).scalars():
+        hosps.setdefault(h.name.lower(), h)
+    for it in items:
+        key = it["hospital"].lower()
+        if key not in hosps:
+            hosps[key] = Hospital(name=it["hospital"])
+            db.add(hosps[key])
+    db.flush()
+
+    dkeys = {(hosps[it["hospital"].lower()].id, it["department_name"].lower()) for it in items}
+    deps: dict[tuple[int, str], Department] = {}
+    for d in db.execute(select(Department).where(
+        Department.hospital_id.in_({h for h, _ in dkeys}), func.lower(Department.name).in_({n for _, n in dkeys}),
+    )).scalars():
+        deps.setdefault((d.hospital_id, d.name.lower()), d)
+    for it in items:
+        key = (hosps[it["hospital"].lower()].id, it["department_name"].lower())
+        if key not in deps:
+            deps[key] = Department(name=it["department_name"], hospital_id=key[0])
+            db.add(deps[key])
+    db.flush()
+
+    for it in items:
+        it["hosp"] = hosps[it["hospital"].lower()]
+        it["dep"] = deps[(it["hosp"].id, it["department_name"].lower())]
+    _lock_names(db, "doctor", {f"{it['dep'].id}:{it['doctor_name'].lower()}" for it in items})
+    dockeys = {(it["dep"].id, it["doctor_name"].lower()) for it in items}
+    docs: dict[tuple[int, str], Doctor] = {}
+    for d in db.execute(select(Doctor).where(
+        Doctor.department_id.in_({dep for dep, _ in dockeys}), func.lower(Doctor.name).in_({n for _, n in dockeys}),
+    ).order_by(Doctor.id)).scalars():
+        docs.setdefault((d.department_id, d.name.lower()), d)
+    for it in items:
+        key = (it["dep"].id, it["doctor_name"].lower())
+        if key not in docs:
+            docs[key] = Doctor(name=it["doctor_name"], department_id=key[0])
+            db.add(docs[key])
+
+    phones = {it["phone_number"] for it in items}
+    users = {u.phone: u for u in db.execute(select(User).where(User.phone.in_(phones))).scalars()}
+    for it in items:
+        if it["phone_number"] not in users:
+            users[it["phone_number"]] = User(name=it["patient_name"], phone=it["phone_number"])
+            db.add(users[it["phone_number"]])
+    db.flush()
+    for it in items:
+        it["doc"] = docs[(it["dep"].id, it["doctor_name"].lower())]
+        it["user"] = users[it["phone_number"]]
+
+
+def _parse(q: BookingQueueItem) -> dict:
+    p = dict(q.payload)
+    for k in ("hospital", "department_name", "doctor_name"):
+        p[k] = str(p[k]).strip()
+    p["when"] = datetime.fromisoformat(p["time_slot"])
+    p["queue_item"] = q
+    return p
+
+
+def _finish(q: BookingQueueItem, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+    q.status, q.result, q.error, q.finished_at = status, result, error, datetime.utcnow()
+
+
+def _book(db, queue_items: list[BookingQueueItem]) -> dict:
+    items = []
+    for q in queue_items:
+        try:
+            items.append(_parse(q))
+        except Exception as e:
+            _finish(q, "failed", error=f"invalid payload: {e}")
+    if not items:
+        return {"done": 0, "failed": len(queue_items)}
+    _resolve_entities(db, items)
+
+    doc_ids = sorted({it["doc"].id for it in items})
+    # serialize batches touching the same doctors (the prefetched busy/STT snapshot must stay valid)
+    booking.lock_doctors(db, doc_ids)
+    pre = booking.Prefetch(db, doc_ids, min(it["when"] for it in items), max(it["when"] for it in items) + SLOT)
+
+    done = 0
+    booked = []
+    for it in sorted(items, key=lambda i: i["queue_item"].id):
+        doc, start = it["doc"], it["when"]
+        err = pre.check(doc.id, start)
+        if err:
+            _finish(it["queue_item"], "failed", error=err)
+            continue
+        fields = booking.external_fields(it, start, it["user"], it["hosp"], it["dep"], doc)
+        appt = booking.new_appointment(doc.id, start, pre.take(doc.id, start), user_id=it["user"].id, **fields)
+        db.add(appt)
+        booked.append((it, appt, fields["need"], fields["symptoms"]))
+    db.flush()  # one multi-row INSERT; queue_board is noted after the savepoint (_note_booked)
+    for it, appt, need, symptoms in booked:
+        u, hosp, dep, doc = it["user"], it["hosp"], it["dep"], it["doc"]
+        # same shape as the synchronous POST /api/bookings response, plus the appointment id
+        _finish(it["queue_item"], "done", result={
+            "userId": str(u.id), "name": u.name, "phone": u.phone, "need": need, "symptoms": symptoms,
+            "hospitalId": str(hosp.id), "hospitalName": hosp.name, "hospitalAddress": None,
+            "department": dep.name, "doctorId": str(doc.id), "doctorName": doc.name,
+            "time": it["time_slot"], "appointmentId": appt.id, "stt": appt.stt,
+        })
+        done += 1
+    # one room plan per department-day of the batch, not per appointment
+    rooms.plan_department_days(db, {(it["dep"].id, appt.when.date()) for it, appt, _, _ in booked})
+    return {"done": done, "failed": len(queue_items) - done}
+
+
+def _note_booked(db, items: list[BookingQueueItem]) -> None:
+    for q in items:
+        if q.status == "done" and q.result:
+            r = q.result
+            queue_board.note_booked(db, int(r["doctorId"]), datetime.fromisoformat(r["time"]), r["stt"], r["appointmentId"])
+
+
+def process_batch(limit: int = QUEUE_BATCH) -> dict:
+    """Claim and book up to `limit` queued items in one transaction. {'claimed', 'done', 'failed'}."""
+    with get_session() as db:
+        claimed = db.execute(
+            select(BookingQueueItem).where(BookingQueueItem.status == "queued")
+            .order_by(BookingQueueItem.id).limit(limit).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not claimed:
+            return {"claimed": 0, "done": 0, "failed": 0}
+        try:
+            with db.begin_nested():
+                res = _book(db, claimed)
+            _note_booked(db, claimed)
+        except Exception as batch_err:
+            print(f"[booking-queue] batch of {len(claimed)} failed ({batch_err}); retrying items one by one")
+            res = {"done": 0, "failed": 0}
+            for q in claimed:
+                try:
+                    with db.begin_nested():
+                        r = _book(db, [q])
+                    _note_booked(db, [q])
+                    res["done"] += r["done"]
+                    res["failed"] += r["failed"]
+                except Exception as e:
+                    q.attempts += 1
+                    if q.attempts >= MAX_ATTEMPTS:
+                        _finish(q, "failed", error=f"internal error: {e}")
+                        res["failed"] += 1
+        _depth["value"] = max(0, _depth["value"] - res["done"] - res["failed"])
+        return {"claimed": len(claimed), **res}
+
+
+# --------- workers ---------
+def _worker_loop(stop: threading.Event) -> None:
+    idle = QUEUE_POLL_MS / 1000.0
+    while not stop.is_set():
+        try:
+            res = process_batch()
+        except Exception as e:
+            print(f"[booking-queue] worker error: {e}")
+            res = {"claimed": 0}
+        if res["claimed"] < QUEUE_BATCH:
+            # queue drained (or nothing claimable): sleep until the poll interval or a local enqueue
+            _wake.wait(idle)
+            _wake.clear()
+
+
+def start_workers(n: Optional[int] = None) -> Optional[threading.Event]:
+    n = QUEUE_WORKERS if n is None else n
+    if n <= 0:
+        return None
+    stop = threading.Event()
+    for i in range(n):
+        threading.Thread(target=_worker_loop, args=(stop,), name=f"booking-queue-{i}", daemon=True).start()
+    return stop
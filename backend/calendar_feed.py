@@ -0,0 +1,228 @@
+"""iCalendar (.ics) feeds of a doctor's or a department's windows and appointments.
+
+Calendar apps poll a feed every few minutes and almost always find nothing new, so the common path
+is one query and a 304:
+- calendar_versions (migration 20261019_0190) holds a per-doctor counter bumped by triggers on
+  appointments, schedule_windows and schedule_rules; the strong ETag is built from the versions of
+  the feed's doctors plus today's date (the feed range moves at midnight), Last-Modified is the
+  latest changed_at (or local midnight, whichever is later);
+- If-None-Match (or, without it, If-Modified-Since) that still matches gets 304 with no rendering;
+- a rendered feed is kept as bytes per (kind, id), up to ICS_CACHE_MAX feeds (LRU), and reused
+  while its ETag is current, so any write to one of its doctors invalidates it, in every worker;
+- a miss streams the feed: doctors in chunks of ICS_DOCTOR_CHUNK, effective windows (templates
+  included) per chunk and appointments from a range query read with yield_per.
+The range is ICS_PAST_DAYS back to ICS_FUTURE_DAYS ahead. Times are floating local times with
+X-WR-TIMEZONE, as everywhere else in the API. The feed URLs are unauthenticated and use sequential
+ids, so events carry no patient data at all (no name, phone, need or symptoms): an appointment is
+its time, STT and room.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, time as dtime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterator, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from backend import booking, schedule_rules
+from backend.db import get_session
+from backend.models import Appointment, CalendarVersion, Department, Doctor, Room
+
+ICS_PAST_DAYS = int(os.getenv("ICS_PAST_DAYS", "30"))
+ICS_FUTURE_DAYS = int(os.getenv("ICS_FUTURE_DAYS", "90"))
+ICS_CACHE_MAX = int(os.getenv("ICS_CACHE_MAX", "512"))
+ICS_DOCTOR_CHUNK = int(os.getenv("ICS_DOCTOR_CHUNK", "50"))
+ICS_UID_DOMAIN = os.getenv("ICS_UID_DOMAIN", "booking.local")
+ICS_TIMEZONE = os.getenv("ICS_TIMEZONE", "Asia/Ho_Chi_Minh")
+
+_LOCK = threading.Lock()
+_CACHE: "OrderedDict[tuple[str, int], tuple[str, bytes]]" = OrderedDict()  # (kind, id) -> (etag, body)
+_STATS = {"not_modified": 0, "cache_hits": 0, "renders": 0}
+
+
+class Feed:
+    """Validators of a feed as of now; cached() has the bytes while they are current, stream() renders."""
+
+    def __init__(self, kind: str, scope_id: int, name: str, doctors: list[tuple[int, str]], etag: str, last_modified: datetime, now: datetime):
+        self.kind, self.scope_id, self.name = kind, scope_id, name
+        self.doctors = doctors  # (id, name), sorted by id
+        self.etag, self.last_modified, self.now = etag, last_modified, now  # last_modified: aware UTC, whole seconds
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": format_datetime(self.last_modified, usegmt=True),
+            "Cache-Control": "private, max-age=60",
+        }
+
+    def not_modified(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        if if_none_match is not None:
+            hit = any(t.strip() in (self.etag, "*") for t in if_none_match.split(","))
+        elif if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            hit = since.tzinfo is not None and since >= self.last_modified
+        else:
+            hit = False
+        if hit:
+            _count("not_modified")
+        return hit
+
+    def cached(self) -> Optional[bytes]:
+        with _LOCK:
+            hit = _CACHE.get((self.kind, self.scope_id))
+            if hit is None or hit[0] != self.etag:
+                return None
+            _CACHE.move_to_end((self.kind, self.scope_id))
+            _STATS["cache_hits"] += 1
+            return hit[1]
+
+    def stream(self) -> Iterator[bytes]:
+        """Render in chunks; the complete body is cached once the last chunk is out."""
+        parts = []
+        for chunk in _render(self):
+            parts.append(chunk)
+            yield chunk
+        with _LOCK:
+            _CACHE[(self.kind, self.scope_id)] = (self.etag, b"".join(parts))
+            _CACHE.move_to_end((self.kind, self.scope_id))
+            while len(_CACHE) > ICS_CACHE_MAX:
+                _CACHE.popitem(last=False)
+            _STATS["renders"] += 1
+
+
+def _count(key: str) -> None:
+    with _LOCK:
+        _STATS[key] += 1
+
+
+def stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "cached": len(_CACHE)}
+
+
+def reset() -> None:
+    """Drop the rendered feeds (after reset-and-seed)."""
+    with _LOCK:
+        _CACHE.clear()
+
+
+def _local_midnight_utc(now: datetime) -> datetime:
+    # naive local "now" -> the UTC instant of today's local midnight
+    return datetime.utcnow() - (now - datetime.combine(now.date(), dtime.min))
+
+
+def feed(db, kind: str, scope_id: int, now: Optional[datetime] = None) -> Feed:
+    """Current validators of a doctor or department feed (one query); 404 for an unknown id."""
+    now = now or datetime.now()
+    if kind == "doctor":
+        where, title = Doctor.id == scope_id, Doctor.name
+    else:
+        where, title = Doctor.department_id == scope_id, Department.name
+    rows = db.execute(
+        select(Doctor.id, Doctor.name, title, func.coalesce(CalendarVersion.version, 0), CalendarVersion.changed_at)
+        .join(Department, Doctor.department_id == Department.id)
+        .outerjoin(CalendarVersion, CalendarVersion.doctor_id == Doctor.id)
+        .where(where)
+        .order_by(Doctor.id)
+    ).all()
+    if rows:
+        name = rows[0][2]
+    else:
+        dep = db.get(Department, scope_id) if kind == "department" else None
+        if dep is None:
+            raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+        name = dep.name  # no doctors: an empty feed
+    versions = ",".join(f"{r[0]}:{r[3]}" for r in rows)
+    digest = hashlib.sha1(versions.encode()).hexdigest()[:16]
+    etag = f'"{kind[:3]}{scope_id}-{now.date():%Y%m%d}-{digest}"'
+    last = max([r[4] for r in rows if r[4] is not None] + [_local_midnight_utc(now)])
+    last = last.replace(microsecond=0, tzinfo=timezone.utc)  # HTTP dates have second precision
+    return Feed(kind, scope_id, name, [(r[0], r[1]) for r in rows], etag, last, now)
+
+
+def _esc(s: str) -> str:
+    return s.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """Fold to 75-octet lines (RFC 5545 3.1) without splitting a UTF-8 character."""
+    raw = line.encode()
+    if len(raw) <= 75:
+        return line + "\r\n"
+    out, cur, size = [], [], 0
+    for ch in line:
+        n = len(ch.encode())
+        if size + n > (75 if not out else 74):
+            out.append("".join(cur))
+            cur, size = [], 0
+        cur.append(ch)
+        size += n
+    out.append("".join(cur))
+    return "\r\n ".join(out) + "\r\n"
+
+
+def _dt(d: datetime) -> str:
+    return d.strftime("%Y%m%dT%H%M%S")
+
+
+def _event(uid: str, stamp: str, start: datetime, end: datetime, summary: str, transparent: bool = False,
+           location: Optional[str] = None) -> str:
+    lines = ["BEGIN:VEVENT", f"UID:{uid}@{ICS_UID_DOMAIN}", f"DTSTAMP:{stamp}", f"DTSTART:{_dt(start)}", f"DTEND:{_dt(end)}",
+             f"SUMMARY:{_esc(summary)}", f"TRANSP:{'TRANSPARENT' if transparent else 'OPAQUE'}"]
+    if location:
+        lines.append(f"LOCATION:{_esc(location)}")
+    lines.append("END:VEVENT")
+    return "".join(_fold(x) for x in lines)
+
+
+def _render(f: Feed) -> Iterator[bytes]:
+    lo = datetime.combine(f.now.date() - timedelta(days=ICS_PAST_DAYS), dtime.min)
+    hi = datetime.combine(f.now.date() + timedelta(days=ICS_FUTURE_DAYS + 1), dtime.min)
+    stamp = f.last_modified.strftime("%Y%m%dT%H%M%SZ")
+    prefix = f.kind == "department"  # several doctors: name them in each event
+    yield "".join(_fold(x) for x in [
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//booking//calendar feed//VI", "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH", f"X-WR-CALNAME:{_esc(f.name)}", f"X-WR-TIMEZONE:{ICS_TIMEZONE}",
+    ]).encode()
+    with get_session() as db:
+        for i in range(0, len(f.doctors), ICS_DOCTOR_CHUNK):
+            chunk = f.doctors[i:i + ICS_DOCTOR_CHUNK]
+            names = dict(chunk)
+            wins = schedule_rules.effective_windows(db, list(names), lo, hi)
+            buf = []
+            for doc_id, _ in chunk:
+                who = f"{names[doc_id]}: " if prefix else ""
+                for w in sorted(wins.get(doc_id, ()), key=lambda w: w["start"]):
+                    if w["kind"] not in ("available", "ooo") or w["end"] <= w["start"]:
+                        continue
+                    off = w["kind"] == "ooo"
+                    buf.append(_event(f"w{w['id']}-d{doc_id}", stamp, w["start"], w["end"],
+                                      who + ("Nghỉ" if off else "Lịch làm việc"), transparent=not off))
+            if buf:
+                yield "".join(buf).encode()
+            buf = []
+            rows = db.execute(
+                select(Appointment.id, Appointment.doctor_id, Appointment.when, Appointment.stt, Room.code)
+                .outerjoin(Room, Appointment.room_id == Room.id)
+                .where(Appointment.doctor_id.in_(list(names)), Appointment.when >= lo, Appointment.when < hi)
+                .order_by(Appointment.doctor_id, Appointment.when)
+                .execution_options(yield_per=500)
+            )
+            for appt_id, doc_id, when, stt, room in rows:
+                who = f"{names[doc_id]}: " if prefix else ""
+                summary = f"{who}STT {stt}" + (f" · {room}" if room else "")
+                buf.append(_event(f"a{appt_id}", stamp, when, when + booking.SLOT, summary, location=room))
+                if len(buf) >= 500:
+                    yield "".join(buf).encode()
+                    buf = []
+            if buf:
+                yield "".join(buf).encode()
+    yield b"END:VCALENDAR\r\n"
+
@@ -0,0 +1,105 @@
+"""Single-flight for idempotent GET handlers.
+
+Concurrent identical requests (same handler, same query parameters) share one execution: the first
+runs the handler and renders the JSON once; requests arriving while it runs wait for it and get the
+same response bytes. Nothing is cached after the leader finishes, so data is never older than an
+in-flight query.
+
+Followers wait at most COALESCE_WAIT_S seconds (they hold a threadpool thread meanwhile); after
+that they run the handler themselves, so one slow leader cannot tie up the whole pool.
+
+An explicit X-Primary-Until (read-your-writes) is part of the key, so such requests only share with
+requests holding the same value. So is this worker's write epoch, which note_write() bumps after
+every write (main._mark_written): a request arriving after a write never joins a flight that started
+before it, so it cannot get a pre-write result.
+"""
+import functools
+import os
+import threading
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+
+class _Flight:
+    __slots__ = ("done", "body", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body: bytes | None = None
+        self.error: BaseException | None = None
+        self.followers = 0
+
+
+COALESCE_WAIT_S = float(os.getenv("COALESCE_WAIT_S", "2"))
+
+_LOCK = threading.Lock()
+_IN_FLIGHT: dict[tuple, _Flight] = {}
+_WRITE_EPOCH = [0]
+# name -> {"leaders": n, "followers": n, "timeouts": n}
+_STATS: dict[str, dict[str, int]] = {}
+
+
+def _key(name: str, kwargs: dict, epoch: int) -> tuple:
+    return (name, epoch, tuple(sorted((k, repr(v)) for k, v in kwargs.items() if v is not None)))
+
+
+def note_write() -> None:
+    """A write committed in this worker: later requests start new flights."""
+    with _LOCK:
+        _WRITE_EPOCH[0] += 1
+
+
+def single_flight(name: str) -> Callable:
+    """Decorate a sync GET handler (below @app.get). Handlers must be called with keyword args (FastAPI does)."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(**kwargs):
+            with _LOCK:
+                key = _key(name, kwargs, _WRITE_EPOCH[0])
+                st = _STATS.setdefault(name, {"leaders": 0, "followers": 0, "timeouts": 0})
+                flight = _IN_FLIGHT.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _IN_FLIGHT[key] = _Flight()
+                    st["leaders"] += 1
+                else:
+                    flight.followers += 1
+                    st["followers"] += 1
+            if leader:
+                try:
+                    result = fn(**kwargs)
+                    flight.body = result.body if isinstance(result, Response) else JSONResponse(jsonable_encoder(result)).body
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with _LOCK:
+                        _IN_FLIGHT.pop(key, None)
+                    flight.done.set()
+            else:
+                if not flight.done.wait(COALESCE_WAIT_S):
+                    with _LOCK:
+                        st["followers"] -= 1
+                        st["timeouts"] += 1
+                    return fn(**kwargs)
+                if flight.error is not None:
+                    raise flight.error
+            return Response(content=flight.body, media_type="application/json")
+        return wrapper
+    return deco
+
+
+def coalescing_stats(reset: bool = False) -> dict:
+    """Per handler: executions (leaders), requests served by another's execution (followers), followers
+    that gave up waiting and ran the handler themselves (timeouts) and coalescing ratio = followers / requests."""
+    with _LOCK:
+        out = {}
+        for name, st in _STATS.items():
+            total = st["leaders"] + st["followers"] + st["timeouts"]
+            out[name] = {**st, "requests": total, "ratio": round(st["followers"] / total, 4) if total else 0.0}
+        if reset:
+            _STATS.clear()
+        out["_in_flight"] = len(_IN_FLIGHT)
+    return out
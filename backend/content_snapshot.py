@@ -0,0 +1,159 @@
+"""Compact storage of Appointment.content, the external booking snapshot.
+
+The snapshot's hospital / department_name / doctor_name / patient_name / phone_number / time_slot /
+symptoms repeat what the appointment's foreign keys and columns already hold. compact() drops every
+field whose value equals the one derived from those rows and lists the dropped keys under "_d";
+expand() puts them back on read, so the API keeps returning the full snapshot. A value that differs
+(other spelling or casing, a different time format) stays in the delta, so expand(compact(x)) == x when
+written; later, derived fields follow the current names of the linked rows.
+- the ingest paths and the admin content endpoint store the compact form;
+- compact_existing() rewrites older rows in id batches (`manage.py compact-content`), and
+  storage_stats() gives the before/after table size, content size and list latency;
+- GIN (content jsonb_path_ops) serves containment filters such as content @> '{"room_code": "P101"}'.
+"""
+import json
+import statistics
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, select, text, update
+
+from backend.db import get_session
+from backend.models import Appointment, Department, Doctor, Hospital, User
+
+MARK = "_d"
+DERIVED = ("hospital", "department_name", "doctor_name", "patient_name", "phone_number", "time_slot", "symptoms")
+
+
+def derived_values(when: datetime, symptoms: Optional[str], user_name: Optional[str], user_phone: Optional[str],
+                   doctor_name: Optional[str], department_name: Optional[str], hospital_name: Optional[str]) -> dict:
+    """Snapshot fields as they follow from the appointment and its linked rows."""
+    return {
+        "hospital": hospital_name,
+        "department_name": department_name,
+        "doctor_name": doctor_name,
+        "patient_name": user_name,
+        "phone_number": user_phone,
+        "time_slot": when.isoformat(),
+        "symptoms": symptoms.split(", ") if symptoms else [],  # Appointment.symptoms = ", ".join(list)
+    }
+
+
+def compact(content, derived: dict):
+    """Content without the fields equal to their derived value (listed under "_d"); other values pass through."""
+    if not isinstance(content, dict) or MARK in content:
+        return content
+    out, dropped = {}, []
+    for k, v in content.items():
+        if k in DERIVED and derived.get(k) == v:
+            dropped.append(k)
+        else:
+            out[k] = v
+    if dropped:
+        out[MARK] = dropped
+    return out
+
+
+def expand(content, derived: dict):
+    if not isinstance(content, dict) or MARK not in content:
+        return content
+    out = {k: derived.get(k) for k in content[MARK]}
+    out.update((k, v) for k, v in content.items() if k != MARK)
+    return out
+
+
+def expanded(db, appts: Iterable) -> dict[int, dict]:
+    """Full content per appointment id (Appointment rows or archived ones); two queries when any row is compact."""
+    appts = list(appts)
+    out = {a.id: a.content or {} for a in appts}
+    compacted = [a for a in appts if isinstance(a.content, dict) and MARK in a.content]
+    if not compacted:
+        return out
+    docs = {
+        r[0]: r[1:] for r in db.execute(
+            select(Doctor.id, Doctor.name, Department.name, Hospital.name)
+            .join(Department, Doctor.department_id == Department.id)
+            .join(Hospital, Department.hospital_id == Hospital.id)
+            .where(Doctor.id.in_({a.doctor_id for a in compacted}))
+        )
+    }
+    users = {r[0]: r[1:] for r in db.execute(select(User.id, User.name, User.phone).where(User.id.in_({a.user_id for a in compacted})))}
+    for a in compacted:
+        doc_name, dep_name, hosp_name = docs.get(a.doctor_id, (None, None, None))
+        user_name, user_phone = users.get(a.user_id, (None, None))
+        out[a.id] = expand(a.content, derived_values(a.when, a.symptoms, user_name, user_phone, doc_name, dep_name, hosp_name))
+    return out
+
+
+def compact_existing(batch: int = 2000, dry_run: bool = False) -> dict:
+    """Rewrite not-yet-compacted content in id order, one transaction per batch."""
+    t0 = time.perf_counter()
+    appts = Appointment.__table__
+    stmt = (
+        update(appts)
+        .where(appts.c.id == bindparam("b_id"), appts.c.when == bindparam("b_when"))  # "when" prunes to one partition
+        .values(content=bindparam("b_content"))
+    )
+    last_id, scanned, changed, bytes_before, bytes_after = 0, 0, 0, 0, 0
+    while True:
+        with get_session() as db:
+            rows = db.execute(
+                select(Appointment.id, Appointment.when, Appointment.symptoms, Appointment.content,
+                       User.name, User.phone, Doctor.name, Department.name, Hospital.name)
+                .join(User, Appointment.user_id == User.id)
+                .join(Doctor, Appointment.doctor_id == Doctor.id)
+                .join(Department, Doctor.department_id == Department.id)
+                .join(Hospital, Department.hospital_id == Hospital.id)
+                .where(Appointment.id > last_id, Appointment.content.isnot(None), ~Appointment.content.has_key(MARK))
+                .order_by(Appointment.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                break
+            params = []
+            for appt_id, when, symptoms, content, *names in rows:
+                new = compact(content, derived_values(when, symptoms, *names))
+                bytes_before += len(json.dumps(content, ensure_ascii=False).encode())
+                bytes_after += len(json.dumps(new, ensure_ascii=False).encode())
+                if new != content:
+                    params.append({"b_id": appt_id, "b_when": when, "b_content": new})
+            if params and not dry_run:
+                db.execute(stmt, params)
+            scanned += len(rows)
+            changed += len(params)
+            last_id = rows[-1][0]
+    return {
+        "scanned": scanned,
+        "compacted": changed,
+        "dryRun": dry_run,
+        "jsonBytesBefore": bytes_before,
+        "jsonBytesAfter": bytes_after,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
+
+
+def storage_stats(list_limit: int = 500, runs: int = 5) -> dict:
+    """Size of appointments (all partitions, TOAST and indexes included), content column size, and the
+    median time to fetch the newest `list_limit` rows with content (the GET /api/bookings query)."""
+    with get_session() as db:
+        total = db.execute(text(
+            "SELECT coalesce(sum(pg_total_relation_size(inhrelid)), 0) FROM pg_inherits WHERE inhparent = 'appointments'::regclass"
+        )).scalar()
+        n, avg_bytes, sum_bytes = db.execute(text(
+            "SELECT count(*), coalesce(avg(pg_column_size(content)), 0), coalesce(sum(pg_column_size(content)), 0) "
+            "FROM appointments WHERE content IS NOT NULL"
+        )).one()
+        q = text("SELECT id, created_at, stt, content FROM appointments ORDER BY created_at DESC, id DESC LIMIT :n")
+        lat = []
+        for _ in range(runs):
+            s0 = time.perf_counter()
+            db.execute(q, {"n": list_limit}).all()
+            lat.append((time.perf_counter() - s0) * 1000.0)
+    return {
+        "tableBytes": int(total),
+        "rowsWithContent": int(n),
+        "contentBytesAvg": round(float(avg_bytes), 1),
+        "contentBytesTotal": int(sum_bytes),
+        "listMs": round(statistics.median(lat), 2),
+    }
@@ -1,8 +1,19 @@
 from contextlib import contextmanager
 from urllib.parse import quote_plus
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+import hashlib
+import json
 import os
+import tempfile
+import threading
+import time
+import weakref
 
 def _build_database_url() -> str:
     # Prefer full DATABASE_URL (kèm ?sslmode=require từ Neon)
@@ -22,14 +33,169 @@ def _build_database_url() -> str:
 
 DATABASE_URL = _build_database_url()
 
-# Neon + Pooler: giữ pool nhỏ và pre_ping
-engine = create_engine(
-    DATABASE_URL.replace("postgresql://", "postgresql+psycopg2://"),
-    pool_pre_ping=True,
-    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
-    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
-    pool_recycle=1800,
-)
+# --------- Pool strategy (config decision, see /api/_debug/pool and `manage.py pool-bench`) ---------
+#   DB_POOLER=transaction   opt-in for a Neon "-pooler" host / PgBouncer in transaction mode (never
+#                           auto-detected): NullPool by default and no server-side prepared statements
+#   DB_POOL_MODE=queue|lifo|null   queue = FIFO QueuePool (default), lifo = QueuePool(use_lifo=True)
+#   DB_POOL_PRE_PING=0|1    pre-ping costs one round-trip per checkout and is on whenever connections
+#                           are reused (off by default only for NullPool, whose connections are new)
+POOL_MODES = ("queue", "lifo", "null")
+
+
+POOL_SLOW_WAIT_MS = float(os.getenv("DB_POOL_SLOW_WAIT_MS", "10"))
+
+
+class PoolStats:
+    """Counters fed by pool/engine events; cheap enough to stay on in production."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.pre_ping_failures = 0
+            self.disconnect_errors = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+            self.slow_waits = 0  # > POOL_SLOW_WAIT_MS
+            self.overflow_checkouts = 0
+            self.peak_checked_out = 0
+
+    def record_wait(self, ms: float, pool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_ms_total += ms
+            if ms > self.wait_ms_max:
+                self.wait_ms_max = ms
+            if ms > POOL_SLOW_WAIT_MS:
+                self.slow_waits += 1
+            checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+            if checked_out > self.peak_checked_out:
+                self.peak_checked_out = checked_out
+            if hasattr(pool, "size") and checked_out > pool.size():
+                self.overflow_checkouts += 1
+
+    def bump(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            out = {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "pre_ping_failures": self.pre_ping_failures,
+                "disconnect_errors": self.disconnect_errors,
+                "wait_ms_total": round(self.wait_ms_total, 2),
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 2),
+                "slow_waits": self.slow_waits,
+                "overflow_checkouts": self.overflow_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+            }
+        if pool is not None:
+            out["pool"] = {"class": type(pool).__mro__[1].__name__, "status": pool.status()}
+            if hasattr(pool, "checkedout"):
+                out["pool"].update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return out
+
+
+_POOL_STATS: "weakref.WeakKeyDictionary[Engine, PoolStats]" = weakref.WeakKeyDictionary()
+
+
+def _timed_pool_class(base: type, stats: PoolStats) -> type:
+    # _do_get is where a caller blocks for a free connection (or opens a new one)
+    def _do_get(self):
+        t0 = perf_counter()
+        rec = base._do_get(self)
+        stats.record_wait((perf_counter() - t0) * 1000.0, self)
+        return rec
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    return default if v is None or v.strip() == "" else v.strip().lower() in ("1", "true", "yes", "on")
+
+
+def pool_config(url: str) -> dict:
+    """Resolve pool settings from env; transaction-pooler mode (explicit DB_POOLER) changes the defaults."""
+    pooler = os.getenv("DB_POOLER", "").strip().lower() or "session"
+    txn = pooler == "transaction"
+    mode = os.getenv("DB_POOL_MODE", "null" if txn else "queue").strip().lower()
+    if mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE must be one of {POOL_MODES}")
+    return {
+        "pooler": pooler,
+        "mode": mode,
+        "pre_ping": _env_bool("DB_POOL_PRE_PING", mode != "null"),
+        "size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
+
+def make_engine(url: str, **overrides) -> Engine:
+    """Create an instrumented engine; `overrides` replace keys of pool_config() (used by pool-bench)."""
+    url = url.replace("postgresql://", "postgresql+psycopg2://")
+    cfg = {**pool_config(url), **overrides}
+    stats = PoolStats(cfg)
+    kwargs: dict = {"pool_pre_ping": cfg["pre_ping"]}
+    if cfg["mode"] == "null":
+        kwargs["poolclass"] = _timed_pool_class(NullPool, stats)
+    else:
+        kwargs.update(
+            poolclass=_timed_pool_class(QueuePool, stats),
+            pool_size=cfg["size"],
+            max_overflow=cfg["max_overflow"],
+            pool_recycle=cfg["recycle"],
+            pool_timeout=cfg["timeout"],
+            pool_use_lifo=cfg["mode"] == "lifo",
+        )
+    if cfg["pooler"] == "transaction" and make_url(url).drivername.endswith("+psycopg"):
+        # psycopg 3 prepares server-side after 5 executions; a transaction pooler breaks that.
+        # psycopg2 never uses server-side prepared statements.
+        kwargs["connect_args"] = {"prepare_threshold": None}
+    eng = create_engine(url, **kwargs)
+
+    @event.listens_for(eng.pool, "connect")
+    def _on_connect(dbapi_conn, rec):
+        stats.bump("connects")
+
+    @event.listens_for(eng.pool, "invalidate")
+    def _on_invalidate(dbapi_conn, rec, exc):
+        stats.bump("invalidations")
+
+    @event.listens_for(eng, "handle_error")
+    def _on_error(ctx):
+        if getattr(ctx, "is_pre_ping", False):
+            stats.bump("pre_ping_failures")
+        elif ctx.is_disconnect:
+            stats.bump("disconnect_errors")
+
+    _POOL_STATS[eng] = stats
+    return eng
+
+
+def pool_stats(eng: Engine | None = None, reset: bool = False) -> dict:
+    eng = eng or engine
+    stats = _POOL_STATS.get(eng)
+    if stats is None:
+        return {"config": None}
+    out = {"config": stats.config, **stats.snapshot(eng.pool)}
+    if reset:
+        stats.reset()
+    return out
+
+
+engine = make_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
@@ -44,3 +210,195 @@ def get_session():
         raise
     finally:
         db.close()
+
+
+# --------- Read replicas ---------
+#   DATABASE_REPLICA_URLS=url1,url2   read-only routes round-robin over these (same pool settings as primary)
+#   REPLICA_MAX_LAG_SECONDS=5         a replica lagging more than this (or failing the check) is skipped
+#   REPLICA_LAG_CHECK_SECONDS=2       lag is re-measured at most this often per replica
+#   REPLICA_STICKY_SECONDS=5          read-your-writes: after a write, reads for the same key go to primary;
+#                                     writes also return X-Primary-Until so clients on other workers can echo it
+REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# On a standby: 0 when everything received is replayed, else age of the last replayed transaction.
+# On a non-standby (e.g. a second local instance used for testing) both functions return NULL -> 0.
+_LAG_SQL = text(
+    "SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)"
+)
+
+
+class ReplicaRouter:
+    def __init__(self, urls: list[str]):
+        self.engines = [make_engine(u) for u in urls]
+        self.sessions = [sessionmaker(bind=e, autocommit=False, autoflush=False) for e in self.engines]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._lag: dict[int, tuple[float, Optional[float]]] = {}  # idx -> (checked_at, lag or None if down)
+        self._sticky: dict[str, float] = {}  # key -> unix time until which reads go to primary
+        self.routed = {"replica": 0, "primary_sticky": 0, "primary_lag": 0}
+
+    def mark_write(self, *keys: str) -> float:
+        until = time.time() + REPLICA_STICKY_SECONDS
+        with self._lock:
+            if len(self._sticky) > 10000:
+                now = time.time()
+                self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+            for k in keys:
+                self._sticky[k] = until
+        return until
+
+    def _is_sticky(self, keys: tuple[str, ...], primary_until: Optional[float]) -> bool:
+        now = time.time()
+        if primary_until and primary_until > now:
+            return True
+        return any(self._sticky.get(k, 0) > now for k in keys)
+
+    def lag(self, idx: int) -> Optional[float]:
+        now = time.monotonic()
+        checked = self._lag.get(idx)
+        if checked and now - checked[0] < REPLICA_LAG_CHECK_SECONDS:
+            return checked[1]
+        try:
+            with self.engines[idx].connect() as conn:
+                lag: Optional[float] = float(conn.execute(_LAG_SQL).scalar() or 0)
+        except Exception:
+            lag = None
+        self._lag[idx] = (now, lag)
+        return lag
+
+    def pick(self, keys: tuple[str, ...], primary_until: Optional[float]):
+        """sessionmaker of a healthy replica, or None for primary."""
+        if self._is_sticky(keys, primary_until):
+            self._count("primary_sticky")
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.engines)
+        for i in range(len(self.engines)):
+            idx = (start + i) % len(self.engines)
+            lag = self.lag(idx)
+            if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS:
+                self._count("replica")
+                return self.sessions[idx]
+        self._count("primary_lag")
+        return None
+
+    def _count(self, k: str) -> None:
+        with self._lock:
+            self.routed[k] += 1
+
+    def stats(self) -> dict:
+        return {
+            "routed": dict(self.routed),
+            "replicas": [
+                {"url": e.url.render_as_string(hide_password=True), "lag_s": (self._lag.get(i) or (0, None))[1], **pool_stats(e)}
+                for i, e in enumerate(self.engines)
+            ],
+        }
+
+
+replica_router: Optional[ReplicaRouter] = ReplicaRouter(REPLICA_URLS) if REPLICA_URLS else None
+
+
+@contextmanager
+def get_read_session(*sticky_keys: str, primary_until: Optional[float] = None):
+    """Session for read-only routes: a replica unless the caller just wrote (sticky) or replicas lag."""
+    maker = replica_router.pick(sticky_keys, primary_until) if replica_router else None
+    if maker is None:
+        with get_session() as db:
+            yield db
+        return
+    db = maker()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+def mark_written(*sticky_keys: str) -> Optional[float]:
+    """Record a write for read-your-writes routing; returns the X-Primary-Until value (None w/o replicas)."""
+    return replica_router.mark_write(*sticky_keys) if replica_router else None
+
+
+# --------- Schema version check (startup) ---------
+ALEMBIC_DIR = Path(__file__).parent / "alembic"
+
+
+def expected_schema_revision() -> str | None:
+    """Alembic head shipped with this code (parsed from alembic/versions, no DB access)."""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    cfg = Config()
+    cfg.set_main_option("script_location", str(ALEMBIC_DIR))
+    return ScriptDirectory.from_config(cfg).get_current_head()
+
+
+def current_schema_revision() -> str | None:
+    """Revision recorded in the database's alembic_version table."""
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+
+def check_schema_version() -> dict:
+    """Compare DB revision with code head. A single-row read: no DDL, no table scans."""
+    expected = expected_schema_revision()
+    try:
+        current = current_schema_revision()
+        error = None
+    except Exception as e:
+        current = None
+        error = str(e).splitlines()[0] if str(e) else type(e).__name__
+    return {"ok": current == expected and error is None, "current": current, "expected": expected, "error": error}
+
+
+# --------- Cached reflection ---------
+# Reflection only changes with the schema revision, so it is cached in-process and in a small JSON
+# file keyed by (DB URL, alembic revision) that sibling workers / fresh instances on the host reuse.
+REFLECTION_CACHE_DIR = os.getenv("REFLECTION_CACHE_DIR", tempfile.gettempdir())
+_REFLECTION: dict[str, list[str]] | None = None
+
+
+def _reflection_cache_file(revision: str) -> Path:
+    key = hashlib.sha1(f"{engine.url.render_as_string(hide_password=True)}|{revision}".encode()).hexdigest()[:16]
+    return Path(REFLECTION_CACHE_DIR) / f"medly_reflection_{key}.json"
+
+
+def reflected_schema() -> dict[str, list[str]]:
+    """{table: [column, ...]} for the current schema, reflected at most once per revision."""
+    global _REFLECTION
+    if _REFLECTION is not None:
+        return _REFLECTION
+    try:
+        revision = current_schema_revision()
+    except Exception:
+        revision = None
+    path = _reflection_cache_file(revision) if revision else None
+    if path is not None and path.exists():
+        try:
+            _REFLECTION = json.loads(path.read_text(encoding="utf-8"))
+            return _REFLECTION
+        except Exception:
+            pass
+    # One catalog query instead of Inspector.get_columns() per table
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() ORDER BY table_name, ordinal_position"
+        )).all()
+    out: dict[str, list[str]] = {}
+    for t, c in rows:
+        out.setdefault(t, []).append(c)
+    _REFLECTION = out
+    if path is not None:
+        try:
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(out), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception:
+            pass
+    return out
@@ -0,0 +1,123 @@
+"""Earliest free slots across hospitals for a department name (GET /api/search/earliest).
+
+- Department names resolve through an in-process index of folded names (textnorm.fold) -> departments,
+  rebuilt at most every EARLIEST_INDEX_TTL_S seconds; exact folded match first, else every department
+  whose folded name contains the query.
+- Each candidate doctor gets a lazy slot iterator; heapq.merge does the k-way merge and the search stops
+  at `limit` results. Slots are computed per chunk of days for all doctors at once
+  (booking.free_slot_starts: windows minus OOO minus appointments). Chunks double in length
+  (1, 2, 4, ... days) up to EARLIEST_HORIZON_DAYS, and a chunk is only loaded once the merge has
+  emitted everything before it, so the cost follows how far the answer is, not the schedule size.
+"""
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, time as dtime, timedelta
+from itertools import islice
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from backend import booking, textnorm
+from backend.models import Department, Doctor, Hospital
+
+EARLIEST_HORIZON_DAYS = int(os.getenv("EARLIEST_HORIZON_DAYS", "60"))
+EARLIEST_INDEX_TTL_S = float(os.getenv("EARLIEST_INDEX_TTL_S", "300"))
+
+_INDEX_LOCK = threading.Lock()
+_INDEX: dict = {"at": 0.0, "names": {}}  # folded name -> [department id]
+
+
+def _name_index(db) -> dict[str, list[int]]:
+    with _INDEX_LOCK:
+        if time.monotonic() - _INDEX["at"] < EARLIEST_INDEX_TTL_S:
+            return _INDEX["names"]
+    names: dict[str, list[int]] = defaultdict(list)
+    for dep_id, name in db.execute(select(Department.id, Department.name)):
+        names[textnorm.fold(name)].append(dep_id)
+    with _INDEX_LOCK:
+        _INDEX.update(at=time.monotonic(), names=dict(names))
+    return _INDEX["names"]
+
+
+def reset() -> None:
+    """Forget the name index (after reset-and-seed); the next search rebuilds it."""
+    with _INDEX_LOCK:
+        _INDEX.update(at=0.0, names={})
+
+
+def resolve_departments(db, name: str) -> list[int]:
+    q = textnorm.fold(name)
+    if not q:
+        return []
+    names = _name_index(db)
+    if q in names:
+        return list(names[q])
+    return [d for n, ids in names.items() if q in n for d in ids]
+
+
+class _Chunks:
+    """Free slots of every candidate doctor, loaded one day-range at a time and shared by the iterators."""
+
+    def __init__(self, db, doctor_ids: list[int], start: datetime, horizon: datetime):
+        self.db, self.doctor_ids, self.start, self.horizon = db, doctor_ids, start, horizon
+        self.bounds: list[datetime] = [start]
+        self.slots: list[dict[int, list[datetime]]] = []
+
+    def get(self, i: int) -> Optional[dict[int, list[datetime]]]:
+        while len(self.slots) <= i:
+            lo = self.bounds[-1]
+            if lo >= self.horizon:
+                return None
+            days = 2 ** len(self.slots)
+            hi = min(datetime.combine(lo.date() + timedelta(days=days), dtime.min), self.horizon)
+            found = booking.free_slot_starts(self.db, [(d, lo, hi) for d in self.doctor_ids])
+            self.slots.append({self.doctor_ids[k]: v for k, v in found.items()})
+            self.bounds.append(hi)
+        return self.slots[i]
+
+    def end(self, i: int) -> datetime:
+        return self.bounds[i + 1]
+
+
+def _doctor_slots(chunks: _Chunks, doctor_id: int, per_doctor: Optional[int]) -> Iterator[tuple[datetime, int, bool]]:
+    """(start, doctor, is_slot). After each chunk a (chunk end, doctor, False) marker is yielded, so the
+    next chunk is only loaded when the merge reaches that point."""
+    n, i = 0, 0
+    while (chunk := chunks.get(i)) is not None:
+        for s in chunk.get(doctor_id, ()):
+            yield s, doctor_id, True
+            n += 1
+            if per_doctor and n >= per_doctor:
+                return
+        yield chunks.end(i), doctor_id, False
+        i += 1
+
+
+def search(db, department: str, start: datetime, limit: int = 10, per_doctor: Optional[int] = None) -> dict:
+    t0 = time.perf_counter()
+    dep_ids = resolve_departments(db, department)
+    rows = db.execute(
+        select(Doctor.id, Doctor.name, Department.id, Department.name, Hospital.id, Hospital.name)
+        .join(Department, Doctor.department_id == Department.id)
+        .join(Hospital, Department.hospital_id == Hospital.id)
+        .where(Department.id.in_(dep_ids))
+        .order_by(Doctor.id)
+    ).all() if dep_ids else []
+    info = {r[0]: r for r in rows}
+    chunks = _Chunks(db, list(info), start, start + timedelta(days=EARLIEST_HORIZON_DAYS))
+    merged = heapq.merge(*(_doctor_slots(chunks, d, per_doctor) for d in info))
+    results = []
+    for when, doc_id, _ in islice((x for x in merged if x[2]), limit):
+        _, doc_name, dep_id, dep_name, hosp_id, hosp_name = info[doc_id]
+        results.append({"when": when.isoformat(), "doctorId": doc_id, "doctorName": doc_name, "departmentId": dep_id,
+                        "department": dep_name, "hospitalId": hosp_id, "hospitalName": hosp_name})
+    return {
+        "results": results,
+        "departments": len(dep_ids),
+        "doctors": len(info),
+        "scannedUntil": chunks.bounds[-1].isoformat(),
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
@@ -0,0 +1,143 @@
+"""Idempotency-Key support for the booking POSTs.
+
+A request carrying `Idempotency-Key` is fingerprinted (sha1 of the route + canonical JSON body).
+begin() answers a retry from the in-process LRU, or from one primary-key lookup in
+idempotency_keys, by raising Replayed (turned into the stored response by the app's exception
+handler). Validation and STT logic do not run again.
+
+The result is saved by Idempotent.save() inside the booking's own transaction, so the appointment
+and its stored response commit together. If two requests with the same key race, the second blocks
+on the primary key until the first commits, then rolls back its own appointment and replays the
+first response. Only successful responses are stored: a 409 retried later may succeed.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import event, select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.db import get_session
+from backend.models import IdempotencyKey
+
+IDEMPOTENCY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+IDEMPOTENCY_LRU_SIZE = int(os.getenv("IDEMPOTENCY_LRU_SIZE", "10000"))
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+class Replayed(Exception):
+    def __init__(self, status_code: int, body: dict):
+        super().__init__(f"replayed {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = size
+        self._d: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, k):
+        with self._lock:
+            v = self._d.get(k)
+            if v is None:
+                return None
+            if v[0] <= datetime.utcnow():
+                del self._d[k]
+                return None
+            self._d.move_to_end(k)
+            return v
+
+    def put(self, k, v) -> None:
+        with self._lock:
+            self._d[k] = v
+            self._d.move_to_end(k)
+            while len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._d.clear()
+
+
+# (scope, key) -> (expires_at, fingerprint, status_code, body)
+_CACHE = _LRU(IDEMPOTENCY_LRU_SIZE)
+
+
+def fingerprint(scope: str, body: dict) -> str:
+    return hashlib.sha1(f"{scope}\n{json.dumps(body, sort_keys=True, default=str)}".encode("utf-8")).hexdigest()
+
+
+def _check(entry, fp: str):
+    _, stored_fp, status_code, body = entry
+    if stored_fp != fp:
+        raise HTTPException(status_code=422, detail="Idempotency-Key đã được dùng cho một yêu cầu khác")
+    raise Replayed(status_code, body)
+
+
+class Idempotent:
+    def __init__(self, scope: str, key: Optional[str], fp: Optional[str]):
+        self.scope, self.key, self.fp = scope, key, fp
+
+    def save(self, db, body: dict, status_code: int = 200) -> None:
+        """Store the response in the caller's transaction. Raises Replayed if a concurrent request
+        with the same key committed first (the caller's transaction then rolls back)."""
+        if not self.key:
+            return
+        expires = datetime.utcnow() + IDEMPOTENCY_TTL
+        stmt = pg_insert(IdempotencyKey).values(
+            scope=self.scope, key=self.key, fingerprint=self.fp, status_code=status_code, response=body, expires_at=expires,
+        )
+        # an expired row for the same key is simply replaced
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+            set_={"fingerprint": stmt.excluded.fingerprint, "status_code": stmt.excluded.status_code,
+                  "response": stmt.excluded.response, "expires_at": stmt.excluded.expires_at},
+            where=IdempotencyKey.expires_at <= datetime.utcnow(),
+        ).returning(IdempotencyKey.key)
+        if db.execute(stmt).first() is None:
+            row = db.execute(
+                select(IdempotencyKey.expires_at, IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+                .where(IdempotencyKey.scope == self.scope, IdempotencyKey.key == self.key)
+            ).first()
+            _check(tuple(row), self.fp)
+        entry = (expires, self.fp, status_code, body)
+        event.listen(db, "after_commit", lambda _s: _CACHE.put((self.scope, self.key), entry), once=True)
+
+
+def begin(scope: str, key: Optional[str], body: dict) -> Idempotent:
+    """Raise Replayed if this key already has a stored result (LRU first, then one PK lookup)."""
+    if not key:
+        return Idempotent(scope, None, None)
+    key = key.strip()[:255]
+    fp = fingerprint(scope, body)
+    entry = _CACHE.get((scope, key))
+    if entry is None:
+        with get_session() as db:
+            row = db.execute(
+                select(IdempotencyKey.expires_at, IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+                .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.expires_at > datetime.utcnow())
+            ).first()
+        if row is not None:
+            entry = tuple(row)
+            _CACHE.put((scope, key), entry)
+    if entry is not None:
+        _check(entry, fp)
+    return Idempotent(scope, key, fp)
+
+
+def reset() -> None:
+    """Forget this worker's cached responses (after reset-and-seed truncates idempotency_keys)."""
+    _CACHE.clear()
+
+
+def purge_expired() -> int:
+    with get_session() as db:
+        r = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow()))
+        return int(r.rowcount or 0)
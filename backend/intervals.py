@@ -0,0 +1,135 @@
+"""Vectorized interval sets for schedule math (windows, OOO, busy blocks).
+
+An IntervalBatch holds half-open intervals for many keys at once (usually doctor ids, or
+(doctor, day) codes) as three parallel int64 arrays: key, start, end. Times are microseconds since
+1970-01-01 on naive local datetimes, so round-tripping datetimes is exact.
+
+union / subtract / intersect run as one sweep over the sorted boundary events of both operands:
+the coverage counters of A and B at each distinct (key, time) decide whether the following segment
+is in the result, and adjacent result segments are merged (touching intervals merge, like
+main._merge_intervals). Cost is O(n log n) for n intervals in total, independent of the number of keys.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+_I64 = np.int64
+US_PER_MINUTE = 60_000_000
+
+
+def to_us(dts: Iterable[datetime]) -> np.ndarray:
+    return np.array(list(dts), dtype="datetime64[us]").astype(_I64)
+
+
+def from_us(values: np.ndarray) -> list[datetime]:
+    return values.astype("datetime64[us]").astype(object).tolist()
+
+
+def td_us(td: timedelta) -> int:
+    return (td.days * 86_400 + td.seconds) * 1_000_000 + td.microseconds
+
+
+class IntervalBatch(NamedTuple):
+    keys: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "IntervalBatch":
+        z = np.empty(0, dtype=_I64)
+        return cls(z, z.copy(), z.copy())
+
+    @classmethod
+    def from_arrays(cls, keys, starts, ends) -> "IntervalBatch":
+        return cls(np.asarray(keys, dtype=_I64), np.asarray(starts, dtype=_I64), np.asarray(ends, dtype=_I64))
+
+    @classmethod
+    def from_pairs(cls, by_key: dict[int, list[tuple[datetime, datetime]]]) -> "IntervalBatch":
+        keys: list[int] = []
+        starts: list[datetime] = []
+        ends: list[datetime] = []
+        for k, pairs in by_key.items():
+            for s, e in pairs:
+                keys.append(k)
+                starts.append(s)
+                ends.append(e)
+        if not keys:
+            return cls.empty()
+        return cls(np.array(keys, dtype=_I64), to_us(starts), to_us(ends))
+
+    def to_pairs(self) -> dict[int, list[tuple[datetime, datetime]]]:
+        out: dict[int, list[tuple[datetime, datetime]]] = {}
+        for k, s, e in zip(self.keys.tolist(), from_us(self.starts), from_us(self.ends)):
+            out.setdefault(k, []).append((s, e))
+        return out
+
+    def __len__(self) -> int:
+        return int(self.keys.shape[0])
+
+
+def _sweep(a: IntervalBatch, b: IntervalBatch, op) -> IntervalBatch:
+    a_ok = a.starts < a.ends
+    b_ok = b.starts < b.ends
+    ak, as_, ae = a.keys[a_ok], a.starts[a_ok], a.ends[a_ok]
+    bk, bs, be = b.keys[b_ok], b.starts[b_ok], b.ends[b_ok]
+    na, nb = len(ak), len(bk)
+    if na + nb == 0:
+        return IntervalBatch.empty()
+    keys = np.concatenate((ak, ak, bk, bk))
+    times = np.concatenate((as_, ae, bs, be))
+    da = np.concatenate((np.ones(na, _I64), -np.ones(na, _I64), np.zeros(2 * nb, _I64)))
+    db = np.concatenate((np.zeros(2 * na, _I64), np.ones(nb, _I64), -np.ones(nb, _I64)))
+    order = np.lexsort((times, keys))
+    keys, times = keys[order], times[order]
+    # every key's events sum to zero, so one global cumsum gives per-key coverage
+    ca = np.cumsum(da[order])
+    cb = np.cumsum(db[order])
+    # state after the last event at each distinct (key, time)
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = (keys[1:] != keys[:-1]) | (times[1:] != times[:-1])
+    uk, ut = keys[last], times[last]
+    inside = op(ca[last] > 0, cb[last] > 0)
+    seg = inside[:-1] & (uk[1:] == uk[:-1])
+    sk, ss, se = uk[:-1][seg], ut[:-1][seg], ut[1:][seg]
+    if len(sk) == 0:
+        return IntervalBatch.empty()
+    # merge touching segments of the same key
+    run = np.ones(len(sk), dtype=bool)
+    run[1:] = (sk[1:] != sk[:-1]) | (ss[1:] != se[:-1])
+    idx = np.flatnonzero(run)
+    end_idx = np.append(idx[1:] - 1, len(sk) - 1)
+    return IntervalBatch(sk[idx], ss[idx], se[end_idx])
+
+
+def union(a: IntervalBatch, b: Optional[IntervalBatch] = None) -> IntervalBatch:
+    """Merged union per key (with b=None: normalize a)."""
+    return _sweep(a, b if b is not None else IntervalBatch.empty(), np.logical_or)
+
+
+def subtract(a: IntervalBatch, b: IntervalBatch) -> IntervalBatch:
+    """a minus b per key."""
+    return _sweep(a, b, lambda x, y: x & ~y)
+
+
+def intersect(a: IntervalBatch, b: IntervalBatch) -> IntervalBatch:
+    return _sweep(a, b, np.logical_and)
+
+
+def free_slots(free: IntervalBatch, length: timedelta, step: Optional[timedelta] = None, align: bool = True) -> IntervalBatch:
+    """Every [t, t+length) inside `free` (which must be normalized), t advancing by `step` (default
+    `length`). With align=True, t sits on the step grid (e.g. :00/:15/:30/:45 for 15 minutes)."""
+    ln = td_us(length)
+    st = td_us(step) if step else ln
+    if len(free) == 0 or ln <= 0 or st <= 0:
+        return IntervalBatch.empty()
+    first = -(-free.starts // st) * st if align else free.starts
+    counts = np.where(free.ends - first >= ln, (free.ends - first - ln) // st + 1, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return IntervalBatch.empty()
+    rep = np.repeat(np.arange(len(free)), counts)
+    # position of each slot inside its interval: 0, 1, 2, ... restarting per interval
+    offs = np.arange(total, dtype=_I64) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts = first[rep] + offs * st
+    return IntervalBatch(free.keys[rep], starts, starts + ln)
@@ -1,23 +1,31 @@
-from fastapi import FastAPI, Query, HTTPException
+from time import perf_counter
+_IMPORT_T0 = perf_counter()  # module import time is reported as the first startup stage
+from fastapi import FastAPI, Query, HTTPException, Header, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta, date, time as dtime
-from sqlalchemy import select, and_, func, or_, delete, update, inspect
-from backend.db import get_session, engine
-from backend.timing_instrumentation import TimingMiddleware, attach_sqlalchemy_instrumentation
-from backend.models import Base, Hospital, Department, Doctor, User, Appointment, Conversation, ScheduleWindow, Room
-from backend import seed_loader
+from sqlalchemy import select, func, delete, or_
+from backend.db import get_session, get_read_session, mark_written, replica_router, engine, check_schema_version, reflected_schema, pool_stats
+from backend.timing_instrumentation import TimingMiddleware, attach_sqlalchemy_instrumentation, startup_stage, STARTUP_STAGES, shed_counts
+from backend.admission import AdmissionMiddleware, ADMISSION
+from backend.coalesce import single_flight, coalescing_stats, note_write
+from backend.models import Hospital, Department, Doctor, User, Appointment, ScheduleWindow, Room, Conversation, ScheduleRule, WaitlistEntry
+from backend.intervals import IntervalBatch, union as iv_union, subtract as iv_subtract
+from backend import schedule_rules, schedule_audit, window_batch, archive, idempotency, booking, booking_queue, queue_board, waitlist, earliest, symptom_routing, user_search, utilization, content_snapshot, rooms, calendar_feed
 import os
 import json
-from pathlib import Path
 from sqlalchemy import inspect as sa_inspect
 from sqlalchemy import text as sa_text
 from sqlalchemy.exc import ProgrammingError
 from collections import defaultdict
 
 app = FastAPI(title="Medly API")
+# shed excess writes (429/503) before a handler or DB session is involved; innermost, so timing + CORS still apply
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(TimingMiddleware)
 _HAS_HOSPITAL_ADDRESS: Optional[bool] = None
 
@@ -25,8 +33,7 @@ def has_hospital_address() -> bool:
     global _HAS_HOSPITAL_ADDRESS
     if _HAS_HOSPITAL_ADDRESS is None:
         try:
-            cols = sa_inspect(engine).get_columns("hospitals")
-            _HAS_HOSPITAL_ADDRESS = any(c.get("name") == "address" for c in cols)
+            _HAS_HOSPITAL_ADDRESS = "address" in reflected_schema().get("hospitals", [])
         except Exception:
             _HAS_HOSPITAL_ADDRESS = False
     return bool(_HAS_HOSPITAL_ADDRESS)
@@ -36,17 +43,38 @@ app.add_middleware(
     allow_origins=["*"],
     allow_credentials=False,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Primary-Until", idempotency.REPLAY_HEADER],
 )
 
 
+@app.exception_handler(idempotency.Replayed)
+async def idempotent_replay(request: Request, exc: idempotency.Replayed):
+    # retried POST with a known Idempotency-Key: answer with the stored response
+    return JSONResponse(exc.body, status_code=exc.status_code, headers={idempotency.REPLAY_HEADER: "true"})
+
+
 # --------- Utilities ---------
+def _mark_written(response: Response, *sticky_keys: str) -> None:
+    """Read-your-writes: route this worker's reads for these keys to primary for a few seconds and
+    hand the deadline to the client (X-Primary-Until) so reads served by other workers honor it too.
+    Coalesced GETs arriving from now on start a new flight instead of joining one from before the write."""
+    note_write()
+    until = mark_written(*sticky_keys)
+    if until is not None:
+        response.headers["X-Primary-Until"] = f"{until:.3f}"
+
+
+def _sticky(prefix: str, value) -> tuple[str, ...]:
+    return (f"{prefix}:{value}",) if value not in (None, "") else ()
+
+
 def ensure_seed():
     """Seed data from exactly two JSON files once tables exist."""
     try:
-        insp = inspect(engine)
+        tables = reflected_schema()
         required = ["hospitals", "departments", "doctors", "rooms"]
-        missing = [t for t in required if not insp.has_table(t)]
+        missing = [t for t in required if t not in tables]
         if missing:
             print("Skipping seed: missing tables -> " + ", ".join(missing))
             return
@@ -59,47 +87,55 @@ def ensure_seed():
     # Startup now only ensures seed from the two JSON files; demo data seeding removed.
 
 
+# Startup only verifies the schema revision; DDL/backfills live in Alembic revisions and
+# seeding is an explicit command (python -m backend.manage seed).
+#   STARTUP_MODE=verify (default) | strict (refuse to boot on mismatch) | skip
+#   SEED_ON_STARTUP=1 restores the old seed-on-boot behaviour for local dev
+STARTUP_MODE = os.getenv("STARTUP_MODE", "verify").lower()
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
 @app.on_event("startup")
 def startup():
+    STARTUP_STAGES.append(("import backend.main", (_IMPORT_DONE - _IMPORT_T0) * 1000.0))
     # Attach SQLAlchemy query timing & slow query logging
     try:
-        attach_sqlalchemy_instrumentation(engine)
+        with startup_stage("attach_sqlalchemy_instrumentation"):
+            attach_sqlalchemy_instrumentation(engine)
     except Exception as e:
         print(f"[timing] attach_sqlalchemy_instrumentation failed: {e}")
-    # Best-effort unique index to prevent exact duplicate windows
-    try:
-        with engine.begin() as conn:
-            conn.execute(sa_text(
-                """
-                CREATE UNIQUE INDEX IF NOT EXISTS ux_windows_doc_start_end_kind
-                ON schedule_windows (doctor_id, start, "end", kind)
-                """
-            ))
-            # Ensure appointments.stt exists (best-effort) and backfill if missing
-            conn.execute(sa_text(
-                """
-                ALTER TABLE appointments ADD COLUMN IF NOT EXISTS stt integer
-                """
-            ))
-            # Backfill stt for existing rows where null: daily sequence per doctor by appointment time
-            try:
-                conn.execute(sa_text(
-                    """
-                    WITH ranked AS (
-                        SELECT id, ROW_NUMBER() OVER (PARTITION BY doctor_id, DATE("when") ORDER BY "when" ASC, id ASC) AS rn
-                        FROM appointments
-                    )
-                    UPDATE appointments a
-                    SET stt = r.rn
-                    FROM ranked r
-                    WHERE a.id = r.id AND a.stt IS NULL
-                    """
-                ))
-            except Exception:
-                pass
-    except Exception as e:
-        print(f"[startup] unique index create skipped: {e}")
-    ensure_seed()
+    if STARTUP_MODE != "skip":
+        with startup_stage("check_schema_version"):
+            res = check_schema_version()
+        if not res["ok"]:
+            msg = (
+                f"[startup] schema revision mismatch: db={res['current']} code={res['expected']}"
+                + (f" ({res['error']})" if res["error"] else "")
+                + " -> run `alembic upgrade head`"
+            )
+            if STARTUP_MODE == "strict":
+                raise RuntimeError(msg)
+            print(msg)
+        else:
+            # creates next months' appointment partitions in the background (PARTITION_MAINTAIN_HOURS=0: off)
+            from backend import partitions
+            with startup_stage("start_partition_maintenance"):
+                partitions.start_maintenance()
+            # drains POST /api/bookings?async=1 (BOOKING_QUEUE_WORKERS=0: run `manage.py booking-worker` instead)
+            with startup_stage("start_booking_queue_workers"):
+                booking_queue.start_workers()
+            # symptom -> department routing index (ROUTING_REFRESH_S=0: built on first query only)
+            with startup_stage("start_symptom_routing"):
+                symptom_routing.start_refresh()
+            # recomputes utilization facts of changed doctor-days (UTIL_REFRESH_S=0: `manage.py utilization-refresh`)
+            with startup_stage("start_utilization_refresh"):
+                utilization.start_refresh()
+    if _env_flag("SEED_ON_STARTUP"):
+        with startup_stage("ensure_seed"):
+            ensure_seed()
 
 # Basic logging config for timing loggers
 logging.basicConfig(level=logging.INFO)
@@ -152,6 +188,21 @@ def create_or_fetch_user(payload: UserPayload):
         return {"id": str(new_u.id), "phone": new_u.phone, "name": new_u.name}
 
 
+@app.get("/api/users/search")
+def search_users(
+    q: str = Query(..., min_length=1),
+    hospitalId: Optional[int] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    x_primary_until: Optional[float] = Header(None),
+):
+    """
+    Front-desk lookup: digits match phone/CCCD prefixes, text matches name word prefixes without
+    accents ("nguyen an" -> "Nguyễn Văn An"). Pass `nextCursor` back as `cursor` for the next page.
+    """
+    with get_read_session(primary_until=x_primary_until) as db:
+        return user_search.search(db, q, hospital_id=hospitalId, limit=limit, cursor=cursor)
+
 
 
 def base_day_slots(day: date) -> list[tuple[datetime, datetime]]:
@@ -183,19 +234,15 @@ class BookingSummary(BaseModel):
 
 
 @app.post("/api/book")
-def book(summary: BookingSummary):
+def book(summary: BookingSummary, response: Response, idempotency_key: Optional[str] = Header(None)):
     """Create booking with validation.
     Duration is 15 minutes. Must be within an available window, not overlap OOO, and not overlap existing busy.
+    A retry with the same Idempotency-Key gets the stored response without re-validating.
     """
+    idem = idempotency.begin("book", idempotency_key, summary.model_dump())
     start_dt = datetime.fromisoformat(summary.time)
-    end_dt = start_dt + timedelta(minutes=15)
     doctor_id = int(summary.doctorId)
     with get_session() as db:
-        # Validate constraints
-        err = _check_slot_constraints(db, doctor_id, start_dt, end_dt)
-        if err:
-            raise HTTPException(status_code=409, detail=err)
-
         # Upsert or create user
         u = db.get(User, int(summary.userId))
         if not u:
@@ -203,19 +250,12 @@ def book(summary: BookingSummary):
             u = User(id=int(summary.userId), name=summary.name, phone=summary.phone)
             db.add(u)
             db.flush()
-        # Compute STT for the day per doctor
-        day_start = datetime.combine(start_dt.date(), dtime.min)
-        day_end = datetime.combine(start_dt.date(), dtime.max)
-        cur_stt = db.scalar(
-            select(func.coalesce(func.max(Appointment.stt), 0))
-            .where(Appointment.doctor_id == doctor_id, Appointment.when >= day_start, Appointment.when <= day_end)
-        ) or 0
-        # Create appointment with stt = max + 1
-        appt = Appointment(user=u, doctor_id=doctor_id, when=start_dt, stt=int(cur_stt) + 1, need=summary.need, symptoms=summary.symptoms or None)
-        db.add(appt)
-        db.flush()
+        # Validate constraints, create appointment with stt = max + 1 for the day per doctor
+        booking.book_slot(db, doctor_id, start_dt, user=u, need=summary.need, symptoms=summary.symptoms or None)
         summary.time = start_dt.isoformat()
-        return summary
+        idem.save(db, summary.model_dump())
+    _mark_written(response, f"user:{summary.userId}", f"hospital:{summary.hospitalId}")
+    return summary
 
 
 
@@ -251,8 +291,12 @@ def _ensure_entities(db, hospital_name: str, department_name: str, doctor_name:
 
 
 @app.post("/api/bookings")
-def ingest_booking(payload: ExternalBookingPayload):
+def ingest_booking(payload: ExternalBookingPayload, response: Response, idempotency_key: Optional[str] = Header(None),
+                   async_mode: bool = Query(False, alias="async")):
+    if async_mode:
+        return _enqueue_booking(payload, response, idempotency_key)
     # Map external JSON into our internal BookingSummary, create entities as needed
+    idem = idempotency.begin("bookings", idempotency_key, payload.model_dump())
     with get_session() as db:
         hosp, dep, doc = _ensure_entities(db, payload.hospital.strip(), payload.department_name.strip(), payload.doctor_name.strip())
         # user
@@ -262,12 +306,15 @@ def ingest_booking(payload: ExternalBookingPayload):
             db.add(u)
             db.flush()
         when_iso = payload.time_slot
+        when_dt = datetime.fromisoformat(when_iso)
+        # need / symptoms / compact content snapshot, shared with the async queue
+        fields = booking.external_fields(payload.model_dump(), when_dt, u, hosp, dep, doc)
         bs = BookingSummary(
             userId=str(u.id),
             name=u.name,
             phone=u.phone,
-            need=f"Khám tại phòng {payload.room_code}" if payload.room_code else "Đặt lịch khám",
-            symptoms=", ".join(payload.symptoms) if payload.symptoms else None,
+            need=fields["need"],
+            symptoms=fields["symptoms"],
             hospitalId=str(hosp.id),
             hospitalName=hosp.name,
             department=dep.name,
@@ -275,53 +322,71 @@ def ingest_booking(payload: ExternalBookingPayload):
             doctorName=doc.name,
             time=when_iso,
         )
-        # create appointment and mark busy
-        when_dt = datetime.fromisoformat(when_iso)
-        end_dt = when_dt + timedelta(minutes=15)
-        err = _check_slot_constraints(db, doc.id, when_dt, end_dt)
-        if err:
-            raise HTTPException(status_code=409, detail=err)
-        # Compute STT for the day per doctor
-        day_start = datetime.combine(when_dt.date(), dtime.min)
-        day_end = datetime.combine(when_dt.date(), dtime.max)
-        cur_stt = db.scalar(
-            select(func.coalesce(func.max(Appointment.stt), 0))
-            .where(Appointment.doctor_id == doc.id, Appointment.when >= day_start, Appointment.when <= day_end)
-        ) or 0
-        appt = Appointment(user=u, doctor_id=doc.id, when=when_dt, stt=int(cur_stt) + 1, need=bs.need, symptoms=bs.symptoms or None, content={
-            "hospital": payload.hospital,
-            "patient_name": payload.patient_name,
-            "phone_number": payload.phone_number,
-            "doctor_name": payload.doctor_name,
-            "department_name": payload.department_name,
-            "room_code": payload.room_code,
-            "time_slot": payload.time_slot,
-            "symptoms": payload.symptoms or [],
-        })
-    db.add(appt)
-    # no linking column; we store the snapshot in appointment.content
-    db.flush()
+        # create appointment and mark busy; no linking column, we store the snapshot in appointment.content
+        booking.book_slot(db, doc.id, when_dt, user=u, **fields)
+        idem.save(db, bs.model_dump())
+    _mark_written(response, f"user:{bs.userId}", f"hospital:{bs.hospitalId}")
     return bs
 
 
+def _enqueue_booking(payload: ExternalBookingPayload, response: Response, idempotency_key: Optional[str]):
+    """Accept-then-process: shape check + one INSERT into booking_queue, 202 with a ticket."""
+    try:
+        datetime.fromisoformat(payload.time_slot)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid time_slot (ISO datetime)")
+    if not (payload.hospital.strip() and payload.department_name.strip() and payload.doctor_name.strip()):
+        raise HTTPException(status_code=422, detail="hospital, department_name and doctor_name are required")
+    idem = idempotency.begin("bookings_async", idempotency_key, payload.model_dump())
+    if booking_queue.depth() >= booking_queue.QUEUE_MAX_DEPTH:
+        raise HTTPException(status_code=503, detail="Hàng đợi đặt lịch đang đầy, vui lòng thử lại sau", headers={"Retry-After": "5"})
+    with get_session() as db:
+        item = booking_queue.enqueue(db, payload.model_dump())
+        out = {"ticket": item.id, "status": "queued", "statusUrl": f"/api/bookings/queue/{item.id}"}
+        idem.save(db, out, status_code=202)
+    response.status_code = 202
+    return out
+
+
+@app.get("/api/bookings/queue/{ticket}")
+def booking_queue_status(ticket: int):
+    """Outcome of an async booking: queued (with position) | done (result = booking summary) | failed (error)."""
+    with get_session() as db:
+        out = booking_queue.ticket_status(db, ticket)
+    if out is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return out
+
+
 @app.get("/api/bookings")
-def list_bookings(userId: Optional[str] = Query(None)):
+def list_bookings(userId: Optional[str] = Query(None), since: Optional[str] = Query(None),
+                  x_primary_until: Optional[float] = Header(None)):
+    since_dt = _parse_since(since)
     try:
-        with get_session() as db:
+        with get_read_session(*_sticky("user", userId), primary_until=x_primary_until) as db:
             q = select(Appointment).order_by(Appointment.created_at.desc(), Appointment.id.desc())
+            uid = None
             if userId:
                 try:
-                    q = q.where(Appointment.user_id == int(userId))
+                    uid = int(userId)
+                    q = q.where(Appointment.user_id == uid)
                 except ValueError:
                     pass
+            if since_dt:
+                q = q.where(Appointment.when >= since_dt)
             rows = db.execute(q).scalars().all()
+            # older months live in the archive; only read when the range reaches back that far
+            archived = archive.archived_appointments(db, user_id=uid, since=since_dt)
+            if archived:
+                rows = sorted([*rows, *archived], key=lambda a: (a.created_at or a.when, a.id), reverse=True)
+            contents = content_snapshot.expanded(db, rows)
             out = []
             for ap in rows:
                 out.append({
                     "id": ap.id,
                     "created_at": (ap.created_at or ap.when).isoformat(),
                     "stt": ap.stt,
-                    "content": ap.content or {},
+                    "content": contents[ap.id],
                 })
             return out
     except ProgrammingError as e:
@@ -334,14 +399,14 @@ def list_bookings(userId: Optional[str] = Query(None)):
 @app.get("/api/bookings/{booking_id}")
 def get_booking(booking_id: int):
     with get_session() as db:
-        ap = db.get(Appointment, booking_id)
+        ap = db.get(Appointment, booking_id) or archive.find_archived(db, booking_id)
         if not ap:
             raise HTTPException(status_code=404, detail="Booking not found")
         return {
             "id": ap.id,
             "created_at": (ap.created_at or ap.when).isoformat(),
             "stt": ap.stt,
-            "content": ap.content or {},
+            "content": content_snapshot.expanded(db, [ap])[ap.id],
         }
 
 
@@ -373,6 +438,7 @@ def lookup_appointment(doctor_id: int, start: str):
         dep = db.get(Department, doc.department_id) if doc else None
         hosp = db.get(Hospital, dep.hospital_id) if dep else None
         user = db.get(User, ap.user_id) if ap.user_id else None
+        room = db.get(Room, ap.room_id) if ap.room_id else None
         out = {
             "appointment": {
                 "id": ap.id,
@@ -382,7 +448,8 @@ def lookup_appointment(doctor_id: int, start: str):
                 "doctor": {"id": doc.id, "name": doc.name} if doc else None,
                 "department": dep.name if dep else None,
                 "hospital": hosp.name if hosp else None,
-                "content": ap.content or {},
+                "room": {"id": room.id, "code": room.code, "name": room.name} if room else None,
+                "content": content_snapshot.expanded(db, [ap])[ap.id],
             }
         }
         return out
@@ -410,25 +477,66 @@ def all_appointments_enriched():
                 "doctor": {"id": str(doc.id), "name": doc.name},
                 "department": {"id": str(dep.id), "name": dep.name},
                 "hospital": {"id": str(hosp.id), "name": hosp.name},
-                "content": ap.content or None,
+                "content": content_snapshot.expand(ap.content, content_snapshot.derived_values(
+                    ap.when, ap.symptoms, u.name, u.phone, doc.name, dep.name, hosp.name)) or None,
             })
         return {"appointments": out}
 
 @app.post("/api/_admin/appointments/{appt_id}/content")
 def set_appointment_content(appt_id: int, payload: dict):
     with get_session() as db:
-        ap = db.get(Appointment, int(appt_id))
-        if not ap:
+        row = db.execute(
+            select(Appointment, User.name, User.phone, Doctor.name, Department.name, Hospital.name)
+            .join(User, Appointment.user_id == User.id)
+            .join(Doctor, Appointment.doctor_id == Doctor.id)
+            .join(Department, Doctor.department_id == Department.id)
+            .join(Hospital, Department.hospital_id == Hospital.id)
+            .where(Appointment.id == int(appt_id))
+        ).first()
+        if not row:
             raise HTTPException(status_code=404, detail="Appointment not found")
-        ap.content = payload or {}
+        ap, *names = row
+        ap.content = content_snapshot.compact(payload or {}, content_snapshot.derived_values(ap.when, ap.symptoms, *names))
         db.flush()
         return {"ok": True}
 
 
+@app.get("/api/_admin/appointments")
+def admin_filter_appointments(
+    roomCode: Optional[str] = Query(None),
+    contains: Optional[str] = Query(None, description='JSON object matched against content, e.g. {"room_code": "P101"}'),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Appointments whose content contains these keys/values (content @> ..., GIN jsonb_path_ops index).
+    Only non-derived snapshot keys (room_code, extra keys) are filterable; names live in the linked rows."""
+    try:
+        filt = json.loads(contains) if contains else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="contains must be a JSON object")
+    if not isinstance(filt, dict):
+        raise HTTPException(status_code=400, detail="contains must be a JSON object")
+    if roomCode:
+        filt["room_code"] = roomCode
+    if not filt:
+        raise HTTPException(status_code=400, detail="roomCode or contains is required")
+    with get_read_session() as db:
+        rows = db.execute(
+            select(Appointment).where(Appointment.content.contains(filt)).order_by(Appointment.when.desc()).limit(limit)
+        ).scalars().all()
+        contents = content_snapshot.expanded(db, rows)
+        return {"appointments": [
+            {"id": ap.id, "when": ap.when.isoformat(), "stt": ap.stt, "doctorId": ap.doctor_id, "userId": ap.user_id,
+             "content": contents[ap.id]}
+            for ap in rows
+        ]}
+
+
 @app.get("/api/upcoming")
-def list_upcoming(userId: Optional[str] = Query(None)):
-    with get_session() as db:
+def list_upcoming(userId: Optional[str] = Query(None), x_primary_until: Optional[float] = Header(None)):
+    with get_read_session(*_sticky("user", userId), primary_until=x_primary_until) as db:
         q = select(Appointment, Doctor, Department, Hospital).join(Doctor, Appointment.doctor_id == Doctor.id).join(Department, Doctor.department_id == Department.id).join(Hospital, Department.hospital_id == Hospital.id).order_by(Appointment.when.asc())
+        # from today on: a plain range on "when" lets Postgres skip past months' partitions
+        q = q.where(Appointment.when >= datetime.combine(datetime.now().date(), dtime.min))
         if userId:
             q = q.where(Appointment.user_id == int(userId))
         rows = db.execute(q).all()
@@ -447,7 +555,9 @@ def list_upcoming(userId: Optional[str] = Query(None)):
 
 
 @app.get("/api/dev/schedule")
-def dev_schedule(date_str: str, span: str = Query("day", alias="range"), hospital_id: Optional[int] = Query(None)):
+@single_flight("schedule")
+def dev_schedule(date_str: str, span: str = Query("day", alias="range"), hospital_id: Optional[int] = Query(None),
+                 x_primary_until: Optional[float] = Header(None)):
     try:
         base = datetime.fromisoformat(date_str).date()
     except Exception:
@@ -462,7 +572,7 @@ def dev_schedule(date_str: str, span: str = Query("day", alias="range"), hospita
     start_min = datetime.combine(days[0], dtime.min)
     end_max = datetime.combine(days[-1], dtime.max)
 
-    with get_session() as db:
+    with get_read_session("schedule", *_sticky("hospital", hospital_id), primary_until=x_primary_until) as db:
         # 1) hospitals
         qh = select(Hospital)
         if hospital_id:
@@ -500,16 +610,9 @@ def dev_schedule(date_str: str, span: str = Query("day", alias="range"), hospita
         wins_by_doc: dict[int, list] = defaultdict(list)
         busy_by_doc: dict[int, list] = defaultdict(list)
         if doc_ids:
-            wins = db.execute(
-                select(ScheduleWindow)
-                .where(
-                    ScheduleWindow.doctor_id.in_(doc_ids),
-                    ScheduleWindow.start < end_max,
-                    ScheduleWindow.end > start_min,
-                )
-            ).scalars().all()
-            for w in wins:
-                wins_by_doc[w.doctor_id].append({"id": w.id, "start": w.start.isoformat(), "end": w.end.isoformat(), "kind": w.kind})
+            # concrete rows + recurring templates expanded only for this range
+            for doc_id, wins in schedule_rules.effective_windows(db, doc_ids, start_min, end_max).items():
+                wins_by_doc[doc_id] = [{**w, "start": w["start"].isoformat(), "end": w["end"].isoformat()} for w in wins]
 
             # Busy blocks are 15-minute appointments
             aps = db.execute(
@@ -555,11 +658,16 @@ class WindowUpsert(BaseModel):
 
 
 @app.put("/api/dev/windows")
-def upsert_window(payload: WindowUpsert):
+def upsert_window(payload: WindowUpsert, response: Response):
     if payload.kind not in ("available", "ooo"):
         raise HTTPException(status_code=400, detail="Invalid kind")
     with get_session() as db:
         s = ScheduleWindow(doctor_id=payload.doctorId, start=datetime.fromisoformat(payload.start), end=datetime.fromisoformat(payload.end), kind=payload.kind)
+        # Editing a template-driven day turns it into concrete rows first (rows override templates)
+        d = s.start.date()
+        while d <= s.end.date():
+            schedule_rules.materialize_day(db, s.doctor_id, d)
+            d += timedelta(days=1)
         # Skip if exact duplicate exists
         dup = db.execute(
             select(ScheduleWindow.id).where(
@@ -586,16 +694,65 @@ def upsert_window(payload: WindowUpsert):
                 raise HTTPException(status_code=409, detail="Out-of-office overlaps available time")
         db.add(s)
         db.flush()
-        return {"id": s.id}
+        sid = s.id
+    _mark_written(response, "schedule")
+    return {"id": sid}
 
 
 @app.delete("/api/dev/windows/{window_id}")
-def delete_window(window_id: int):
+def delete_window(window_id: str, response: Response):
     with get_session() as db:
-        r = db.execute(delete(ScheduleWindow).where(ScheduleWindow.id == window_id))
-        if r.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Not found")
-        return {"ok": True}
+        if window_id.isdigit():
+            r = db.execute(delete(ScheduleWindow).where(ScheduleWindow.id == int(window_id)))
+            if r.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Not found")
+        else:
+            # template-derived window "v-<doctor>-<YYYYMMDD>-<rule>"
+            parsed = schedule_rules.parse_virtual_id(window_id)
+            rule = db.get(ScheduleRule, parsed[2]) if parsed else None
+            if not rule:
+                raise HTTPException(status_code=404, detail="Not found")
+            doctor_id, day, _ = parsed
+            if not schedule_rules.materialize_day(db, doctor_id, day, skip_rule_id=rule.id):
+                # day already materialized (e.g. by the PUT of a drag): drop the row the template produced
+                s, e = schedule_rules.rule_window(rule, day)
+                db.execute(delete(ScheduleWindow).where(
+                    ScheduleWindow.doctor_id == doctor_id,
+                    ScheduleWindow.kind == rule.kind,
+                    ScheduleWindow.start == s,
+                    ScheduleWindow.end == e,
+                ))
+    _mark_written(response, "schedule")
+    return {"ok": True}
+
+
+class WindowOp(BaseModel):
+    op: str  # 'create' | 'update' | 'delete'
+    id: Optional[str] = None  # update/delete: window id, or template-derived "v-..." id
+    doctorId: Optional[int] = None  # create (update: defaults to the window's doctor)
+    start: Optional[str] = None
+    end: Optional[str] = None
+    kind: Optional[str] = None  # 'available' | 'ooo'
+    ref: Optional[str] = None  # echoed back in the op's result
+
+
+class WindowBatchPayload(BaseModel):
+    ops: List[WindowOp]
+    atomic: bool = False  # all-or-nothing: any failed op aborts the batch
+
+
+@app.post("/api/dev/windows/batch")
+def batch_windows(payload: WindowBatchPayload, response: Response):
+    """Apply several window edits in one transaction, validated against one snapshot; per-op results."""
+    if len(payload.ops) > 500:
+        raise HTTPException(status_code=400, detail="Too many ops (max 500)")
+    with get_session() as db:
+        results, written = window_batch.apply_ops(db, payload.ops, atomic=payload.atomic)
+        if payload.atomic and not all(r["ok"] for r in results):
+            raise HTTPException(status_code=409, detail={"message": "Batch aborted", "results": results})
+    if written:
+        _mark_written(response, "schedule")
+    return {"ok": all(r["ok"] for r in results), "results": results}
 
 
 # --------- Bulk Adjust Windows (day pattern over date range) ---------
@@ -612,6 +769,10 @@ class BulkAdjustPayload(BaseModel):
     available: Optional[List[BulkRule]] = None
     ooo: Optional[List[BulkRule]] = None
     overwrite: bool = True
+    # recurring=True stores the pattern as schedule templates (one rule per time range) instead of
+    # writing one row per doctor per day; weekdays: 0=Mon..6=Sun (default: every day in range)
+    recurring: bool = False
+    weekdays: Optional[List[int]] = None
 
 
 def _parse_hhmm(hhmm: str) -> tuple[int, int]:
@@ -683,8 +844,43 @@ def _doctors_by_scope(db, kind: str, sid: int) -> List[Doctor]:
     raise HTTPException(status_code=400, detail="Invalid scopeKind")
 
 
+def _parse_scope(scope: Optional[str]) -> tuple[Optional[str], Optional[int]]:
+    """`scope` query param (hospital:ID | department:ID | doctor:ID) -> (kind, id); (None, None) without one."""
+    if not scope:
+        return None, None
+    kind, _, sid = scope.partition(":")
+    if kind not in ("hospital", "department", "doctor") or not sid.isdigit():
+        raise HTTPException(status_code=400, detail="scope must be hospital:ID|department:ID|doctor:ID")
+    return kind, int(sid)
+
+
+def _scope_doctor_ids(db, scope: Optional[str], default_all: bool = True) -> Optional[List[int]]:
+    """Sorted doctor ids in `scope`; without a scope every doctor (or None when not `default_all`)."""
+    kind, sid = _parse_scope(scope)
+    if kind is None:
+        return db.execute(select(Doctor.id).order_by(Doctor.id)).scalars().all() if default_all else None
+    return sorted(d.id for d in _doctors_by_scope(db, kind, sid))
+
+
+def _parse_day_range(date_from: Optional[str], date_to: Optional[str], past: bool = False) -> tuple[date, date]:
+    """`from`/`to` query params -> inclusive day range. A missing bound makes it 30 days long, starting
+    today (or ending today with `past`); 400 when unparseable or reversed."""
+    try:
+        if past:
+            end_date = datetime.fromisoformat(date_to).date() if date_to else datetime.now().date()
+            start_date = datetime.fromisoformat(date_from).date() if date_from else end_date - timedelta(days=29)
+        else:
+            start_date = datetime.fromisoformat(date_from).date() if date_from else datetime.now().date()
+            end_date = datetime.fromisoformat(date_to).date() if date_to else start_date + timedelta(days=29)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="to must be >= from")
+    return start_date, end_date
+
+
 @app.post("/api/dev/windows/bulk-adjust")
-def bulk_adjust_windows(payload: BulkAdjustPayload):
+def bulk_adjust_windows(payload: BulkAdjustPayload, response: Response):
     kind = payload.scopeKind
     if kind not in ("hospital", "department", "doctor"):
         raise HTTPException(status_code=400, detail="scopeKind must be hospital|department|doctor")
@@ -718,6 +914,22 @@ def bulk_adjust_windows(payload: BulkAdjustPayload):
     deleted = 0
     affected_doctors = 0
     days_count = (end_date - start_date).days + 1
+    if payload.recurring:
+        with get_session() as db:
+            res = _apply_recurring_rules(db, payload, start_date, end_date, av_pairs, ooo_pairs)
+        _mark_written(response, "schedule")
+        return {"ok": True, **res, "days": days_count}
+    # The day pattern is identical for every doctor: merge OOO and cut it out of available for all
+    # days in one vectorized pass (keyed by day ordinal), then reuse the result per doctor.
+    all_days = [start_date + timedelta(days=i) for i in range(days_count)]
+    ooo_b = iv_union(IntervalBatch.from_pairs({
+        d.toordinal(): [(_dt_on(d, sh, sm), _dt_on(d, eh, em)) for (sh, sm, eh, em) in ooo_pairs] for d in all_days
+    }))
+    av_b = iv_union(IntervalBatch.from_pairs({
+        d.toordinal(): [(_dt_on(d, sh, sm), _dt_on(d, eh, em)) for (sh, sm, eh, em) in av_pairs] for d in all_days
+    }))
+    final_av_by_day = iv_subtract(av_b, ooo_b).to_pairs()
+    ooo_by_day = ooo_b.to_pairs()
     with get_session() as db:
         doctors = _doctors_by_scope(db, kind, int(payload.scopeId))
         if not doctors:
@@ -728,13 +940,8 @@ def bulk_adjust_windows(payload: BulkAdjustPayload):
             while cur <= end_date:
                 day_start = datetime.combine(cur, dtime.min)
                 day_end = datetime.combine(cur, dtime.max)
-                # Build intervals on this day
-                av_intv = [(_dt_on(cur, sh, sm), _dt_on(cur, eh, em)) for (sh, sm, eh, em) in av_pairs]
-                ooo_intv = [(_dt_on(cur, sh, sm), _dt_on(cur, eh, em)) for (sh, sm, eh, em) in ooo_pairs]
-                av_intv = _merge_intervals(av_intv)
-                ooo_intv = _merge_intervals(ooo_intv)
-                # Subtract OOO from available
-                final_av = _subtract(av_intv, ooo_intv) if ooo_intv else av_intv
+                final_av = final_av_by_day.get(cur.toordinal(), [])
+                ooo_intv = ooo_by_day.get(cur.toordinal(), [])
                 # Overwrite existing windows in day for this doctor
                 if payload.overwrite:
                     r = db.execute(
@@ -742,10 +949,16 @@ def bulk_adjust_windows(payload: BulkAdjustPayload):
                         .where(
                             ScheduleWindow.doctor_id == doc.id,
                             ScheduleWindow.start < day_end,
-                            ScheduleWindow.end > day_start,
+                            or_(ScheduleWindow.end > day_start, ScheduleWindow.start == day_start),
                         )
                     )
                     deleted += int(r.rowcount or 0)
+                    if not final_av and not ooo_intv:
+                        # explicit empty override so recurring templates stay hidden for this day
+                        db.add(ScheduleWindow(doctor_id=doc.id, start=day_start, end=day_start, kind=schedule_rules.CLEARED_KIND))
+                else:
+                    # adding to a template-driven day: keep its template windows as rows
+                    inserted += schedule_rules.materialize_day(db, doc.id, cur)
                 # Insert merged OOO and available
                 for s, e in final_av:
                     # skip exact duplicate
@@ -774,9 +987,158 @@ def bulk_adjust_windows(payload: BulkAdjustPayload):
                         inserted += 1
                 cur += timedelta(days=1)
         db.flush()
+    _mark_written(response, "schedule")
     return {"ok": True, "inserted": inserted, "deleted": deleted, "doctors": affected_doctors, "days": days_count}
 
 
+def _apply_recurring_rules(db, payload: BulkAdjustPayload, start_date: date, end_date: date,
+                           av_pairs: list[tuple[int, int, int, int]], ooo_pairs: list[tuple[int, int, int, int]]) -> dict:
+    """Store the bulk pattern as ScheduleRule rows for the scope. With overwrite, existing rules of the
+    same scope are clipped out of [start_date, end_date] and concrete overrides in that range removed."""
+    try:
+        mask = schedule_rules.weekdays_mask(payload.weekdays)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    kind, sid = payload.scopeKind, int(payload.scopeId)
+    created = deleted = clipped = 0
+    if payload.overwrite:
+        rules = db.execute(
+            select(ScheduleRule).where(
+                ScheduleRule.scope_kind == kind,
+                ScheduleRule.scope_id == sid,
+                ScheduleRule.date_from <= end_date,
+                or_(ScheduleRule.date_to.is_(None), ScheduleRule.date_to >= start_date),
+            )
+        ).scalars().all()
+        for r in rules:
+            before = r.date_from < start_date
+            after = r.date_to is None or r.date_to > end_date
+            if before and after:
+                db.add(ScheduleRule(
+                    scope_kind=r.scope_kind, scope_id=r.scope_id, kind=r.kind, weekdays=r.weekdays,
+                    start_minute=r.start_minute, end_minute=r.end_minute,
+                    date_from=end_date + timedelta(days=1), date_to=r.date_to, exceptions=r.exceptions,
+                ))
+                r.date_to = start_date - timedelta(days=1)
+                clipped += 1
+            elif before:
+                r.date_to = start_date - timedelta(days=1)
+                clipped += 1
+            elif after:
+                r.date_from = end_date + timedelta(days=1)
+                clipped += 1
+            else:
+                db.delete(r)
+                deleted += 1
+        doc_ids = [d.id for d in _doctors_by_scope(db, kind, sid)]
+        if doc_ids:
+            r = db.execute(delete(ScheduleWindow).where(
+                ScheduleWindow.doctor_id.in_(doc_ids),
+                ScheduleWindow.start <= datetime.combine(end_date, dtime.max),
+                ScheduleWindow.end >= datetime.combine(start_date, dtime.min),
+            ))
+            deleted += int(r.rowcount or 0)
+    for rule_kind, pairs in (("available", av_pairs), ("ooo", ooo_pairs)):
+        for sh, sm, eh, em in pairs:
+            db.add(ScheduleRule(
+                scope_kind=kind, scope_id=sid, kind=rule_kind, weekdays=mask,
+                start_minute=sh * 60 + sm, end_minute=eh * 60 + em,
+                date_from=start_date, date_to=end_date,
+            ))
+            created += 1
+    db.flush()
+    return {"rules_created": created, "rules_clipped": clipped, "deleted": deleted}
+
+
+# --------- Schedule templates (recurring rules) ---------
+class ScheduleRulePayload(BaseModel):
+    id: Optional[int] = None
+    scopeKind: str  # 'hospital' | 'department' | 'doctor'
+    scopeId: int
+    kind: str = "available"  # 'available' | 'ooo'
+    weekdays: Optional[List[int]] = None  # 0=Mon..6=Sun
+    start: str  # HH:MM
+    end: str    # HH:MM (24:00 = end of day)
+    dateFrom: str  # YYYY-MM-DD
+    dateTo: Optional[str] = None  # inclusive; None = open-ended
+    exceptions: Optional[List[str]] = None  # YYYY-MM-DD days skipped
+
+
+def _rule_dict(r: ScheduleRule) -> dict:
+    return {
+        "id": r.id,
+        "scopeKind": r.scope_kind,
+        "scopeId": r.scope_id,
+        "kind": r.kind,
+        "weekdays": schedule_rules.weekdays_list(r.weekdays),
+        "start": f"{r.start_minute // 60:02d}:{r.start_minute % 60:02d}",
+        "end": f"{r.end_minute // 60:02d}:{r.end_minute % 60:02d}",
+        "dateFrom": r.date_from.isoformat(),
+        "dateTo": r.date_to.isoformat() if r.date_to else None,
+        "exceptions": r.exceptions or [],
+    }
+
+
+@app.get("/api/dev/schedule-rules")
+def list_schedule_rules(scopeKind: Optional[str] = Query(None), scopeId: Optional[int] = Query(None),
+                        x_primary_until: Optional[float] = Header(None)):
+    with get_read_session("schedule", primary_until=x_primary_until) as db:
+        stmt = select(ScheduleRule)
+        if scopeKind:
+            stmt = stmt.where(ScheduleRule.scope_kind == scopeKind)
+        if scopeId is not None:
+            stmt = stmt.where(ScheduleRule.scope_id == scopeId)
+        rules = db.execute(stmt.order_by(ScheduleRule.scope_kind, ScheduleRule.scope_id, ScheduleRule.date_from, ScheduleRule.start_minute)).scalars().all()
+        return [_rule_dict(r) for r in rules]
+
+
+@app.put("/api/dev/schedule-rules")
+def upsert_schedule_rule(payload: ScheduleRulePayload, response: Response):
+    if payload.scopeKind not in schedule_rules.SCOPES:
+        raise HTTPException(status_code=400, detail="Invalid scopeKind")
+    if payload.kind not in ("available", "ooo"):
+        raise HTTPException(status_code=400, detail="kind must be 'available' or 'ooo'")
+    sh, sm = _parse_hhmm(payload.start)
+    eh, em = _parse_hhmm(payload.end)
+    start_minute, end_minute = sh * 60 + sm, eh * 60 + em
+    if end_minute <= start_minute:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    try:
+        mask = schedule_rules.weekdays_mask(payload.weekdays)
+        date_from = date.fromisoformat(payload.dateFrom)
+        date_to = date.fromisoformat(payload.dateTo) if payload.dateTo else None
+        exceptions = sorted({date.fromisoformat(d).isoformat() for d in payload.exceptions or []})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if date_to is not None and date_to < date_from:
+        raise HTTPException(status_code=400, detail="dateTo must be on/after dateFrom")
+    with get_session() as db:
+        if payload.id is not None:
+            r = db.get(ScheduleRule, payload.id)
+            if not r:
+                raise HTTPException(status_code=404, detail="Rule not found")
+        else:
+            r = ScheduleRule()
+            db.add(r)
+        r.scope_kind, r.scope_id, r.kind, r.weekdays = payload.scopeKind, payload.scopeId, payload.kind, mask
+        r.start_minute, r.end_minute = start_minute, end_minute
+        r.date_from, r.date_to, r.exceptions = date_from, date_to, exceptions or None
+        db.flush()
+        out = _rule_dict(r)
+    _mark_written(response, "schedule")
+    return out
+
+
+@app.delete("/api/dev/schedule-rules/{rule_id}")
+def delete_schedule_rule(rule_id: int, response: Response):
+    with get_session() as db:
+        r = db.execute(delete(ScheduleRule).where(ScheduleRule.id == rule_id))
+        if (r.rowcount or 0) == 0:
+            raise HTTPException(status_code=404, detail="Rule not found")
+    _mark_written(response, "schedule")
+    return {"ok": True}
+
+
 # Endpoint for slots-to-appointment lookup removed
 
 
@@ -807,6 +1169,46 @@ def debug_db():
     return {"url": url, "tables": tables, "alembic_version": version}
 
 
+@app.get("/api/_debug/startup")
+def debug_startup():
+    """Per-stage startup timings of this worker (ms)."""
+    return {"mode": STARTUP_MODE, "stages": [{"stage": n, "ms": round(ms, 2)} for n, ms in STARTUP_STAGES]}
+
+
+@app.get("/api/_debug/pool")
+def debug_pool(reset: bool = False):
+    """Connection pool config + counters (checkouts, wait time, overflow, pre-ping failures) of this worker."""
+    out = pool_stats(engine, reset=reset)
+    if replica_router:
+        out["read_routing"] = replica_router.stats()
+    return out
+
+
+@app.get("/api/_debug/admission")
+def debug_admission(reset: bool = False):
+    """Rate limiter / write concurrency state and shed counts (429 rate_limited, 503 overloaded) of this worker."""
+    mw = ADMISSION["middleware"]
+    return {**(mw.stats() if mw else {}), "shed": shed_counts(reset=reset)}
+
+
+@app.get("/api/_debug/coalescing")
+def debug_coalescing(reset: bool = False):
+    """Single-flight counters per GET handler: executions, coalesced requests and coalescing ratio."""
+    return coalescing_stats(reset=reset)
+
+
+@app.get("/api/_debug/queue-board")
+def debug_queue_board(reset: bool = False):
+    """Queue board cache of this worker: loads, renders, served/304 counts, open SSE streams."""
+    return queue_board.stats(reset=reset)
+
+
+@app.get("/api/_debug/symptom-routing")
+def debug_symptom_routing():
+    """Shared symptom routing index: documents, terms, watermark, last build/refresh."""
+    return symptom_routing.stats()
+
+
 @app.get("/api/_debug/which-db")
 def which_db():
     with engine.connect() as c:
@@ -830,6 +1232,13 @@ def which_db():
 
 
 # --------- Admin: Reset and Seed ---------
+RESET_HOSPITALS = {
+    1: "BV Nhân dân Gia Định",
+    2: "BV đa khoa sài gòn",
+    3: "Bệnh viện Bình Dân",
+}
+
+
 @app.post("/api/_admin/reset-and-seed")
 def admin_reset_and_seed():
     """
@@ -838,47 +1247,17 @@ def admin_reset_and_seed():
       1: BV Nhân dân Gia Định
       2: BV đa khoa sài gòn
       3: Bệnh viện Bình Dân
+    Truncate + COPY FROM STDIN + sequence fix + summary run in one transaction.
+    Ids restart, so this worker's in-process copies of old ids are dropped afterwards; other workers
+    keep theirs until they are restarted (restart them all after a reset).
     """
-    from backend.seed_loader import upsert_hospitals_json
-    base_dir = Path(__file__).parent
-    seed_giadinh = base_dir / "seed" / "hospitals.json"
-    seed_binhdan = base_dir / "seed" / "hospitals_binhdan.json"
-
-    # 1) Truncate all related tables and restart identities
-    with engine.begin() as conn:
-        conn.execute(sa_text(
-            "TRUNCATE TABLE appointments, schedule_windows, doctors, rooms, departments, users, hospitals RESTART IDENTITY CASCADE"
-        ))
-
-        # 2) Insert hospitals with fixed IDs
-        conn.execute(sa_text(
-            "INSERT INTO hospitals (id, name) VALUES (:id1, :n1), (:id2, :n2), (:id3, :n3)"
-        ), {
-            "id1": 1, "n1": "BV Nhân dân Gia Định",
-            "id2": 2, "n2": "BV đa khoa sài gòn",
-            "id3": 3, "n3": "Bệnh viện Bình Dân",
-        })
-        # 3) Fix sequence to MAX(id)
-        try:
-            conn.execute(sa_text("SELECT setval(pg_get_serial_sequence('hospitals','id'), COALESCE((SELECT MAX(id) FROM hospitals), 0))"))
-        except Exception:
-            pass
-
-    # 4) Seed only from the two JSON seed files
-    if seed_giadinh.exists():
-        upsert_hospitals_json(seed_giadinh)
-    if seed_binhdan.exists():
-        upsert_hospitals_json(seed_binhdan)
-
-    # 5) Return summary
-    with get_session() as db:
-        hs = db.execute(select(Hospital)).scalars().all()
-        out = []
-        for h in hs:
-            dep_count = db.scalar(select(func.count(Department.id)).where(Department.hospital_id == h.id)) or 0
-            doc_count = db.scalar(select(func.count(Doctor.id)).join(Department, Doctor.department_id == Department.id).where(Department.hospital_id == h.id)) or 0
-            out.append({"id": h.id, "name": h.name, "departments": dep_count, "doctors": doc_count})
-        return {"ok": True, "hospitals": out}
+    from backend.seed_loader import copy_reset_and_seed, CANONICAL_FILES
+    res = copy_reset_and_seed(CANONICAL_FILES, fixed_hospitals=RESET_HOSPITALS)
+    idempotency.reset()
+    queue_board.reset()
+    earliest.reset()
+    calendar_feed.reset()
+    return {"ok": True, **res}
 
 
 # --------- Admin: Flexible seeding from folder/files ---------
@@ -896,6 +1275,7 @@ def admin_seed(req: SeedRequest):
     - elif path provided: seed all JSONs under path (by pattern, optional recursive)
     - else: fallback to the two canonical files
     """
+    from backend import seed_loader
     if req.files:
         summary = seed_loader.seed_files(req.files)
         return {"ok": True, "summary": summary}
@@ -909,18 +1289,44 @@ def admin_seed(req: SeedRequest):
 
 # --------- Admin: Seed default weekly schedule ---------
 @app.post("/api/_admin/seed-default-schedule")
-def admin_seed_default_schedule(weeks: int = 1, fill_ooo: bool = False):
+def admin_seed_default_schedule(response: Response, weeks: int = 1, fill_ooo: bool = False, materialize: bool = False):
     """
     Create default 'available' windows for each doctor:
     - For the next `weeks` weeks starting today
     - Monday to Saturday
     - 08:00 to 17:00 local time
+    Stored as one recurring template per hospital (expanded lazily on read). materialize=true keeps the
+    old behaviour of one row per doctor per day.
     Idempotent-ish: skips creating a window if one with exact (start,end,kind) already exists.
     """
     today = datetime.utcnow().date()
     end_date = today + timedelta(days=max(1, weeks) * 7)
     created = 0
     created_ooo = 0
+    if not materialize:
+        mon_sat = schedule_rules.weekdays_mask(range(6))
+        sunday = schedule_rules.weekdays_mask([6])
+        specs = [("available", mon_sat, 8 * 60, 17 * 60)]
+        if fill_ooo:
+            specs += [("ooo", mon_sat, 0, 8 * 60), ("ooo", mon_sat, 17 * 60, 1440), ("ooo", sunday, 0, 1440)]
+        with get_session() as db:
+            hids = db.execute(select(Hospital.id)).scalars().all()
+            existing = set(db.execute(
+                select(ScheduleRule.scope_id, ScheduleRule.kind, ScheduleRule.weekdays, ScheduleRule.start_minute, ScheduleRule.end_minute)
+                .where(ScheduleRule.scope_kind == "hospital", ScheduleRule.date_from == today, ScheduleRule.date_to == end_date - timedelta(days=1))
+            ).all())
+            for hid in hids:
+                for kind, mask, smin, emin in specs:
+                    if (hid, kind, mask, smin, emin) in existing:
+                        continue
+                    db.add(ScheduleRule(scope_kind="hospital", scope_id=hid, kind=kind, weekdays=mask, start_minute=smin,
+                                        end_minute=emin, date_from=today, date_to=end_date - timedelta(days=1)))
+                    if kind == "available":
+                        created += 1
+                    else:
+                        created_ooo += 1
+        _mark_written(response, "schedule")
+        return {"ok": True, "created": created, "created_ooo": created_ooo, "recurring": True}
     with get_session() as db:
         doctors = db.execute(select(Doctor)).scalars().all()
         for doc in doctors:
@@ -986,17 +1392,39 @@ def admin_seed_default_schedule(weeks: int = 1, fill_ooo: bool = False):
     return {"ok": True, "created": created, "created_ooo": created_ooo}
 
 
+# --------- Admin: Schedule conflicts audit ---------
+@app.get("/api/_admin/schedule/conflicts")
+def admin_schedule_conflicts(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    scope: Optional[str] = Query(None, description="hospital:ID | department:ID | doctor:ID (default: all doctors)"),
+    limit: int = Query(1000, ge=0, le=100000),
+):
+    """
+    Orphaned appointments (outside available windows or inside OOO), overlapping window pairs and
+    duplicate STT per doctor-day, for days from..to inclusive (default: the next 30 days).
+    Lists are capped at `limit` entries each; `counts` are always complete.
+    """
+    start_date, end_date = _parse_day_range(date_from, date_to)
+    start = datetime.combine(start_date, dtime.min)
+    end = datetime.combine(end_date + timedelta(days=1), dtime.min)
+    with get_read_session("schedule") as db:
+        report = schedule_audit.find_conflicts(db, _scope_doctor_ids(db, scope), start, end, limit=limit)
+    return {"from": start_date.isoformat(), "to": end_date.isoformat(), "scope": scope or "all", **report}
+
+
 # --------- Hospital-scoped user lists and upcoming ---------
 class HospitalUsersOut(BaseModel):
     hospitals: list[dict]
 
 
 @app.get("/api/hospital-users")
-def list_hospital_users(hospitalId: Optional[int] = Query(None)) -> Dict[str, list[dict]]:
+@single_flight("hospital_users")
+def list_hospital_users(hospitalId: Optional[int] = Query(None), x_primary_until: Optional[float] = Header(None)) -> Dict[str, list[dict]]:
     """Return, per hospital, the users who have appointments with its doctors.
     Each user row includes basic info + appointment count and last appointment time in that hospital.
     """
-    with get_session() as db:
+    with get_read_session(*_sticky("hospital", hospitalId), primary_until=x_primary_until) as db:
         # base join
         q = (
             select(
@@ -1039,9 +1467,12 @@ def list_hospital_users(hospitalId: Optional[int] = Query(None)) -> Dict[str, li
 
 
 @app.get("/api/hospital-user-profile")
-def get_hospital_user_profile(hospitalId: int, userId: int):
-    """Profile for a user constrained to one hospital: basic user info + all their appointments at this hospital."""
-    with get_session() as db:
+def get_hospital_user_profile(hospitalId: int, userId: int, since: Optional[str] = Query(None),
+                              x_primary_until: Optional[float] = Header(None)):
+    """Profile for a user constrained to one hospital: basic user info + all their appointments at this hospital
+    (from `since` on when given; archived months are merged in)."""
+    since_dt = _parse_since(since)
+    with get_read_session(f"user:{userId}", f"hospital:{hospitalId}", primary_until=x_primary_until) as db:
         h = db.get(Hospital, int(hospitalId))
         if not h:
             raise HTTPException(status_code=404, detail="Hospital not found")
@@ -1056,14 +1487,31 @@ def get_hospital_user_profile(hospitalId: int, userId: int):
             .where(Appointment.user_id == u.id, Department.hospital_id == h.id)
             .order_by(Appointment.when.desc())
         )
+        if since_dt:
+            q = q.where(Appointment.when >= since_dt)
         rows = db.execute(q).all()
+        archived = archive.archived_appointments(db, user_id=u.id, since=since_dt)
+        if archived:
+            docs = {
+                doc.id: (doc, dep)
+                for doc, dep in db.execute(
+                    select(Doctor, Department)
+                    .join(Department, Doctor.department_id == Department.id)
+                    .where(Doctor.id.in_({a.doctor_id for a in archived}), Department.hospital_id == h.id)
+                ).all()
+            }
+            rows = sorted(
+                [*rows, *((a, *docs[a.doctor_id]) for a in archived if a.doctor_id in docs)],
+                key=lambda r: r[0].when, reverse=True,
+            )
         appts = [{
             "id": ap.id,
             "when": ap.when.isoformat(),
             "stt": ap.stt,
             "doctorName": doc.name,
             "department": dep.name,
-            "content": ap.content or {},
+            "content": content_snapshot.expand(ap.content, content_snapshot.derived_values(
+                ap.when, ap.symptoms, u.name, u.phone, doc.name, dep.name, h.name)) or {},
         } for (ap, doc, dep) in rows]
         # Note: BHYT is not modeled in DB; return None to keep the shape
         return {
@@ -1074,6 +1522,7 @@ def get_hospital_user_profile(hospitalId: int, userId: int):
 
 
 @app.get("/api/hospitals/upcoming")
+@single_flight("hospitals_upcoming")
 def list_upcoming_by_hospital():
     """Upcoming appointments grouped by hospital from "now" forward."""
     now = datetime.utcnow()
@@ -1102,11 +1551,294 @@ def list_upcoming_by_hospital():
         return {"hospitals": list(groups.values())}
 
 
+# --------- Cancellation, reschedule and waitlist ---------
+class ReschedulePayload(BaseModel):
+    time: str
+    doctorId: Optional[int] = None  # default: same doctor
+
+
+class WaitlistPayload(BaseModel):
+    userId: int
+    doctorId: int
+    day: str  # YYYY-MM-DD
+    need: Optional[str] = None
+    symptoms: Optional[str] = None
+    # no priority: public entries wait in arrival order; higher priorities belong to displace()
+
+
+def _sticky_keys(db, user_ids, doctor_ids) -> list[str]:
+    """Read-your-writes keys (user:<id>, hospital:<id>) touched by a booking change."""
+    hids = db.execute(
+        select(Department.hospital_id).join(Doctor, Doctor.department_id == Department.id)
+        .where(Doctor.id.in_(set(doctor_ids))).distinct()
+    ).scalars().all() if doctor_ids else []
+    return [f"user:{u}" for u in set(user_ids)] + [f"hospital:{h}" for h in hids]
+
+
+@app.post("/api/appointments/{appt_id}/cancel")
+def cancel_appointment(appt_id: int, response: Response):
+    """Cancel a future appointment; its doctor-day is then backfilled from the waitlist."""
+    with get_session() as db:
+        appt = db.get(Appointment, appt_id)
+        if not appt:
+            raise HTTPException(status_code=404, detail="Not found")
+        user_id, doctor_id = appt.user_id, appt.doctor_id
+        backfilled = waitlist.cancel(db, appt)
+        keys = _sticky_keys(db, [user_id] + [b["userId"] for b in backfilled], [doctor_id])
+    _mark_written(response, *keys)
+    return {"ok": True, "backfilled": backfilled}
+
+
+@app.post("/api/appointments/{appt_id}/reschedule")
+def reschedule_appointment(appt_id: int, payload: ReschedulePayload, response: Response):
+    try:
+        when = datetime.fromisoformat(payload.time)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid time")
+    with get_session() as db:
+        appt = db.get(Appointment, appt_id)
+        if not appt:
+            raise HTTPException(status_code=404, detail="Not found")
+        old_doctor = appt.doctor_id
+        backfilled = waitlist.reschedule(db, appt, when, payload.doctorId)
+        out = {"id": appt.id, "doctorId": appt.doctor_id, "when": appt.when.isoformat(), "stt": appt.stt, "backfilled": backfilled}
+        keys = _sticky_keys(db, [appt.user_id] + [b["userId"] for b in backfilled], [old_doctor, appt.doctor_id])
+    _mark_written(response, *keys)
+    return out
+
+
+@app.post("/api/waitlist")
+def join_waitlist(payload: WaitlistPayload, response: Response):
+    """Wait for any slot of a doctor-day; booked right away if the day still has free time."""
+    try:
+        day = date.fromisoformat(payload.day)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid day")
+    with get_session() as db:
+        if not db.get(User, payload.userId):
+            raise HTTPException(status_code=404, detail="User not found")
+        if not db.get(Doctor, payload.doctorId):
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        entry = WaitlistEntry(user_id=payload.userId, doctor_id=payload.doctorId, day=day, priority=0,
+                              need=payload.need, symptoms=payload.symptoms)
+        booked = waitlist.join(db, entry)
+        out = {**waitlist.entry_dict(entry), "backfilled": booked}
+        keys = _sticky_keys(db, [payload.userId] + [b["userId"] for b in booked], [payload.doctorId]) if booked else []
+    if keys:
+        _mark_written(response, *keys)
+    return out
+
+
+@app.get("/api/waitlist")
+def list_waitlist(userId: Optional[int] = Query(None), doctorId: Optional[int] = Query(None), day: Optional[str] = Query(None)):
+    if userId is None and doctorId is None:
+        raise HTTPException(status_code=400, detail="userId or doctorId is required")
+    try:
+        d = date.fromisoformat(day) if day else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid day")
+    with get_session() as db:
+        return waitlist.entries(db, user_id=userId, doctor_id=doctorId, day=d)
+
+
+@app.delete("/api/waitlist/{entry_id}")
+def leave_waitlist(entry_id: int):
+    with get_session() as db:
+        e = db.get(WaitlistEntry, entry_id)
+        if not e:
+            raise HTTPException(status_code=404, detail="Not found")
+        if e.status == "waiting":
+            e.status = "cancelled"
+        return waitlist.entry_dict(e)
+
+
+@app.post("/api/_admin/waitlist/repack")
+def admin_waitlist_repack(
+    response: Response,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    scope: Optional[str] = Query(None, description="hospital:ID | department:ID | doctor:ID (default: all doctors)"),
+):
+    """
+    After a schedule change: appointments now outside available time (or inside OOO) go back to the
+    waitlist of their doctor-day with high priority, then every affected doctor-day is re-packed in one pass.
+    Days from..to inclusive (default: the next 30 days); only future appointments move.
+    """
+    start_date, end_date = _parse_day_range(date_from, date_to)
+    with get_session() as db:
+        report = schedule_audit.find_conflicts(
+            db, _scope_doctor_ids(db, scope), datetime.combine(start_date, dtime.min), datetime.combine(end_date + timedelta(days=1), dtime.min),
+            limit=1_000_000,
+        )
+        out = waitlist.displace(db, [o["id"] for o in report["orphaned_appointments"]])
+        if out["displaced"]:
+            keys = _sticky_keys(db, [b["userId"] for b in out["rebooked"]], {o["doctor_id"] for o in report["orphaned_appointments"]})
+    if out["displaced"]:
+        _mark_written(response, "schedule", *keys)
+    return out
+
+
+# --------- Earliest availability search ---------
+@app.get("/api/search/earliest")
+def search_earliest(
+    department: str = Query(..., min_length=1),
+    date_from: Optional[str] = Query(None, alias="from"),
+    limit: int = Query(10, ge=1, le=200),
+    perDoctor: Optional[int] = Query(None, ge=1),
+    x_primary_until: Optional[float] = Header(None),
+):
+    """
+    Earliest bookable slots for a department name across all hospitals ("tim mach" matches "Tim Mạch"),
+    from `from` (default and earliest: now, past slots are not bookable) up to EARLIEST_HORIZON_DAYS
+    ahead, in time order. `perDoctor` caps the slots taken from any one doctor.
+    """
+    now = datetime.now()
+    start = max(_parse_since(date_from) or now, now)
+    with get_read_session("schedule", primary_until=x_primary_until) as db:
+        return earliest.search(db, department, start, limit=limit, per_doctor=perDoctor)
+
+
+# --------- Analytics: utilization ---------
+@app.get("/api/analytics/utilization")
+def analytics_utilization(
+    scope: Optional[str] = Query(None, description="hospital:ID | department:ID | doctor:ID (default: all doctors)"),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    granularity: str = Query("day"),
+    groupBy: Optional[str] = Query(None, description="doctor | department | hospital | all (default: one level below scope)"),
+    x_primary_until: Optional[float] = Header(None),
+):
+    """
+    Booked 15-minute blocks over available minutes minus OOO, per group and day/week/month bucket,
+    for days from..to inclusive (default: the last 30 days). Read from the precomputed daily facts;
+    `pendingChanges` counts writes not yet folded in.
+    """
+    if granularity not in utilization.GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be day|week|month")
+    if groupBy is not None and groupBy not in utilization.GROUPS:
+        raise HTTPException(status_code=400, detail="groupBy must be doctor|department|hospital|all")
+    start_date, end_date = _parse_day_range(date_from, date_to, past=True)
+    kind, _ = _parse_scope(scope)
+    group_by = groupBy or {None: "hospital", "hospital": "department"}.get(kind, "doctor")
+    with get_read_session("schedule", primary_until=x_primary_until) as db:
+        doc_ids = _scope_doctor_ids(db, scope, default_all=False)
+        report = utilization.aggregate(db, doc_ids, start_date, end_date, granularity=granularity, group_by=group_by)
+    return {"from": start_date.isoformat(), "to": end_date.isoformat(), "scope": scope or "all", **report}
+
+
+@app.post("/api/_admin/analytics/utilization/refresh")
+def admin_utilization_refresh():
+    """Fold pending schedule/booking changes into the utilization facts now."""
+    return utilization.refresh()
+
+
+# --------- Symptom routing ---------
+@app.get("/api/route-symptoms")
+def route_symptoms(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(5, ge=1, le=50),
+    hospitalId: Optional[int] = Query(None),
+):
+    """
+    Departments that past appointments with these symptoms went to, best first (score 0..1), and the
+    same scores summed per department name (feed `names[0].department` to /api/search/earliest).
+    Answered from the shared index of backend/symptom_routing.py (one lookup of the query's terms).
+    """
+    return symptom_routing.route(q, limit=limit, hospital_id=hospitalId)
+
+
+@app.post("/api/_admin/symptom-routing/refresh")
+def admin_symptom_routing_refresh(full: bool = False):
+    """Add appointments created since the last refresh to the shared index (`full`: rebuild, archive included);
+    {"skipped": true} while another worker is refreshing it."""
+    return symptom_routing.refresh(full=full)
+
+
+@app.get("/api/_admin/symptoms/search")
+def admin_symptoms_search(q: str = Query(..., min_length=3), limit: int = Query(50, ge=1, le=500)):
+    """Ad-hoc substring search over appointment and conversation symptoms (pg_trgm GIN indexes)."""
+    pattern = f"%{q}%"
+    with get_read_session() as db:
+        appts = db.execute(
+            select(Appointment.id, Appointment.when, Appointment.symptoms, Doctor.department_id)
+            .join(Doctor, Appointment.doctor_id == Doctor.id)
+            .where(Appointment.symptoms.ilike(pattern))
+            .order_by(Appointment.when.desc())
+            .limit(limit)
+        ).all()
+        convs = db.execute(
+            select(Conversation.id, Conversation.user_id, Conversation.created_at, Conversation.symptoms)
+            .where(Conversation.symptoms.ilike(pattern))
+            .order_by(Conversation.created_at.desc())
+            .limit(limit)
+        ).all()
+    return {
+        "appointments": [{"id": i, "when": w.isoformat(), "symptoms": s, "departmentId": d} for i, w, s, d in appts],
+        "conversations": [{"id": i, "userId": u, "created_at": c.isoformat() if c else None, "symptoms": s} for i, u, c, s in convs],
+    }
+
+
+# --------- Queue board (lobby "now serving" displays) ---------
+@app.get("/api/queue/{doctor_id}")
+def get_queue_board(doctor_id: int, if_none_match: Optional[str] = Header(None)):
+    """Today's STT queue of a doctor: current, next entries and counts. Rendered once per change;
+    If-None-Match with the last ETag gets 304."""
+    body, etag = queue_board.board(doctor_id)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=1"}
+    if if_none_match == etag:
+        queue_board.count("not_modified")
+        return Response(status_code=304, headers=headers)
+    queue_board.count("served")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/queue/{doctor_id}/stream")
+async def stream_queue_board(doctor_id: int, request: Request):
+    """Server-sent events (`event: board`) with the same JSON as GET /api/queue/{doctor_id}, on connect and on change."""
+    first = await run_in_threadpool(queue_board.board, doctor_id)  # 404 before the stream starts
+    return StreamingResponse(
+        queue_board.events(doctor_id, request, first), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --------- Calendar feeds (.ics) ---------
+def _calendar_response(kind: str, scope_id: int, if_none_match: Optional[str], if_modified_since: Optional[str]):
+    with get_session() as db:
+        feed = calendar_feed.feed(db, kind, scope_id)
+    if feed.not_modified(if_none_match, if_modified_since):
+        return Response(status_code=304, headers=feed.headers)
+    body = feed.cached()
+    if body is not None:
+        return Response(content=body, media_type="text/calendar; charset=utf-8", headers=feed.headers)
+    return StreamingResponse(feed.stream(), media_type="text/calendar; charset=utf-8", headers=feed.headers)
+
+
+@app.get("/api/calendar/doctors/{doctor_id}.ics")
+def doctor_calendar(doctor_id: int, if_none_match: Optional[str] = Header(None), if_modified_since: Optional[str] = Header(None)):
+    """Subscribable iCalendar feed of a doctor's windows and appointments (backend/calendar_feed.py).
+    Strong ETag / Last-Modified from the doctor's change version: an unchanged feed answers 304."""
+    return _calendar_response("doctor", doctor_id, if_none_match, if_modified_since)
+
+
+@app.get("/api/calendar/departments/{department_id}.ics")
+def department_calendar(department_id: int, if_none_match: Optional[str] = Header(None), if_modified_since: Optional[str] = Header(None)):
+    """Same as the doctor feed for every doctor of the department, each event prefixed with the doctor."""
+    return _calendar_response("department", department_id, if_none_match, if_modified_since)
+
+
+@app.get("/api/_debug/calendar")
+def debug_calendar():
+    """This worker's feed counters: 304s, cache hits, renders and cached feeds."""
+    return calendar_feed.stats()
+
+
 # --------- Rooms API (for seeding & lookups) ---------
 @app.get("/api/rooms")
+@single_flight("rooms")
 def list_rooms(hospital_id: Optional[int] = Query(None), department_id: Optional[int] = Query(None)):
     """List rooms, optionally filtered by hospital or department."""
-    with get_session() as db:
+    with get_read_session() as db:
         q = select(Room)
         if department_id:
             q = q.where(Room.department_id == int(department_id))
@@ -1122,48 +1854,31 @@ def list_rooms(hospital_id: Optional[int] = Query(None), department_id: Optional
         } for r in rows]
 
 
+@app.post("/api/_admin/rooms/plan")
+def admin_plan_rooms(response: Response, hospitalId: int = Query(...), day: str = Query(...), full: bool = False):
+    """Re-plan the room assignment of every department of the hospital for one day (backend/rooms.py).
+    Stable by default (current assignments stay); `full` re-colors the day from scratch."""
+    try:
+        d = date.fromisoformat(day)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid day")
+    with get_session() as db:
+        dep_ids = db.execute(select(Department.id).where(Department.hospital_id == hospitalId)).scalars().all()
+        if not dep_ids:
+            raise HTTPException(status_code=404, detail="Hospital not found")
+        res = rooms.plan_department_days(db, [(dep_id, d) for dep_id in dep_ids], full=full)
+    _mark_written(response, f"hospital:{hospitalId}")
+    return {"hospitalId": hospitalId, "day": d.isoformat(), "full": full, **res}
+
+
 # --------- Helpers ---------
-def _check_slot_constraints(db, doctor_id: int, start_dt: datetime, end_dt: datetime) -> Optional[str]:
-    """Return None if slot is valid, or an error message string otherwise."""
-    # Must be fully covered by an available window
-    avail = db.execute(
-        select(ScheduleWindow.id)
-        .where(
-            ScheduleWindow.doctor_id == doctor_id,
-            ScheduleWindow.kind == "available",
-            ScheduleWindow.start <= start_dt,
-            ScheduleWindow.end >= end_dt,
-        )
-        .limit(1)
-    ).scalar_one_or_none()
-    if not avail:
-        return "Thời gian này không nằm trong khung giờ làm việc (available) của bác sĩ"
-
-    # Must not overlap an OOO window
-    ooo_overlap = db.execute(
-        select(ScheduleWindow.id)
-        .where(
-            ScheduleWindow.doctor_id == doctor_id,
-            ScheduleWindow.kind == "ooo",
-            ScheduleWindow.start < end_dt,
-            ScheduleWindow.end > start_dt,
-        )
-        .limit(1)
-    ).scalar_one_or_none()
-    if ooo_overlap:
-        return "Khung giờ này trùng thời gian out-of-office của bác sĩ"
-
-    # Must not overlap existing appointment (15-minute busy)
-    busy_appt = db.execute(
-        select(Appointment.id)
-        .where(
-            Appointment.doctor_id == doctor_id,
-            Appointment.when < end_dt,
-            Appointment.when > (start_dt - timedelta(minutes=15)),
-        )
-        .limit(1)
-    ).scalar_one_or_none()
-    if busy_appt:
-        return "Khung giờ này đã có bệnh nhân đặt"
-    return None
+def _parse_since(since: Optional[str]) -> Optional[datetime]:
+    if not since:
+        return None
+    try:
+        return datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since (ISO date/datetime)")
+
 
+_IMPORT_DONE = perf_counter()
@@ -0,0 +1,447 @@
+"""Operational commands kept out of the API process: schema check, startup profiling, seeding.
+
+Usage (from project root):
+    python -m backend.manage check-schema
+    python -m backend.manage profile-startup [--top 25]
+    python -m backend.manage bench-intervals [--doctors 10000] [--days 7]
+    python -m backend.manage pool-bench [--modes queue,lifo,null] [--concurrency 20] [--requests 2000]
+    python -m backend.manage seed [--path DIR [--pattern *.json] [--recursive]] [--files a.json b.json]
+    python -m backend.manage partitions list|ensure|detach [--months-ahead 12] [--before YYYY-MM-DD]
+    python -m backend.manage archive [--before YYYY-MM-DD] [--dry-run]
+    python -m backend.manage purge-idempotency
+    python -m backend.manage booking-worker [--workers 4]
+    python -m backend.manage bench-partitions [--years 3] [--per-day 3000] [--iterations 200]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def cmd_check_schema(args) -> int:
+    from backend.db import check_schema_version
+    res = check_schema_version()
+    print(json.dumps(res, ensure_ascii=False))
+    return 0 if res["ok"] else 1
+
+
+def cmd_seed(args) -> int:
+    from backend import seed_loader
+    if args.files:
+        summary = seed_loader.seed_files(args.files)
+    elif args.path:
+        summary = seed_loader.seed_path(args.path, pattern=args.pattern, recursive=args.recursive)
+    else:
+        summary = seed_loader.seed_two_files_only()
+    print(json.dumps(summary, ensure_ascii=False, default=str))
+    return 0
+
+
+def _import_times(module: str) -> list[tuple[str, int, int]]:
+    """(module, self_us, cumulative_us) from `python -X importtime` in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=str(PROJECT_ROOT),
+    )
+    out = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[0].isdigit():
+            continue  # header line
+        out.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    if proc.returncode != 0:
+        print(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"import {module} failed", file=sys.stderr)
+    return out
+
+
+def cmd_profile_startup(args) -> int:
+    rows = _import_times("backend.main")
+    total_us = max((c for _, _, c in rows), default=0)
+    print(f"== import time per module (cold interpreter, top {args.top} by cumulative) ==")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cum_us in sorted(rows, key=lambda r: r[2], reverse=True)[: args.top]:
+        print(f"{cum_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+    print(f"{total_us / 1000:14.1f} {'':9}  (total, {len(rows)} modules)")
+
+    t0 = perf_counter()
+    import backend.main as app_main
+    from backend.timing_instrumentation import STARTUP_STAGES
+    app_main.startup()
+    total_ms = (perf_counter() - t0) * 1000.0
+    print("\n== startup stages ==")
+    for name, ms in STARTUP_STAGES:
+        print(f"{ms:14.1f}  {name}")
+    print(f"{total_ms:14.1f}  (import + startup, this process)")
+    return 0
+
+
+def cmd_bench_intervals(args) -> int:
+    """Free time = available - (OOO + busy) for every doctor-day: per-doctor Python helpers vs one
+    vectorized pass over all doctors. Results are compared for equality before timings are printed."""
+    import random
+    from datetime import datetime, timedelta
+    from backend.main import _merge_intervals, _subtract
+    from backend.intervals import IntervalBatch, union, subtract, free_slots
+
+    rnd = random.Random(args.seed)
+    base = datetime(2025, 1, 6)
+    av: dict[int, list] = {}
+    cut: dict[int, list] = {}
+    for doc in range(args.doctors):
+        for d in range(args.days):
+            day = base + timedelta(days=d)
+            for _ in range(rnd.randint(1, 3)):
+                s = day + timedelta(minutes=rnd.randrange(6 * 60, 16 * 60, 15))
+                av.setdefault(doc, []).append((s, s + timedelta(minutes=rnd.randrange(60, 6 * 60, 15))))
+            for _ in range(rnd.randint(0, 2)):
+                s = day + timedelta(minutes=rnd.randrange(0, 24 * 60, 15))
+                cut.setdefault(doc, []).append((s, s + timedelta(minutes=rnd.randrange(15, 180, 15))))
+            for _ in range(rnd.randint(0, 12)):
+                s = day + timedelta(minutes=rnd.randrange(7 * 60, 18 * 60, 15))
+                cut.setdefault(doc, []).append((s, s + timedelta(minutes=15)))
+    n_iv = sum(map(len, av.values())) + sum(map(len, cut.values()))
+
+    t0 = perf_counter()
+    ref = {}
+    for doc, pairs in av.items():
+        by_day: dict = {}
+        for s, e in pairs:
+            by_day.setdefault(s.date(), ([], []))[0].append((s, e))
+        for s, e in cut.get(doc, []):
+            by_day.setdefault(s.date(), ([], []))[1].append((s, e))
+        out = []
+        for day in sorted(by_day):
+            a, c = by_day[day]
+            out.extend(_subtract(_merge_intervals(a), _merge_intervals(c)))
+        if out:
+            ref[doc] = _merge_intervals(out)
+    t_ref = perf_counter() - t0
+
+    a_b, c_b = IntervalBatch.from_pairs(av), IntervalBatch.from_pairs(cut)
+    t0 = perf_counter()
+    free = subtract(union(a_b), c_b)
+    t_vec = perf_counter() - t0
+    t0 = perf_counter()
+    slots = free_slots(free, timedelta(minutes=15))
+    t_slots = perf_counter() - t0
+
+    same = free.to_pairs() == ref
+    print(f"doctors={args.doctors} days={args.days} intervals={n_iv} free={len(free)} slots={len(slots)}")
+    print(f"python helpers : {t_ref * 1000:9.1f} ms")
+    print(f"vectorized     : {t_vec * 1000:9.1f} ms  (x{t_ref / max(t_vec, 1e-9):.0f})")
+    print(f"free 15m slots : {t_slots * 1000:9.1f} ms")
+    print(f"identical      : {same}")
+    return 0 if same else 1
+
+
+def cmd_pool_bench(args) -> int:
+    """Run SELECT 1 sessions from N threads through each pool strategy and print latency + pool counters."""
+    import threading
+    from sqlalchemy import text
+    from backend.db import DATABASE_URL, make_engine, pool_stats
+
+    pre_pings = {"on": [True], "off": [False], "both": [True, False]}[args.pre_ping]
+    per_thread = max(1, args.requests // args.concurrency)
+    print(f"{'mode':>6} {'pre_ping':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'wait avg':>9} {'wait max':>9} {'connects':>8} {'overflow':>8}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for pre_ping in pre_pings:
+            eng = make_engine(DATABASE_URL, mode=mode, pre_ping=pre_ping)
+            lat: list[float] = []
+            lock = threading.Lock()
+
+            def worker():
+                mine = []
+                for _ in range(per_thread):
+                    t0 = perf_counter()
+                    with eng.connect() as conn:
+                        conn.execute(text("SELECT 1"))
+                    mine.append((perf_counter() - t0) * 1000.0)
+                with lock:
+                    lat.extend(mine)
+
+            threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+            t0 = perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = perf_counter() - t0
+            st = pool_stats(eng)
+            eng.dispose()
+            lat.sort()
+            p50 = lat[len(lat) // 2]
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+            print(
+                f"{mode:>6} {str(pre_ping):>8} {len(lat) / elapsed:9.0f} {p50:8.2f} {p95:8.2f} "
+                f"{st['wait_ms_avg']:9.3f} {st['wait_ms_max']:9.2f} {st['connects']:8d} {st['overflow_checkouts']:8d}"
+            )
+    return 0
+
+
+def cmd_partitions(args) -> int:
+    from datetime import date
+    from backend import partitions
+    if args.action == "ensure":
+        start = date.fromisoformat(args.start) if args.start else None
+        out = {"created": partitions.ensure_partitions(args.months_ahead, start=start)}
+    elif args.action == "detach":
+        if not args.before:
+            print("--before YYYY-MM-DD is required for detach", file=sys.stderr)
+            return 2
+        out = {"detached": partitions.detach_before(date.fromisoformat(args.before), archive_schema=args.schema or None)}
+    else:
+        out = {"partitions": partitions.list_partitions()}
+    print(json.dumps(out, ensure_ascii=False, default=str, indent=2))
+    return 0
+
+
+def cmd_archive(args) -> int:
+    from datetime import date
+    from backend import archive
+    out = archive.archive_before(date.fromisoformat(args.before) if args.before else None, dry_run=args.dry_run)
+    print(json.dumps(out, ensure_ascii=False, default=str, indent=2))
+    return 0
+
+
+def cmd_compact_content(args) -> int:
+    """Compact Appointment.content snapshots; prints table size / content size / list latency before and after."""
+    from backend import content_snapshot
+    from backend.db import engine
+    before = content_snapshot.storage_stats()
+    job = content_snapshot.compact_existing(batch=args.batch, dry_run=args.dry_run)
+    if args.vacuum and not args.dry_run:
+        # updated rows leave dead tuples; VACUUM makes the space reusable (VACUUM FULL would return it to the OS)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM (ANALYZE) appointments")
+    after = content_snapshot.storage_stats()
+    print(json.dumps({"before": before, "job": job, "after": after}, indent=2))
+    return 0
+
+
+def cmd_purge_idempotency(args) -> int:
+    from backend.idempotency import purge_expired
+    print(json.dumps({"deleted": purge_expired()}))
+    return 0
+
+
+def cmd_utilization_refresh(args) -> int:
+    from backend import utilization
+    print(json.dumps(utilization.refresh()))
+    return 0
+
+
+def cmd_plan_rooms(args) -> int:
+    """Assign rooms for every department-day with appointments in [--from, --to], one transaction per day."""
+    from datetime import date, datetime, time as dtime, timedelta
+    from sqlalchemy import select
+    from backend import rooms
+    from backend.models import Appointment, Doctor
+    day, end = date.fromisoformat(args.date_from), date.fromisoformat(args.date_to)
+    total = {"departmentDays": 0, "appointments": 0, "assigned": 0, "unassigned": 0, "changed": 0, "ms": 0.0}
+    while day <= end:
+        lo = datetime.combine(day, dtime.min)
+        with get_session() as db:
+            dep_ids = db.execute(
+                select(Doctor.department_id).distinct().join(Appointment, Appointment.doctor_id == Doctor.id)
+                .where(Appointment.when >= lo, Appointment.when < lo + timedelta(days=1))
+            ).scalars().all()
+            res = rooms.plan_department_days(db, [(d, day) for d in dep_ids], full=args.full)
+        for k in total:
+            total[k] += res[k]
+        day += timedelta(days=1)
+    total["ms"] = round(total["ms"], 1)
+    print(json.dumps(total))
+    return 0
+
+
+def cmd_booking_worker(args) -> int:
+    """Drain booking_queue in this process (for deployments running API workers with BOOKING_QUEUE_WORKERS=0)."""
+    import time
+    from backend import booking_queue
+    stop = booking_queue.start_workers(args.workers)
+    print(f"[booking-queue] {args.workers} worker(s) running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        if stop:
+            stop.set()
+    return 0
+
+
+_BENCH_QUERIES = [
+    ("busy check (doctor, 30 min)", 'SELECT 1 FROM {t} WHERE doctor_id = :doc AND "when" >= :lo AND "when" < :hi LIMIT 1'),
+    ("STT max (doctor, day)", 'SELECT coalesce(max(stt), 0) FROM {t} WHERE doctor_id = :doc AND "when" >= :lo AND "when" < :hi'),
+    ("day count (all doctors)", 'SELECT count(*) FROM {t} WHERE "when" >= :lo AND "when" < :hi'),
+    ("upcoming (next 50)", 'SELECT id FROM {t} WHERE "when" >= :lo ORDER BY "when" LIMIT 50'),
+]
+
+
+def _bench_params(rnd, qname: str, recent_days: list, doctors: int) -> dict:
+    """Random parameters within the last month of generated data (the booking path's working set)."""
+    from datetime import timedelta
+    day = rnd.choice(recent_days)
+    if qname.startswith("busy"):
+        w = day + timedelta(minutes=rnd.randrange(0, 1440, 15))
+        return {"doc": rnd.randrange(doctors), "lo": w - timedelta(minutes=15), "hi": w + timedelta(minutes=15)}
+    if qname.startswith("STT"):
+        return {"doc": rnd.randrange(doctors), "lo": day, "hi": day + timedelta(days=1)}
+    if qname.startswith("day"):
+        return {"lo": day, "hi": day + timedelta(days=1)}
+    return {"lo": day}
+
+
+def cmd_bench_partitions(args) -> int:
+    """Same generated multi-year data in a plain heap table and a month-partitioned table; runs the hot
+    appointment queries (by "when" range) against both and prints latency and partitions touched."""
+    import random
+    from datetime import date, datetime, timedelta
+    from sqlalchemy import text
+    from backend.db import engine
+    from backend.partitions import add_months
+
+    days = int(args.years * 365)
+    rows = days * args.per_day
+    t0 = datetime.combine(date.today() - timedelta(days=days - 30), datetime.min.time())
+    tables = {"heap": "bench_appt_heap", "partitioned": "bench_appt_part"}
+    cols = "id bigint NOT NULL, doctor_id integer NOT NULL, \"when\" timestamp NOT NULL, stt integer, content jsonb"
+    fill = (
+        "INSERT INTO {t} SELECT g, (random() * (:docs - 1))::int, "
+        ":t0 + (random() * :days * 86400) * interval '1 second', 1 + (random() * 30)::int, "
+        "jsonb_build_object('note', md5(g::text)) FROM generate_series(1, :rows) AS g"
+    )
+    print(f"rows={rows} years={args.years} doctors={args.doctors}  (loading...)")
+    with engine.begin() as conn:
+        for t in tables.values():
+            conn.execute(text(f"DROP TABLE IF EXISTS {t} CASCADE"))
+        conn.execute(text(f"CREATE TABLE {tables['heap']} ({cols})"))
+        conn.execute(text(f'CREATE TABLE {tables["partitioned"]} ({cols}) PARTITION BY RANGE ("when")'))
+        month, last = add_months(t0.date(), 0), add_months(t0.date(), days // 28 + 2)
+        while month < last:
+            nxt = add_months(month, 1)
+            conn.execute(text(
+                f"CREATE TABLE {tables['partitioned']}_p{month:%Y_%m} PARTITION OF {tables['partitioned']} "
+                f"FOR VALUES FROM ('{month}') TO ('{nxt}')"
+            ))
+            month = nxt
+        params = {"docs": args.doctors, "t0": t0, "days": days, "rows": rows}
+        for t in tables.values():
+            conn.execute(text(fill.format(t=t)), params)
+            conn.execute(text(f'CREATE INDEX ON {t} (doctor_id, "when")'))
+            conn.execute(text(f'CREATE INDEX ON {t} ("when")'))
+            conn.execute(text(f"ANALYZE {t}"))
+
+    rnd = random.Random(args.seed)
+    recent_days = [t0 + timedelta(days=d) for d in range(days - 30, days)]
+    print(f"{'query':30} {'table':>12} {'p50 ms':>8} {'p95 ms':>8} {'partitions':>10}")
+    try:
+        with engine.connect() as conn:
+            for qname, sql in _BENCH_QUERIES:
+                samples = [_bench_params(rnd, qname, recent_days, args.doctors) for _ in range(args.iterations)]
+                for label, t in tables.items():
+                    stmt = text(sql.format(t=t))
+                    lat = []
+                    for p in samples:
+                        s0 = perf_counter()
+                        conn.execute(stmt, p).all()
+                        lat.append((perf_counter() - s0) * 1000.0)
+                    plan = "\n".join(r[0] for r in conn.execute(text("EXPLAIN " + sql.format(t=t)), samples[0]))
+                    scanned = plan.count(f" on {t}_p") if label == "partitioned" else 1
+                    lat.sort()
+                    print(f"{qname:30} {label:>12} {lat[len(lat) // 2]:8.2f} {lat[int(len(lat) * 0.95) - 1]:8.2f} {scanned:>10}")
+            conn.rollback()
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                for t in tables.values():
+                    conn.execute(text(f"DROP TABLE IF EXISTS {t} CASCADE"))
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("check-schema", help="compare alembic_version in the DB with the code head")
+    p.set_defaults(func=cmd_check_schema)
+
+    p = sub.add_parser("profile-startup", help="report import time per module and time per startup stage")
+    p.add_argument("--top", type=int, default=25)
+    p.set_defaults(func=cmd_profile_startup)
+
+    p = sub.add_parser("bench-intervals", help="vectorized interval engine vs the per-doctor helpers")
+    p.add_argument("--doctors", type=int, default=10000)
+    p.add_argument("--days", type=int, default=7)
+    p.add_argument("--seed", type=int, default=7)
+    p.set_defaults(func=cmd_bench_intervals)
+
+    p = sub.add_parser("pool-bench", help="compare pool strategies against DATABASE_URL")
+    p.add_argument("--modes", default="queue,lifo,null")
+    p.add_argument("--pre-ping", choices=("on", "off", "both"), default="both")
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--requests", type=int, default=2000)
+    p.set_defaults(func=cmd_pool_bench)
+
+    p = sub.add_parser("seed", help="seed hospitals/departments/doctors/rooms from JSON")
+    p.add_argument("--files", nargs="*", default=None)
+    p.add_argument("--path", default=None)
+    p.add_argument("--pattern", default="*.json")
+    p.add_argument("--recursive", action="store_true")
+    p.set_defaults(func=cmd_seed)
+
+    p = sub.add_parser("partitions", help="list / create future / detach old monthly appointment partitions")
+    p.add_argument("action", choices=("list", "ensure", "detach"))
+    p.add_argument("--months-ahead", type=int, default=None)
+    p.add_argument("--start", default=None, help="first month for ensure (YYYY-MM-DD), default: this month")
+    p.add_argument("--before", default=None, help="detach months before this date (YYYY-MM-DD)")
+    p.add_argument("--schema", default="archive", help="schema for detached partitions ('' keeps them in place)")
+    p.set_defaults(func=cmd_partitions)
+
+    p = sub.add_parser("archive", help="move appointments older than the horizon into appointments_archive")
+    p.add_argument("--before", default=None, help="cutoff date (YYYY-MM-DD), default: ARCHIVE_HORIZON_MONTHS ago")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("compact-content", help="strip snapshot fields derivable from foreign keys out of appointments.content")
+    p.add_argument("--batch", type=int, default=2000)
+    p.add_argument("--dry-run", action="store_true", help="only report how much would be saved")
+    p.add_argument("--vacuum", action="store_true", help="VACUUM ANALYZE appointments afterwards")
+    p.set_defaults(func=cmd_compact_content)
+
+    p = sub.add_parser("purge-idempotency", help="delete expired Idempotency-Key results")
+    p.set_defaults(func=cmd_purge_idempotency)
+
+    p = sub.add_parser("utilization-refresh", help="recompute utilization facts of changed doctor-days")
+    p.set_defaults(func=cmd_utilization_refresh)
+
+    p = sub.add_parser("plan-rooms", help="assign appointments to rooms of their department for a date range")
+    p.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD")
+    p.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD")
+    p.add_argument("--full", action="store_true", help="re-plan from scratch instead of keeping current rooms")
+    p.set_defaults(func=cmd_plan_rooms)
+
+    p = sub.add_parser("booking-worker", help="process asynchronous bookings (POST /api/bookings?async=1)")
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=cmd_booking_worker)
+
+    p = sub.add_parser("bench-partitions", help="hot appointment queries: heap table vs monthly partitions")
+    p.add_argument("--years", type=float, default=3)
+    p.add_argument("--per-day", type=int, default=3000)
+    p.add_argument("--doctors", type=int, default=500)
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--keep", action="store_true", help="keep the bench_appt_* tables")
+    p.set_defaults(func=cmd_bench_partitions)
+
+    args = parser.parse_args(argv)
+    return int(args.func(args) or 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
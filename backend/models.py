@@ -1,7 +1,8 @@
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Text, UniqueConstraint, Boolean
-from sqlalchemy.dialects.postgresql import JSONB
-from datetime import datetime
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, validates
+from sqlalchemy import String, Integer, BigInteger, ForeignKey, DateTime, Date, Text, UniqueConstraint, Boolean
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from datetime import datetime, date
+from backend.textnorm import fold
 
 class Base(DeclarativeBase):
     pass
@@ -37,9 +38,19 @@ class User(Base):
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     phone: Mapped[str] = mapped_column(String(20), unique=True, nullable=False)
     cccd: Mapped[str] = mapped_column(String(12), unique=True)
+    # textnorm.fold(name), kept in sync on every name assignment; COLLATE "C" in the DB so one btree
+    # serves both LIKE 'prefix%' and ORDER BY (GET /api/users/search)
+    name_folded: Mapped[str | None] = mapped_column(String(255), nullable=True)
     appointments: Mapped[list["Appointment"]] = relationship(back_populates="user")
 
+    @validates("name")
+    def _fold_name(self, key, value):
+        self.name_folded = fold(value)
+        return value
+
 class Appointment(Base):
+    # Range-partitioned by month on "when" (see backend/partitions.py); the DB primary key is (id, "when"),
+    # id alone stays the ORM identity since it comes from one sequence
     __tablename__ = "appointments"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
@@ -50,6 +61,7 @@ class Appointment(Base):
     symptoms: Mapped[str] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     content: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    room_id: Mapped[int | None] = mapped_column(ForeignKey("rooms.id"), nullable=True)  # set by backend/rooms.py
     user: Mapped[User] = relationship(back_populates="appointments")
     doctor: Mapped[Doctor] = relationship()
 
@@ -85,3 +97,142 @@ class Room(Base):
     code: Mapped[str] = mapped_column(String(50), nullable=False)
     name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     __table_args__ = (UniqueConstraint("hospital_id", "code", name="uq_room_hospital_code"),)
+
+
+class ScheduleRule(Base):
+    """Recurring availability template for a doctor, department or hospital.
+    Expanded on the fly for the requested range; concrete ScheduleWindow rows on a doctor-day override it.
+    weekdays: bitmask, Monday = 1 << 0 ... Sunday = 1 << 6. Minutes are from local midnight (1440 = end of day).
+    """
+    __tablename__ = "schedule_rules"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    scope_kind: Mapped[str] = mapped_column(String(16), nullable=False)  # 'hospital' | 'department' | 'doctor'
+    scope_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # 'available' | 'ooo'
+    weekdays: Mapped[int] = mapped_column(Integer, nullable=False, default=0b1111111)
+    start_minute: Mapped[int] = mapped_column(Integer, nullable=False)
+    end_minute: Mapped[int] = mapped_column(Integer, nullable=False)
+    date_from: Mapped[date] = mapped_column(Date, nullable=False)
+    date_to: Mapped[date | None] = mapped_column(Date, nullable=True)
+    exceptions: Mapped[list[str] | None] = mapped_column(JSONB, nullable=True)  # ISO dates skipped
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class AppointmentArchive(Base):
+    """Cold storage for appointments older than the archive horizon (see backend/archive.py).
+    One row per user per month; `rows` is the JSON array of the archived appointments (TOAST-compressed).
+    """
+    __tablename__ = "appointments_archive"
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    n: Mapped[int] = mapped_column(Integer, nullable=False)
+    ids: Mapped[list[int]] = mapped_column(ARRAY(Integer), nullable=False)
+    rows: Mapped[list[dict]] = mapped_column(JSONB, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    """Stored result of a POST sent with an Idempotency-Key header (see backend/idempotency.py)."""
+    __tablename__ = "idempotency_keys"
+    scope: Mapped[str] = mapped_column(String(32), primary_key=True)  # route, e.g. 'book'
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(40), nullable=False)  # sha1 of the canonical request body
+    status_code: Mapped[int] = mapped_column(Integer, nullable=False, default=200)
+    response: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class BookingQueueItem(Base):
+    """Accepted-but-not-yet-processed external booking (POST /api/bookings?async=1, see backend/booking_queue.py).
+    status: 'queued' -> 'done' | 'failed'
+    """
+    __tablename__ = "booking_queue"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)  # the ticket
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")
+    payload: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    result: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class WaitlistEntry(Base):
+    """Patient waiting for any slot of a doctor-day (see backend/waitlist.py).
+    status: 'waiting' -> 'booked' | 'cancelled'. Higher priority first, then oldest; patients displaced
+    by a schedule change come back with WAITLIST_DISPLACED_PRIORITY.
+    """
+    __tablename__ = "waitlist_entries"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    doctor_id: Mapped[int] = mapped_column(ForeignKey("doctors.id"), nullable=False)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    need: Mapped[str | None] = mapped_column(Text, nullable=True)
+    symptoms: Mapped[str | None] = mapped_column(Text, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="waiting")
+    appointment_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # no FK: appointments is partitioned
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    booked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class UtilizationDaily(Base):
+    """Precomputed capacity and bookings of one doctor-day (see backend/utilization.py).
+    Only doctor-days with availability or bookings have a row; capacity = available_min - ooo_min.
+    """
+    __tablename__ = "utilization_daily"
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    doctor_id: Mapped[int] = mapped_column(ForeignKey("doctors.id"), primary_key=True)
+    available_min: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # union of available windows
+    ooo_min: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # part of it covered by OOO
+    booked: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # appointments (15-minute blocks)
+
+
+class UtilizationDirty(Base):
+    """Days whose facts are stale, written by triggers on appointments, schedule_windows and schedule_rules.
+    day_to NULL = open-ended (a rule without date_to)."""
+    __tablename__ = "utilization_dirty"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    scope_kind: Mapped[str] = mapped_column(String(16), nullable=False)  # 'hospital' | 'department' | 'doctor'
+    scope_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    day_from: Mapped[date] = mapped_column(Date, nullable=False)
+    day_to: Mapped[date | None] = mapped_column(Date, nullable=True)
+
+
+class UtilizationState(Base):
+    """Single row (id=1): the day range utilization_daily covers."""
+    __tablename__ = "utilization_state"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    computed_from: Mapped[date] = mapped_column(Date, nullable=False)
+    computed_until: Mapped[date] = mapped_column(Date, nullable=False)
+    last_run_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class CalendarVersion(Base):
+    """Per-doctor change counter behind the .ics feeds' ETag / Last-Modified (backend/calendar_feed.py).
+    Bumped by triggers on appointments, schedule_windows and schedule_rules; changed_at is UTC."""
+    __tablename__ = "calendar_versions"
+    doctor_id: Mapped[int] = mapped_column(ForeignKey("doctors.id"), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    changed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class RoutingTerm(Base):
+    """Posting of the symptom routing index: documents of `department_id` containing `term`
+    (see backend/symptom_routing.py)."""
+    __tablename__ = "routing_terms"
+    term: Mapped[str] = mapped_column(Text, primary_key=True)
+    department_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    docs: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class RoutingState(Base):
+    """Single row (id=1): document count and incremental-refresh position of the routing index.
+    recent = {appointment id: created_at} indexed inside the overlap window; times are UTC."""
+    __tablename__ = "routing_state"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    docs: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    watermark: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    recent: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    built_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
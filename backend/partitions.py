@@ -0,0 +1,137 @@
+"""Monthly range partitions of `appointments` on "when" (Alembic revision 20261019_0090).
+
+Partitions are named appointments_pYYYY_MM; rows outside every month land in appointments_default,
+so an insert never fails because a partition is missing. ensure_partitions() keeps
+PARTITION_MONTHS_AHEAD months ready (the DB function moves matching rows out of the default
+partition first), detach_partition() takes an old month out of the live table into ARCHIVE_SCHEMA.
+
+Queries only prune when they filter on "when" directly with plain values: `"when" >= :lo AND
+"when" < :hi`, never date("when") or "when"::date.
+"""
+import os
+import threading
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from backend.db import engine
+
+PARENT = "appointments"
+DEFAULT_PARTITION = "appointments_default"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "12"))
+# 0 disables the in-process maintenance thread (run `python -m backend.manage partitions ensure` from cron instead)
+PARTITION_MAINTAIN_HOURS = float(os.getenv("PARTITION_MAINTAIN_HOURS", "24"))
+ARCHIVE_SCHEMA = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
+
+_LIST_SQL = text(
+    """
+    SELECT c.relname AS name,
+           pg_get_expr(c.relpartbound, c.oid) AS bound,
+           c.reltuples::bigint AS est_rows,
+           pg_total_relation_size(c.oid) AS bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:parent AS regclass)
+    ORDER BY c.relname
+    """
+)
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+def list_partitions(conn=None) -> list[dict]:
+    if conn is None:
+        with engine.connect() as c:
+            return list_partitions(c)
+    return [dict(r._mapping) for r in conn.execute(_LIST_SQL, {"parent": PARENT})]
+
+
+def ensure_partitions(months_ahead: Optional[int] = None, start: Optional[date] = None, conn=None) -> list[str]:
+    """Create the missing month partitions from `start` (default: this month) through `months_ahead`
+    months later. Returns the names created. Safe to call from several workers at once."""
+    if conn is None:
+        with engine.begin() as c:
+            return ensure_partitions(months_ahead, start, c)
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    first = month_start(start or datetime.now().date())
+    created = []
+    for i in range(months_ahead + 1):
+        month = add_months(first, i)
+        if conn.execute(text("SELECT appointments_ensure_partition(:m)"), {"m": month}).scalar():
+            created.append(partition_name(month))
+    default_rows = conn.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() or 0
+    if default_rows:
+        print(f"[partitions] {default_rows} appointment(s) in {DEFAULT_PARTITION}; ensure_partitions(start=...) covers their months")
+    return created
+
+
+def detach_partition(month: date, archive_schema: Optional[str] = ARCHIVE_SCHEMA, concurrently: bool = False) -> dict:
+    """Detach one month from the live table. The detached table is moved into `archive_schema`
+    (None keeps it next to the live table) and is no longer visible to appointment queries.
+    concurrently=True avoids blocking readers (PG 14+) but cannot run inside a transaction."""
+    name = partition_name(month_start(month))
+    with engine.connect() as conn:
+        if concurrently:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        exists = conn.execute(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": name}).scalar()
+        if not exists:
+            return {"ok": False, "partition": name, "error": "not found"}
+        conn.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION "{name}"' + (" CONCURRENTLY" if concurrently else "")))
+        if archive_schema:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"'))
+            conn.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{archive_schema}"'))
+        conn.commit()
+    return {"ok": True, "partition": name, "schema": archive_schema or "public"}
+
+
+def detach_before(cutoff: date, archive_schema: Optional[str] = ARCHIVE_SCHEMA) -> list[dict]:
+    """Detach every month partition that ends on or before the first day of cutoff's month."""
+    limit = partition_name(month_start(cutoff))
+    out = []
+    for p in list_partitions():
+        if p["name"] != DEFAULT_PARTITION and p["name"] < limit:
+            y, m = p["name"].rsplit("_p", 1)[1].split("_")
+            out.append(detach_partition(date(int(y), int(m), 1), archive_schema=archive_schema))
+    return out
+
+
+def maintain() -> Optional[list[str]]:
+    """ensure_partitions() in one worker at a time: None when another worker holds the run."""
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('partition_maintenance'))")).scalar():
+            return None
+        return ensure_partitions(conn=conn)
+
+
+def _maintain_loop(interval_s: float, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            created = maintain()
+            if created:
+                print(f"[partitions] created {', '.join(created)}")
+        except Exception as e:
+            print(f"[partitions] ensure_partitions failed: {e}")
+        stop.wait(interval_s)
+
+
+def start_maintenance(hours: Optional[float] = None) -> Optional[threading.Event]:
+    """Background thread creating future partitions every `hours`; returns its stop event (None = disabled).
+    Every worker starts one, but only the worker holding the try-lock does the work on each round."""
+    hours = PARTITION_MAINTAIN_HOURS if hours is None else hours
+    if hours <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_maintain_loop, args=(hours * 3600.0, stop), name="partition-maintenance", daemon=True).start()
+    return stop
@@ -0,0 +1,201 @@
+"""Live per-doctor STT queue ("now serving") for lobby displays.
+
+Today's queue of a doctor is loaded on first use by one scan of ix_appointments_doctor_when
+(doctor_id = :d AND "when" within today), then kept current in memory by the booking write paths
+(note_booked()/note_removed() after commit). Bookings made by other workers are picked up by a reload every
+QUEUE_BOARD_RELOAD_S seconds; the day rolls over on the first read after midnight.
+
+The board is time-based: current = the last appointment whose slot has started, next = the following
+QUEUE_BOARD_NEXT entries. Its JSON is rendered once per (version, current) and the same bytes (and
+ETag) are served to every display, whether it polls GET /api/queue/{doctor_id} or holds the SSE
+stream, so extra displays cost a dict lookup.
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, select
+from starlette.concurrency import run_in_threadpool
+
+from backend.db import get_session
+from backend.models import Appointment, Doctor
+
+QUEUE_BOARD_NEXT = int(os.getenv("QUEUE_BOARD_NEXT", "5"))
+QUEUE_BOARD_RELOAD_S = float(os.getenv("QUEUE_BOARD_RELOAD_S", "30"))
+QUEUE_BOARD_TICK_S = float(os.getenv("QUEUE_BOARD_TICK_S", "1"))
+QUEUE_BOARD_PING_S = float(os.getenv("QUEUE_BOARD_PING_S", "15"))
+
+
+class _Queue:
+    __slots__ = ("day", "entries", "version", "loaded_at", "noted", "rendered")
+
+    def __init__(self, day, entries: list[tuple[datetime, int, int]]):
+        self.day = day
+        self.entries = entries  # (when, stt, appointment id), sorted
+        self.version = 1
+        self.loaded_at = time.monotonic()
+        self.noted: list[tuple[float, tuple, bool]] = []  # (monotonic ts, entry, removed) from note_*
+        self.rendered: Optional[tuple[tuple, bytes, str]] = None  # (key, body, etag)
+
+
+_LOCK = threading.Lock()
+_QUEUES: dict[int, _Queue] = {}
+_LOADING: dict[int, threading.Lock] = {}  # one (re)load per doctor at a time
+_STATS = {"loads": 0, "renders": 0, "served": 0, "not_modified": 0, "streams_open": 0}
+
+
+def _load(doctor_id: int, day) -> _Queue:
+    lo = datetime.combine(day, dtime.min)
+    with get_session() as db:
+        if db.get(Doctor, doctor_id) is None:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        rows = db.execute(
+            select(Appointment.when, Appointment.stt, Appointment.id)
+            .where(Appointment.doctor_id == doctor_id, Appointment.when >= lo, Appointment.when < lo + timedelta(days=1))
+            .order_by(Appointment.when, Appointment.stt)
+        ).all()
+    return _Queue(day, [(w, int(s or 0), i) for w, s, i in rows])
+
+
+def _fresh(doctor_id: int, now: datetime) -> Optional[_Queue]:
+    q = _QUEUES.get(doctor_id)
+    if q is None or q.day != now.date() or time.monotonic() - q.loaded_at > QUEUE_BOARD_RELOAD_S:
+        return None
+    return q
+
+
+def _render(doctor_id: int, q: _Queue, now: datetime) -> tuple[bytes, str]:
+    cur = bisect.bisect_right(q.entries, (now, float("inf"))) - 1  # last slot started at or before now
+    key = (q.version, cur)
+    with _LOCK:
+        if q.rendered is not None and q.rendered[0] == key:
+            return q.rendered[1], q.rendered[2]
+    def entry(e):
+        return {"stt": e[1], "when": e[0].isoformat()}
+    body = JSONResponse(jsonable_encoder({
+        "doctorId": doctor_id,
+        "date": q.day.isoformat(),
+        "current": entry(q.entries[cur]) if cur >= 0 else None,
+        "next": [entry(e) for e in q.entries[cur + 1: cur + 1 + QUEUE_BOARD_NEXT]],
+        "counts": {"total": len(q.entries), "served": max(cur, 0), "waiting": len(q.entries) - cur - 1},
+        "version": q.version,
+    })).body
+    etag = f'W/"q{doctor_id}-{hashlib.sha1(body).hexdigest()[:16]}"'
+    with _LOCK:
+        q.rendered = (key, body, etag)
+        _STATS["renders"] += 1
+    return body, etag
+
+
+def board(doctor_id: int, load: bool = True) -> Optional[tuple[bytes, str]]:
+    """(JSON body, ETag) of the doctor's board. load=False never touches the DB: it returns None when
+    the queue needs a (re)load (the SSE loop then loads it from the threadpool)."""
+    now = datetime.now()
+    q = _fresh(doctor_id, now)
+    if q is None:
+        if not load:
+            return None
+        with _LOCK:
+            loading = _LOADING.setdefault(doctor_id, threading.Lock())
+        with loading:
+            q = _fresh(doctor_id, now)  # another caller may have just loaded it
+            if q is None:
+                started = time.monotonic()
+                loaded = _load(doctor_id, now.date())
+                with _LOCK:
+                    prev = _QUEUES.get(doctor_id)
+                    if prev is not None and prev.day == loaded.day:
+                        # changes committed while the load ran may be missing from its snapshot
+                        for ts, e, removed in prev.noted:
+                            if ts < started:
+                                continue
+                            if removed:
+                                loaded.entries = [x for x in loaded.entries if x[2] != e[2]]
+                            elif e not in loaded.entries:
+                                bisect.insort(loaded.entries, e)
+                        loaded.version = prev.version + (prev.entries != loaded.entries)
+                    _QUEUES[doctor_id] = q = loaded
+                    _STATS["loads"] += 1
+    return _render(doctor_id, q, now)
+
+
+def note_booked(db, doctor_id: int, when: datetime, stt: int, appt_id: int) -> None:
+    """Add a booking to a loaded queue of today once the caller's transaction commits."""
+    def apply(_session):
+        with _LOCK:
+            q = _QUEUES.get(doctor_id)
+            if q is None or q.day != when.date():
+                return
+            e = (when, int(stt), int(appt_id))
+            bisect.insort(q.entries, e)
+            q.noted.append((time.monotonic(), e, False))
+            q.version += 1
+    if when.date() == datetime.now().date():
+        event.listen(db, "after_commit", apply, once=True)
+
+
+def note_removed(db, doctor_id: int, when: datetime, appt_id: int) -> None:
+    """Drop a cancelled/moved appointment from a loaded queue once the caller's transaction commits."""
+    def apply(_session):
+        with _LOCK:
+            q = _QUEUES.get(doctor_id)
+            if q is None or q.day != when.date():
+                return
+            kept = [e for e in q.entries if e[2] != appt_id]
+            q.noted.append((time.monotonic(), (when, 0, appt_id), True))
+            if len(kept) != len(q.entries):
+                q.entries = kept
+                q.version += 1
+    if when.date() == datetime.now().date():
+        event.listen(db, "after_commit", apply, once=True)
+
+
+async def events(doctor_id: int, request, first: tuple[bytes, str]):
+    """SSE body: the board on connect and on every change, a comment ping every QUEUE_BOARD_PING_S.
+    Each tick is an in-memory check; only a due reload goes to the threadpool."""
+    count("streams_open")
+    try:
+        cur: Optional[tuple[bytes, str]] = first
+        last_etag, last_sent = None, 0.0
+        while not await request.is_disconnected():
+            if cur is None:
+                cur = await run_in_threadpool(board, doctor_id)
+            body, etag = cur
+            if etag != last_etag:
+                yield b"event: board\ndata: " + body + b"\n\n"
+                last_etag, last_sent = etag, time.monotonic()
+            elif time.monotonic() - last_sent >= QUEUE_BOARD_PING_S:
+                yield b": ping\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(QUEUE_BOARD_TICK_S)
+            cur = board(doctor_id, load=False)
+    finally:
+        count("streams_open", -1)
+
+
+def reset() -> None:
+    """Drop every loaded queue (after reset-and-seed); boards and open streams reload on their next tick."""
+    with _LOCK:
+        _QUEUES.clear()
+
+
+def count(name: str, n: int = 1) -> None:
+    with _LOCK:
+        _STATS[name] += n
+
+
+def stats(reset: bool = False) -> dict:
+    with _LOCK:
+        out = {**_STATS, "doctors_loaded": len(_QUEUES), "entries": sum(len(q.entries) for q in _QUEUES.values())}
+        if reset:
+            for k in ("loads", "renders", "served", "not_modified"):
+                _STATS[k] = 0
+    return out
@@ -0,0 +1,108 @@
+"""Schedule consistency audit (GET /api/_admin/schedule/conflicts).
+
+One pass per doctor over sorted streams: the doctor's effective windows (concrete rows + templates,
+as booking validation sees them) and their appointments in the range, both ordered by start.
+- orphaned appointment: its 15-minute slot is not inside a (merged) available window, or it
+  overlaps an OOO window. Two pointers over the merged intervals, because slots all have the
+  same length and so are sorted by end too;
+- overlapping windows: sweep-line with an active set; any two windows of a doctor that overlap
+  (available/OOO, or two of the same kind);
+- duplicate STT: same (doctor, day, stt) on more than one appointment.
+Cost is O(n log n) in windows + appointments, with a fixed handful of queries for the whole range.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy import select
+
+from backend import schedule_rules
+from backend.intervals import IntervalBatch, union
+from backend.models import Appointment
+
+SLOT = timedelta(minutes=15)
+
+
+def _merged(wins_by_doc: dict[int, list[dict]], kind: str) -> dict[int, list[tuple[datetime, datetime]]]:
+    """Union of one kind of window per doctor, all doctors in one vectorized sweep."""
+    pairs = {doc: [(w["start"], w["end"]) for w in wins if w["kind"] == kind] for doc, wins in wins_by_doc.items()}
+    return union(IntervalBatch.from_pairs(pairs)).to_pairs()
+
+
+def _window_ref(w: dict) -> dict:
+    return {"id": w["id"], "kind": w["kind"], "start": w["start"].isoformat(), "end": w["end"].isoformat(),
+            **({"ruleId": w["ruleId"]} if "ruleId" in w else {})}
+
+
+def find_conflicts(db, doctor_ids: list[int], start: datetime, end: datetime, limit: int = 1000) -> dict:
+    t0 = perf_counter()
+    wins_by_doc = schedule_rules.effective_windows(db, doctor_ids, start, end) if doctor_ids else {}
+    appts_by_doc: dict[int, list[tuple[int, datetime, int | None]]] = defaultdict(list)
+    if doctor_ids:
+        rows = db.execute(
+            select(Appointment.doctor_id, Appointment.id, Appointment.when, Appointment.stt)
+            .where(Appointment.doctor_id.in_(doctor_ids), Appointment.when >= start, Appointment.when < end)
+            .order_by(Appointment.doctor_id, Appointment.when, Appointment.id)
+        )
+        for doc_id, appt_id, when, stt in rows:
+            appts_by_doc[doc_id].append((appt_id, when, stt))
+
+    orphans: list[dict] = []
+    overlaps: list[dict] = []
+    dup_stt: list[dict] = []
+    counts = {"orphaned_appointments": 0, "overlapping_windows": 0, "duplicate_stt": 0}
+    av_by_doc, ooo_by_doc = _merged(wins_by_doc, "available"), _merged(wins_by_doc, "ooo")
+    for doc_id in doctor_ids:
+        wins = [w for w in wins_by_doc.get(doc_id, []) if w["kind"] in ("available", "ooo")]
+        appts = appts_by_doc.get(doc_id, [])
+
+        # orphaned appointments
+        av, ooo = av_by_doc.get(doc_id, []), ooo_by_doc.get(doc_id, [])
+        j = k = 0
+        for appt_id, when, stt in appts:
+            e = when + SLOT
+            while j < len(av) and av[j][1] < e:
+                j += 1
+            while k < len(ooo) and ooo[k][1] <= when:
+                k += 1
+            reason = None
+            if not (j < len(av) and av[j][0] <= when):
+                reason = "outside_available"
+            elif k < len(ooo) and ooo[k][0] < e:
+                reason = "overlaps_ooo"
+            if reason:
+                counts["orphaned_appointments"] += 1
+                if len(orphans) < limit:
+                    orphans.append({"id": appt_id, "doctor_id": doc_id, "when": when.isoformat(), "stt": stt, "reason": reason})
+
+        # overlapping window pairs
+        active: list[dict] = []
+        for w in sorted(wins, key=lambda w: (w["start"], w["end"])):
+            active = [a for a in active if a["end"] > w["start"]]
+            for a in active:
+                counts["overlapping_windows"] += 1
+                if len(overlaps) < limit:
+                    overlaps.append({"doctor_id": doc_id, "kinds": f"{a['kind']}/{w['kind']}", "a": _window_ref(a), "b": _window_ref(w)})
+            if w["end"] > w["start"]:
+                active.append(w)
+
+        # duplicate STT per day
+        seen: dict[tuple, list[int]] = defaultdict(list)
+        for appt_id, when, stt in appts:
+            if stt is not None:
+                seen[(when.date(), stt)].append(appt_id)
+        for (day, stt), ids in sorted(seen.items()):
+            if len(ids) > 1:
+                counts["duplicate_stt"] += 1
+                if len(dup_stt) < limit:
+                    dup_stt.append({"doctor_id": doc_id, "day": day.isoformat(), "stt": stt, "appointment_ids": ids})
+
+    return {
+        "counts": counts,
+        "orphaned_appointments": orphans,
+        "overlapping_windows": overlaps,
+        "duplicate_stt": dup_stt,
+        "doctors": len(doctor_ids),
+        "appointments": sum(len(v) for v in appts_by_doc.values()),
+        "ms": round((perf_counter() - t0) * 1000.0, 1),
+    }
@@ -0,0 +1,207 @@
+"""Recurring schedule templates (ScheduleRule) expanded lazily for the requested range.
+
+Effective windows of a doctor-day:
+- if the doctor has concrete ScheduleWindow rows touching that day, those rows (overrides) win;
+- otherwise templates are expanded per kind: availability comes from the most specific scope that
+  has an available rule for that day (doctor > department > hospital), and the OOO rules of every
+  scope are added on top, so a doctor's "off Wednesday afternoon" keeps the hospital's hours.
+A day cleared through bulk-adjust keeps a zero-length CLEARED_KIND row so the template stays hidden.
+
+Template-derived windows carry a string id "v-<doctor>-<YYYYMMDD>-<rule>"; editing one materializes
+the doctor-day into concrete rows first (materialize_day), so the grid UI keeps working on rows.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, or_, and_
+
+from backend.models import Doctor, Department, ScheduleWindow, ScheduleRule
+
+SCOPES = ("doctor", "department", "hospital")  # most specific first
+CLEARED_KIND = "cleared"
+ALL_WEEKDAYS = 0b1111111
+
+SLOT_NOT_AVAILABLE = "Thời gian này không nằm trong khung giờ làm việc (available) của bác sĩ"
+SLOT_OOO = "Khung giờ này trùng thời gian out-of-office của bác sĩ"
+SLOT_BUSY = "Khung giờ này đã có bệnh nhân đặt"
+
+
+def weekdays_mask(days: Optional[Iterable[int]]) -> int:
+    """[0..6] (Mon..Sun) -> bitmask; None/empty -> every day."""
+    mask = 0
+    for d in days or []:
+        if not 0 <= int(d) <= 6:
+            raise ValueError(f"weekday out of range: {d}")
+        mask |= 1 << int(d)
+    return mask or ALL_WEEKDAYS
+
+
+def weekdays_list(mask: int) -> list[int]:
+    return [d for d in range(7) if mask & (1 << d)]
+
+
+def rule_applies(rule: ScheduleRule, day: date) -> bool:
+    if day < rule.date_from or (rule.date_to is not None and day > rule.date_to):
+        return False
+    if not rule.weekdays & (1 << day.weekday()):
+        return False
+    return not rule.exceptions or day.isoformat() not in rule.exceptions
+
+
+def rule_window(rule: ScheduleRule, day: date) -> tuple[datetime, datetime]:
+    start = datetime.combine(day, dtime.min) + timedelta(minutes=rule.start_minute)
+    end = datetime.combine(day, dtime.max) if rule.end_minute >= 1440 else datetime.combine(day, dtime.min) + timedelta(minutes=rule.end_minute)
+    return start, end
+
+
+def virtual_id(doctor_id: int, day: date, rule_id: int) -> str:
+    return f"v-{doctor_id}-{day:%Y%m%d}-{rule_id}"
+
+
+def parse_virtual_id(vid: str) -> Optional[tuple[int, date, int]]:
+    try:
+        _, doc, ymd, rid = vid.split("-")
+        return int(doc), datetime.strptime(ymd, "%Y%m%d").date(), int(rid)
+    except Exception:
+        return None
+
+
+def _days(start: datetime, end: datetime) -> list[date]:
+    d, last = start.date(), end.date()
+    out = []
+    while d <= last:
+        out.append(d)
+        d += timedelta(days=1)
+    return out
+
+
+def doctor_scopes(db, doctor_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """doctor_id -> (department_id, hospital_id) in one query."""
+    if not doctor_ids:
+        return {}
+    rows = db.execute(
+        select(Doctor.id, Doctor.department_id, Department.hospital_id)
+        .join(Department, Doctor.department_id == Department.id)
+        .where(Doctor.id.in_(doctor_ids))
+    ).all()
+    return {doc_id: (dep_id, hosp_id) for doc_id, dep_id, hosp_id in rows}
+
+
+def load_rules(db, scopes: dict[int, tuple[int, int]], day_from: date, day_to: date) -> dict[tuple[str, int], list[ScheduleRule]]:
+    """Rules of any scope relevant to these doctors and overlapping [day_from, day_to], by (scope_kind, scope_id)."""
+    if not scopes:
+        return {}
+    ids = {
+        "doctor": set(scopes),
+        "department": {dep for dep, _ in scopes.values()},
+        "hospital": {h for _, h in scopes.values()},
+    }
+    rules = db.execute(
+        select(ScheduleRule).where(
+            or_(*[and_(ScheduleRule.scope_kind == k, ScheduleRule.scope_id.in_(v)) for k, v in ids.items()]),
+            ScheduleRule.date_from <= day_to,
+            or_(ScheduleRule.date_to.is_(None), ScheduleRule.date_to >= day_from),
+        ).order_by(ScheduleRule.start_minute.asc(), ScheduleRule.id.asc())
+    ).scalars().all()
+    out: dict[tuple[str, int], list[ScheduleRule]] = defaultdict(list)
+    for r in rules:
+        out[(r.scope_kind, r.scope_id)].append(r)
+    return out
+
+
+def expand_day(doctor_id: int, scope: tuple[int, int], rules: dict[tuple[str, int], list[ScheduleRule]], day: date) -> list[dict]:
+    dep_id, hosp_id = scope
+    chosen: list[ScheduleRule] = []
+    have_available = False
+    for kind, sid in (("doctor", doctor_id), ("department", dep_id), ("hospital", hosp_id)):
+        active = [r for r in rules.get((kind, sid), ()) if rule_applies(r, day)]
+        chosen += [r for r in active if r.kind != "available"]
+        if not have_available:
+            available = [r for r in active if r.kind == "available"]
+            chosen += available
+            have_available = bool(available)
+    out = []
+    for r in chosen:
+        s, e = rule_window(r, day)
+        out.append({"id": virtual_id(doctor_id, day, r.id), "start": s, "end": e, "kind": r.kind, "ruleId": r.id})
+    out.sort(key=lambda w: (w["start"], w["ruleId"]))
+    return out
+
+
+def effective_windows(db, doctor_ids: list[int], start: datetime, end: datetime) -> dict[int, list[dict]]:
+    """Windows overlapping [start, end) per doctor: concrete rows plus template windows for doctor-days
+    without rows. Two queries for rows/scopes, one for rules only when some doctor-day needs them."""
+    out: dict[int, list[dict]] = defaultdict(list)
+    if not doctor_ids:
+        return out
+    days = _days(start, end)
+    day_lo = datetime.combine(days[0], dtime.min)
+    day_hi = datetime.combine(days[-1], dtime.max)
+    rows = db.execute(
+        select(ScheduleWindow).where(
+            ScheduleWindow.doctor_id.in_(doctor_ids),
+            ScheduleWindow.start <= day_hi,
+            ScheduleWindow.end >= day_lo,
+        )
+    ).scalars().all()
+    overridden: set[tuple[int, date]] = set()
+    for w in rows:
+        last = w.end - timedelta(microseconds=1) if w.end > w.start else w.end  # end is exclusive
+        for d in _days(max(w.start, day_lo), min(last, day_hi)):
+            overridden.add((w.doctor_id, d))
+        if w.kind != CLEARED_KIND and w.start < end and w.end > start:
+            out[w.doctor_id].append({"id": w.id, "start": w.start, "end": w.end, "kind": w.kind})
+    need = [doc for doc in doctor_ids if any((doc, d) not in overridden for d in days)]
+    if not need:
+        return out
+    scopes = doctor_scopes(db, need)
+    rules = load_rules(db, scopes, days[0], days[-1])
+    if not rules:
+        return out
+    for doc in need:
+        scope = scopes.get(doc)
+        if scope is None:
+            continue
+        for d in days:
+            if (doc, d) in overridden:
+                continue
+            for w in expand_day(doc, scope, rules, d):
+                if w["start"] < end and w["end"] > start:
+                    out[doc].append(w)
+    return out
+
+
+def materialize_day(db, doctor_id: int, day: date, skip_rule_id: Optional[int] = None) -> int:
+    """Turn a template-driven doctor-day into concrete rows (before editing it). No-op if rows exist."""
+    lo, hi = datetime.combine(day, dtime.min), datetime.combine(day, dtime.max)
+    has_rows = db.execute(
+        select(ScheduleWindow.id).where(
+            ScheduleWindow.doctor_id == doctor_id,
+            ScheduleWindow.start <= hi,
+            or_(ScheduleWindow.end > lo, ScheduleWindow.start == lo),
+        ).limit(1)
+    ).scalar_one_or_none()
+    if has_rows:
+        return 0
+    scopes = doctor_scopes(db, [doctor_id])
+    if doctor_id not in scopes:
+        return 0
+    wins = [w for w in expand_day(doctor_id, scopes[doctor_id], load_rules(db, scopes, day, day), day) if w["ruleId"] != skip_rule_id]
+    for w in wins:
+        db.add(ScheduleWindow(doctor_id=doctor_id, start=w["start"], end=w["end"], kind=w["kind"]))
+    if not wins:
+        # the whole template day was removed: keep an explicit marker so the template stays hidden
+        db.add(ScheduleWindow(doctor_id=doctor_id, start=lo, end=lo, kind=CLEARED_KIND))
+    db.flush()
+    return len(wins)
+
+
+def window_error(wins: list[dict], start: datetime, end: datetime) -> Optional[str]:
+    """Booking rule against a doctor's effective windows: the slot must sit fully inside an available
+    window and must not overlap an OOO window. None if fine, else the error message."""
+    if not any(w["kind"] == "available" and w["start"] <= start and w["end"] >= end for w in wins):
+        return SLOT_NOT_AVAILABLE
+    if any(w["kind"] == "ooo" and w["start"] < end and w["end"] > start for w in wins):
+        return SLOT_OOO
+    return None
@@ -0,0 +1,582 @@
+"""Seed hospitals -> departments -> doctors/rooms from JSON files.
+
+Accepted file shapes (hospital objects are streamed one at a time, the file is never loaded whole):
+    [ {hospital}, ... ]
+    {"hospitals": [ {hospital}, ... ]}
+    {hospital}
+hospital   = {"id"?: int, "name": str, "address"?: str, "departments": [department, ...]}
+department = {"name": str, "doctors": [str | {"name", "phone"?, "roles"?}], "rooms": [str | {"code", "name"?}]}
+
+Hospitals are written in batches (SEED_BATCH_SIZE). Each batch resolves existing ids level by level with one
+SELECT and writes the missing rows with one multi-row INSERT ... ON CONFLICT, in its own transaction.
+Several files are seeded in parallel by a process pool (SEED_WORKERS). The pool always spawns fresh
+interpreters: the API process runs threadpool and background threads (booking queue, partitions,
+routing, utilization), and a forked child could inherit a lock one of them holds and hang.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Optional
+
+from sqlalchemy import func, literal_column, null, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.db import engine
+from backend.models import Hospital, Department, Doctor, Room
+
+SEED_DIR = Path(__file__).parent / "seed"
+CANONICAL_FILES = [SEED_DIR / "hospitals.json", SEED_DIR / "hospitals_binhdan.json"]
+
+BATCH_SIZE = int(os.getenv("SEED_BATCH_SIZE", "20"))  # hospitals per transaction
+INSERT_CHUNK = 1000  # rows per multi-row INSERT
+READ_CHUNK = 1 << 20  # bytes read per refill of the streaming parser
+
+
+# --------- Streaming JSON ---------
+_WS = " \t\r\n"
+_DECODER = json.JSONDecoder()
+
+
+class _JsonStream:
+    """Minimal pull parser: walks the top-level array/object and decodes one element at a time."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        data = self.fh.read(READ_CHUNK)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Invalid seed JSON: expected {ch!r}, got {got!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = _DECODER.raw_decode(self.buf, self.pos)
+                # a number ending exactly at the buffer edge may be truncated
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_array(self) -> Iterator:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            c = self.peek()
+            self.pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(f"Invalid seed JSON: expected ',' or ']', got {c!r}")
+
+
+def iter_hospitals(path: Path) -> Iterator[dict]:
+    """Yield raw hospital objects from a seed file without materializing the whole document."""
+    with open(path, encoding="utf-8-sig") as fh:
+        st = _JsonStream(fh)
+        c = st.peek()
+        if c == "[":
+            yield from st.iter_array()
+            return
+        st.expect("{")
+        single: dict = {}
+        streamed = False
+        if st.peek() == "}":
+            return
+        while True:
+            key = st.value()
+            st.expect(":")
+            if key == "hospitals" and st.peek() == "[":
+                yield from st.iter_array()
+                streamed = True
+            else:
+                single[key] = st.value()
+            c = st.peek()
+            st.pos += 1
+            if c == "}":
+                break
+            if c != ",":
+                raise ValueError(f"Invalid seed JSON: expected ',' or '}}', got {c!r}")
+        if not streamed and single.get("name"):
+            yield single
+
+
+# --------- Normalization ---------
+def _s(v) -> Optional[str]:
+    v = str(v).strip() if v is not None else ""
+    return v or None
+
+
+def _norm_hospital(obj: dict) -> Optional[dict]:
+    name = _s(obj.get("name"))
+    if not name:
+        return None
+    deps: dict[str, dict] = {}
+    for d in obj.get("departments") or []:
+        dname = _s(d.get("name")) if isinstance(d, dict) else _s(d)
+        if not dname:
+            continue
+        dep = deps.setdefault(dname.lower(), {"name": dname, "doctors": {}, "rooms": {}})
+        if not isinstance(d, dict):
+            continue
+        for doc in d.get("doctors") or []:
+            doc = doc if isinstance(doc, dict) else {"name": doc}
+            n = _s(doc.get("name"))
+            if n:
+                dep["doctors"][n.lower()] = {"name": n, "phone": _s(doc.get("phone")), "roles": doc.get("roles")}
+        for r in d.get("rooms") or []:
+            r = r if isinstance(r, dict) else {"code": r}
+            code = _s(r.get("code"))
+            if code:
+                dep["rooms"][code] = {"code": code, "name": _s(r.get("name"))}
+    hid = obj.get("id")
+    return {
+        "id": int(hid) if hid not in (None, "") else None,
+        "name": name,
+        "address": _s(obj.get("address")),
+        "departments": deps,
+    }
+
+
+def _merge_into(batch: dict[str, dict], h: dict) -> None:
+    key = f"id:{h['id']}" if h["id"] is not None else f"name:{h['name'].lower()}"
+    cur = batch.get(key)
+    if cur is None:
+        batch[key] = h
+        return
+    cur["address"] = h["address"] or cur["address"]
+    _merge_departments(cur, h)
+
+
+def _merge_departments(dst: dict, src: dict) -> None:
+    for k, dep in src["departments"].items():
+        tgt = dst["departments"].setdefault(k, {"name": dep["name"], "doctors": {}, "rooms": {}})
+        tgt["doctors"].update(dep["doctors"])
+        tgt["rooms"].update(dep["rooms"])
+
+
+def _chunks(rows: list, n: int = INSERT_CHUNK) -> Iterator[list]:
+    for i in range(0, len(rows), n):
+        yield rows[i:i + n]
+
+
+def _new_stats() -> dict:
+    return {
+        "hospitals": {"inserted": 0, "existing": 0},
+        "departments": {"inserted": 0, "existing": 0},
+        "doctors": {"inserted": 0, "existing": 0, "updated": 0},
+        "rooms": {"inserted": 0, "updated": 0},
+        "batches": 0,
+        "explicit_ids": 0,
+    }
+
+
+# --------- Bulk writer (one transaction per batch) ---------
+def _seed_batch(conn, hospitals: list[dict], st: dict) -> None:
+    # Serialize concurrent seeders (process pool / parallel requests) on the same hospital names.
+    conn.execute(
+        text(
+            "SELECT count(pg_advisory_xact_lock(hashtext(x))) "
+            "FROM (SELECT x FROM unnest(CAST(:keys AS text[])) AS x ORDER BY x) s"
+        ),
+        {"keys": sorted({"medly_seed:" + h["name"].lower() for h in hospitals})},
+    )
+
+    # 1) hospitals: resolve by id (if given) else lower(name)
+    ids = [h["id"] for h in hospitals if h["id"] is not None]
+    names = [h["name"].lower() for h in hospitals]
+    by_id: dict[int, int] = {}
+    by_name: dict[str, int] = {}
+    for hid, lname in conn.execute(
+        text("SELECT id, lower(name) FROM hospitals WHERE id = ANY(:ids) OR lower(name) = ANY(:names)"),
+        {"ids": ids, "names": names},
+    ):
+        by_id[hid] = hid
+        by_name.setdefault(lname, hid)
+
+    def resolve(h: dict) -> Optional[int]:
+        return by_id.get(h["id"]) if h["id"] is not None else by_name.get(h["name"].lower())
+
+    existing = [h for h in hospitals if resolve(h) is not None]
+    st["hospitals"]["existing"] += len(existing)
+    addr = [(resolve(h), h["address"]) for h in existing if h["address"]]
+    if addr:
+        conn.execute(
+            text(
+                "UPDATE hospitals h SET address = v.address "
+                "FROM unnest(CAST(:ids AS int[]), CAST(:addrs AS text[])) AS v(id, address) "
+                "WHERE h.id = v.id AND h.address IS DISTINCT FROM v.address"
+            ),
+            {"ids": [a[0] for a in addr], "addrs": [a[1] for a in addr]},
+        )
+    missing = [h for h in hospitals if resolve(h) is None]
+    with_id = [{"id": h["id"], "name": h["name"], "address": h["address"]} for h in missing if h["id"] is not None]
+    no_id = [{"name": h["name"], "address": h["address"]} for h in missing if h["id"] is None]
+    inserted = 0
+    for chunk in _chunks(with_id):
+        for hid, _ in conn.execute(
+            pg_insert(Hospital).values(chunk).on_conflict_do_nothing(index_elements=["id"]).returning(Hospital.id, Hospital.name)
+        ):
+            by_id[hid] = hid
+            inserted += 1
+        st["explicit_ids"] += len(chunk)
+    lost = [r["id"] for r in with_id if r["id"] not in by_id]
+    if lost:
+        # lost an insert race on the id: the row exists now, treat it as existing
+        for (hid,) in conn.execute(text("SELECT id FROM hospitals WHERE id = ANY(:ids)"), {"ids": lost}):
+            by_id[hid] = hid
+        st["hospitals"]["existing"] += len(lost)
+    for chunk in _chunks(no_id):
+        for hid, name in conn.execute(pg_insert(Hospital).values(chunk).returning(Hospital.id, Hospital.name)):
+            by_name[name.lower()] = hid
+            inserted += 1
+    st["hospitals"]["inserted"] += inserted
+
+    # 2) departments: unique (hospital_id, name)
+    wanted_deps: dict[tuple[int, str], dict] = {}
+    for h in hospitals:
+        hid = resolve(h)
+        if hid is None:
+            continue
+        for k, dep in h["departments"].items():
+            wanted_deps[(hid, k)] = dep
+    if not wanted_deps:
+        return
+    hids = sorted({k[0] for k in wanted_deps})
+    dep_ids: dict[tuple[int, str], int] = {}
+    for did, hid, lname in conn.execute(
+        text("SELECT id, hospital_id, lower(name) FROM departments WHERE hospital_id = ANY(:hids)"), {"hids": hids}
+    ):
+        dep_ids.setdefault((hid, lname), did)
+    st["departments"]["existing"] += sum(1 for k in wanted_deps if k in dep_ids)
+    new_deps = [{"hospital_id": k[0], "name": d["name"]} for k, d in wanted_deps.items() if k not in dep_ids]
+    for chunk in _chunks(new_deps):
+        rows = conn.execute(
+            pg_insert(Department).values(chunk)
+            .on_conflict_do_nothing(constraint="uq_department_hospital_name")
+            .returning(Department.id, Department.hospital_id, Department.name)
+        ).all()
+        for did, hid, name in rows:
+            dep_ids[(hid, name.lower())] = did
+        st["departments"]["inserted"] += len(rows)
+    if any(k not in dep_ids for k in wanted_deps):
+        # lost an insert race on the unique constraint: pick up the winner's ids
+        for did, hid, lname in conn.execute(
+            text("SELECT id, hospital_id, lower(name) FROM departments WHERE hospital_id = ANY(:hids)"), {"hids": hids}
+        ):
+            dep_ids.setdefault((hid, lname), did)
+
+    # 3) doctors: resolve by (department_id, lower(name)); refresh phone/roles when provided
+    wanted_docs: dict[tuple[int, str], dict] = {}
+    wanted_rooms: dict[tuple[int, str], dict] = {}
+    for (hid, k), dep in wanted_deps.items():
+        did = dep_ids.get((hid, k))
+        if did is None:
+            continue
+        for dk, doc in dep["doctors"].items():
+            wanted_docs[(did, dk)] = doc
+        for code, r in dep["rooms"].items():
+            wanted_rooms[(hid, code)] = {"hospital_id": hid, "department_id": did, "code": code, "name": r["name"]}
+    if wanted_docs:
+        dids = sorted({k[0] for k in wanted_docs})
+        cur_docs: dict[tuple[int, str], tuple[int, Optional[str], Optional[list]]] = {}
+        for doc_id, did, lname, phone, roles in conn.execute(
+            text("SELECT id, department_id, lower(name), phone, roles FROM doctors WHERE department_id = ANY(:dids)"),
+            {"dids": dids},
+        ):
+            cur_docs.setdefault((did, lname), (doc_id, phone, roles))
+        upd = []
+        for k, doc in wanted_docs.items():
+            cur = cur_docs.get(k)
+            if cur is None:
+                continue
+            phone = doc["phone"] if doc["phone"] is not None else cur[1]
+            roles = doc["roles"] if doc["roles"] is not None else cur[2]
+            if (phone, roles) != (cur[1], cur[2]):
+                upd.append((cur[0], phone, json.dumps(roles) if roles is not None else None))
+        st["doctors"]["existing"] += sum(1 for k in wanted_docs if k in cur_docs)
+        if upd:
+            conn.execute(
+                text(
+                    "UPDATE doctors d SET phone = v.phone, roles = CAST(v.roles AS jsonb) "
+                    "FROM unnest(CAST(:ids AS int[]), CAST(:phones AS text[]), CAST(:roles AS text[])) AS v(id, phone, roles) "
+                    "WHERE d.id = v.id"
+                ),
+                {"ids": [u[0] for u in upd], "phones": [u[1] for u in upd], "roles": [u[2] for u in upd]},
+            )
+            st["doctors"]["updated"] += len(upd)
+        new_docs = [
+            {"department_id": k[0], "name": d["name"], "phone": d["phone"], "roles": d["roles"] if d["roles"] is not None else null()}
+            for k, d in wanted_docs.items() if k not in cur_docs
+        ]
+        for chunk in _chunks(new_docs):
+            conn.execute(pg_insert(Doctor).values(chunk))
+        st["doctors"]["inserted"] += len(new_docs)
+
+    # 4) rooms: unique (hospital_id, code); xmax = 0 distinguishes inserted from updated rows
+    rooms = list(wanted_rooms.values())
+    for chunk in _chunks(rooms):
+        stmt = pg_insert(Room).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_room_hospital_code",
+            set_={
+                "department_id": stmt.excluded.department_id,
+                "name": func.coalesce(stmt.excluded.name, Room.name),
+            },
+        ).returning(literal_column("(xmax = 0)"))
+        flags = conn.execute(stmt).scalars().all()
+        ins = sum(1 for f in flags if f)
+        st["rooms"]["inserted"] += ins
+        st["rooms"]["updated"] += len(flags) - ins
+
+
+def _seed_file(path: str) -> dict:
+    t0 = perf_counter()
+    st = _new_stats()
+    batch: dict[str, dict] = {}
+
+    def flush():
+        if batch:
+            with engine.begin() as conn:
+                _seed_batch(conn, list(batch.values()), st)
+            st["batches"] += 1
+            batch.clear()
+
+    for raw in iter_hospitals(Path(path)):
+        h = _norm_hospital(raw) if isinstance(raw, dict) else None
+        if h is None:
+            continue
+        _merge_into(batch, h)
+        if len(batch) >= BATCH_SIZE:
+            flush()
+    flush()
+    return {"file": str(path), **st, "ms": round((perf_counter() - t0) * 1000.0, 1)}
+
+
+def _seed_file_safe(path: str) -> dict:
+    try:
+        return _seed_file(path)
+    except Exception as e:
+        return {"file": str(path), "error": f"{type(e).__name__}: {e}"}
+
+
+def _fix_hospital_sequence() -> None:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('hospitals','id'), GREATEST(COALESCE((SELECT MAX(id) FROM hospitals), 0), 1))"
+        ))
+
+
+# --------- Public API ---------
+def seed_files(files: list, workers: Optional[int] = None) -> dict:
+    """Seed the given JSON files; files are processed in parallel when more than one worker is allowed."""
+    t0 = perf_counter()
+    paths = [Path(f) for f in files]
+    todo = [str(p) for p in paths if p.is_file()]
+    results = [{"file": str(p), "error": "not found"} for p in paths if not p.is_file()]
+    workers = workers or int(os.getenv("SEED_WORKERS", "0")) or min(len(todo), os.cpu_count() or 1, 4)
+    if workers > 1 and len(todo) > 1:
+        # spawned children import this module afresh, with their own engine and pool
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+            results = list(ex.map(_seed_file_safe, todo)) + results
+    else:
+        results = [_seed_file_safe(p) for p in todo] + results
+    if any(r.get("explicit_ids") for r in results):
+        _fix_hospital_sequence()
+
+    totals = _new_stats()
+    for r in results:
+        for level in ("hospitals", "departments", "doctors", "rooms"):
+            for k, v in (r.get(level) or {}).items():
+                totals[level][k] += v
+    totals.pop("explicit_ids")
+    totals["batches"] = sum(r.get("batches", 0) for r in results)
+    return {
+        "files": results,
+        "totals": totals,
+        "workers": max(1, min(workers, len(todo))),
+        "ms": round((perf_counter() - t0) * 1000.0, 1),
+    }
+
+
+def seed_path(path: str, pattern: str = "*.json", recursive: bool = False) -> dict:
+    """Seed every file under `path` matching `pattern` (or `path` itself if it is a file)."""
+    p = Path(path)
+    if p.is_file():
+        return seed_files([p])
+    files = sorted(p.rglob(pattern) if recursive else p.glob(pattern))
+    return seed_files([f for f in files if f.is_file()])
+
+
+def seed_two_files_only() -> dict:
+    """Seed from the canonical backend/seed files that are present."""
+    return seed_files([f for f in CANONICAL_FILES if f.exists()])
+
+
+def upsert_hospitals_json(path) -> dict:
+    """Seed a single file in-process (used by /api/_admin/reset-and-seed)."""
+    st = _seed_file(str(path))
+    if st.get("explicit_ids"):
+        _fix_hospital_sequence()
+    return st
+
+
+# --------- Fast reset: COPY into truncated tables ---------
+# every table holding ids of the rows below, FK or not: RESTART IDENTITY recycles those ids, so a
+# leftover archive pack, template, stored response or queue entry would attach to the new rows
+RESET_TABLES = ", ".join([
+    "appointments", "schedule_windows", "doctors", "rooms", "departments", "users", "hospitals",
+    "appointments_archive", "schedule_rules", "idempotency_keys", "booking_queue", "waitlist_entries",
+    "routing_terms", "routing_state", "utilization_daily", "utilization_dirty", "utilization_state",
+    "calendar_versions",
+])
+_COPY_COLUMNS = {
+    "hospitals": ("id", "name", "address"),
+    "departments": ("id", "name", "hospital_id"),
+    "doctors": ("id", "name", "department_id", "phone", "roles"),
+    "rooms": ("id", "department_id", "hospital_id", "code", "name"),
+}
+
+
+def _stage_csv(files: list, fixed_hospitals: dict[int, str]) -> tuple[dict[str, io.StringIO], dict[str, int]]:
+    """Merge the seed files in memory, assign ids client-side and render one CSV buffer per table."""
+    by_id: dict[int, dict] = {}
+    by_name: dict[str, dict] = {}
+    pending: list[dict] = []  # hospitals without an id in the file and no name match yet
+    for hid, name in fixed_hospitals.items():
+        h = {"id": hid, "name": name, "address": None, "departments": {}}
+        by_id[hid] = by_name[name.lower()] = h
+    for f in files:
+        for raw in iter_hospitals(Path(f)):
+            h = _norm_hospital(raw) if isinstance(raw, dict) else None
+            if h is None:
+                continue
+            cur = by_id.get(h["id"]) if h["id"] is not None else None
+            cur = cur or by_name.get(h["name"].lower())
+            if cur is None:
+                cur = {"id": h["id"], "name": h["name"], "address": None, "departments": {}}
+                if h["id"] is not None:
+                    by_id[h["id"]] = cur
+                else:
+                    pending.append(cur)
+                by_name[h["name"].lower()] = cur
+            cur["address"] = h["address"] or cur["address"]
+            _merge_departments(cur, h)
+    next_id = max(by_id, default=0) + 1
+    for h in pending:
+        h["id"] = next_id
+        by_id[next_id] = h
+        next_id += 1
+
+    bufs = {t: io.StringIO() for t in _COPY_COLUMNS}
+    w = {t: csv.writer(b, lineterminator="\n") for t, b in bufs.items()}
+    counts = dict.fromkeys(_COPY_COLUMNS, 0)
+    dep_id = doc_id = room_id = 0
+    for hid in sorted(by_id):
+        h = by_id[hid]
+        w["hospitals"].writerow((hid, h["name"], h["address"]))
+        counts["hospitals"] += 1
+        seen_codes: set[str] = set()
+        for dep in h["departments"].values():
+            dep_id += 1
+            w["departments"].writerow((dep_id, dep["name"], hid))
+            for doc in dep["doctors"].values():
+                doc_id += 1
+                roles = json.dumps(doc["roles"], ensure_ascii=False) if doc["roles"] is not None else None
+                w["doctors"].writerow((doc_id, doc["name"], dep_id, doc["phone"], roles))
+            for code, r in dep["rooms"].items():
+                if code in seen_codes:  # unique (hospital_id, code)
+                    continue
+                seen_codes.add(code)
+                room_id += 1
+                w["rooms"].writerow((room_id, dep_id, hid, code, r["name"]))
+    counts.update(departments=dep_id, doctors=doc_id, rooms=room_id)
+    for b in bufs.values():
+        b.seek(0)
+    return bufs, counts
+
+
+def copy_reset_and_seed(files: list, fixed_hospitals: Optional[dict[int, str]] = None) -> dict:
+    """Truncate core tables and reload them with COPY FROM STDIN, all in one transaction.
+    Sequences are moved past the loaded ids and the summary comes from one grouped query.
+    """
+    t0 = perf_counter()
+    bufs, counts = _stage_csv([f for f in files if Path(f).is_file()], fixed_hospitals or {})
+    t_staged = perf_counter()
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(f"TRUNCATE TABLE {RESET_TABLES} RESTART IDENTITY CASCADE")
+        for table, cols in _COPY_COLUMNS.items():  # parents first for FK checks
+            cur.copy_expert(f"COPY {table} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", bufs[table])
+            cur.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}','id'), "
+                f"GREATEST(COALESCE((SELECT MAX(id) FROM {table}), 0), 1), (SELECT COUNT(*) > 0 FROM {table}))"
+            )
+        # feed ETags are built from these versions: start them at the reset time, not 0, so an ETag
+        # held from before the reset (client or worker cache) can never match a recycled doctor id
+        cur.execute(
+            "INSERT INTO calendar_versions (doctor_id, version, changed_at) "
+            "SELECT id, extract(epoch FROM now())::bigint, now() AT TIME ZONE 'utc' FROM doctors"
+        )
+        cur.execute(
+            """
+            SELECT h.id, h.name, COUNT(DISTINCT d.id) AS departments, COUNT(doc.id) AS doctors
+            FROM hospitals h
+            LEFT JOIN departments d ON d.hospital_id = h.id
+            LEFT JOIN doctors doc ON doc.department_id = d.id
+            GROUP BY h.id, h.name
+            ORDER BY h.id
+            """
+        )
+        summary = [{"id": hid, "name": name, "departments": int(dc), "doctors": int(dr)} for hid, name, dc, dr in cur.fetchall()]
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    t_done = perf_counter()
+    return {
+        "hospitals": summary,
+        "rows": counts,
+        "ms": {
+            "stage": round((t_staged - t0) * 1000.0, 1),
+            "load": round((t_done - t_staged) * 1000.0, 1),
+            "total": round((t_done - t0) * 1000.0, 1),
+        },
+    }
@@ -0,0 +1,269 @@
+"""Symptom text -> department routing learned from past appointments (GET /api/route-symptoms).
+
+Every appointment is one document: its `symptoms`, `content["symptoms"]` and the symptoms of the
+user's latest conversation in the ROUTING_CONVERSATION_HOURS before booking, labelled with the
+doctor's department. Terms are textnorm.fold()ed words plus the word pairs inside each phrase
+("dau bung" says more than "dau"), counted once per document.
+
+The index is shared by every worker in routing_terms (term, department id -> documents) and
+routing_state (migration 20261019_0200). A query reads only the posting lists of its own terms with
+one primary-key range lookup. Each query term adds idf * (its documents in the department / its
+documents) to that department's score. The scores are then divided by the total idf of the matched
+terms, so a department that every term points to gets a score of 1.
+- refresh() adds only the appointments created since the last run, using the created_at index.
+  Runs overlap by ROUTING_OVERLAP_S, and ids already seen are skipped, so a row that commits late
+  is not lost
+- a full rebuild every ROUTING_REBUILD_HOURS drops cancelled/moved appointments from the counts and
+  also reads the archived months (appointments_archive packs), so the history is not cut to the live
+  partitions
+- one refresh at a time across workers (transaction advisory try-lock), and the rebuild schedule is
+  in routing_state, so the scan runs once per interval whatever the worker count;
+  start_refresh() runs it every ROUTING_REFRESH_S in a daemon thread (0: only on first use)
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend import textnorm
+from backend.db import get_read_session, get_session
+from backend.models import Appointment, Conversation, Department, Doctor, Hospital, RoutingState, RoutingTerm
+
+ROUTING_REFRESH_S = float(os.getenv("ROUTING_REFRESH_S", "300"))
+ROUTING_REBUILD_HOURS = float(os.getenv("ROUTING_REBUILD_HOURS", "24"))
+ROUTING_CONVERSATION_HOURS = float(os.getenv("ROUTING_CONVERSATION_HOURS", "24"))
+ROUTING_OVERLAP_S = float(os.getenv("ROUTING_OVERLAP_S", "120"))
+ROUTING_WRITE_CHUNK = int(os.getenv("ROUTING_WRITE_CHUNK", "5000"))
+
+_PHRASES = re.compile(r"[,;.\n/()]+")
+_WORDS = re.compile(r"[a-z0-9]+")
+
+
+def terms(*texts) -> set[str]:
+    """Folded words (2+ chars) and adjacent word pairs of every phrase in the texts."""
+    out: set[str] = set()
+    for t in texts:
+        for phrase in _PHRASES.split(textnorm.fold(t)):
+            words = [w for w in _WORDS.findall(phrase) if len(w) > 1]
+            out.update(words)
+            out.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return out
+
+
+class _Delta:
+    """Postings counted by one refresh, merged into routing_terms at the end."""
+
+    def __init__(self, watermark: Optional[datetime] = None, recent: Optional[dict[int, datetime]] = None):
+        self.postings: Counter = Counter()  # (term, department id) -> documents
+        self.docs = 0
+        self.watermark = watermark  # max created_at indexed
+        self.recent: dict[int, datetime] = dict(recent or {})  # ids indexed inside the overlap window
+        self.added = 0
+
+    def add(self, appt_id: int, dept_id: int, created_at: Optional[datetime], toks: set[str], track: bool = True) -> None:
+        if track and appt_id in self.recent:
+            return
+        self.added += 1
+        if track and created_at is not None:
+            self.recent[appt_id] = created_at
+            if self.watermark is None or created_at > self.watermark:
+                self.watermark = created_at
+        if not toks:
+            return
+        self.docs += 1
+        for t in toks:
+            self.postings[(t, dept_id)] += 1
+
+
+# archived appointments, unpacked in SQL, with the same conversation lookup as the live query
+_ARCHIVE_SQL = """
+SELECT (r->>'id')::int, (r->>'created_at')::timestamp, d.department_id, r->>'symptoms', r->'content'->'symptoms',
+       (SELECT c.symptoms FROM conversations c
+        WHERE c.user_id = a.user_id AND c.symptoms IS NOT NULL
+          AND c.created_at <= (r->>'created_at')::timestamp
+          AND c.created_at > (r->>'created_at')::timestamp - make_interval(secs => :hours * 3600)
+        ORDER BY c.created_at DESC LIMIT 1)
+FROM appointments_archive a
+CROSS JOIN LATERAL jsonb_array_elements(a.rows) AS r
+JOIN doctors d ON d.id = (r->>'doctor_id')::int
+"""
+
+
+def _add_rows(delta: _Delta, rows, track: bool = True) -> None:
+    for appt_id, created_at, dept_id, sym, content_sym, conv_sym in rows:
+        if isinstance(content_sym, list):
+            content_sym = ", ".join(str(s) for s in content_sym)
+        elif not isinstance(content_sym, str):
+            content_sym = None
+        delta.add(appt_id, dept_id, created_at, terms(sym, content_sym, conv_sym), track)
+
+
+def _load(db, delta: _Delta, archived: bool = False) -> None:
+    conv = (
+        select(Conversation.symptoms)
+        .where(Conversation.user_id == Appointment.user_id, Conversation.symptoms.isnot(None),
+               Conversation.created_at <= Appointment.created_at,
+               Conversation.created_at > Appointment.created_at - timedelta(hours=ROUTING_CONVERSATION_HOURS))
+        .order_by(Conversation.created_at.desc())
+        .limit(1)
+        .correlate(Appointment)
+        .scalar_subquery()
+    )
+    q = (
+        select(Appointment.id, Appointment.created_at, Doctor.department_id, Appointment.symptoms,
+               Appointment.content["symptoms"], conv)
+        .join(Doctor, Appointment.doctor_id == Doctor.id)
+    )
+    since = delta.watermark - timedelta(seconds=ROUTING_OVERLAP_S) if delta.watermark else None
+    if since is not None:
+        q = q.where(Appointment.created_at > since)
+    _add_rows(delta, db.execute(q.execution_options(yield_per=5000)))
+    if archived:
+        # archived months are far behind the watermark, so they stay out of the overlap bookkeeping
+        _add_rows(delta, db.execute(text(_ARCHIVE_SQL).execution_options(yield_per=5000), {"hours": ROUTING_CONVERSATION_HOURS}),
+                  track=False)
+    if delta.watermark is not None:
+        cutoff = delta.watermark - timedelta(seconds=ROUTING_OVERLAP_S)
+        delta.recent = {i: c for i, c in delta.recent.items() if c > cutoff}
+
+
+def refresh(full: bool = False) -> dict:
+    """Add appointments created since the last run (or rebuild from scratch when due / `full`) in one
+    transaction; skipped while another worker is refreshing."""
+    t0 = time.perf_counter()
+    with get_session() as db:
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('symptom_routing_refresh'))")).scalar():
+            return {"skipped": True}
+        state = db.get(RoutingState, 1)
+        now = datetime.utcnow()
+        rebuild = full or state is None or now - state.built_at >= timedelta(hours=ROUTING_REBUILD_HOURS)
+        if rebuild:
+            delta = _Delta()
+        else:
+            delta = _Delta(state.watermark, {int(i): datetime.fromisoformat(c) for i, c in state.recent.items()})
+        with get_read_session() as rdb:
+            _load(rdb, delta, archived=rebuild)
+        if rebuild:
+            db.execute(delete(RoutingTerm))
+        rows = [{"term": t, "department_id": d, "docs": n} for (t, d), n in delta.postings.items()]
+        for i in range(0, len(rows), ROUTING_WRITE_CHUNK):
+            stmt = pg_insert(RoutingTerm).values(rows[i:i + ROUTING_WRITE_CHUNK])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[RoutingTerm.term, RoutingTerm.department_id],
+                set_={"docs": RoutingTerm.docs + stmt.excluded.docs},
+            ))
+        if state is None:
+            state = RoutingState(id=1, docs=0, built_at=now, refreshed_at=now)
+            db.add(state)
+        state.docs = delta.docs if rebuild else state.docs + delta.docs
+        state.watermark = delta.watermark
+        state.recent = {str(i): c.isoformat() for i, c in delta.recent.items()}
+        if rebuild:
+            state.built_at = now
+        state.refreshed_at = now
+        return {"rebuilt": rebuild, "added": delta.added, "postings": len(rows),
+                "ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+
+
+def route(q: str, limit: int = 5, hospital_id: Optional[int] = None) -> dict:
+    """Best departments for free symptom text, plus the same scores summed per department name."""
+    t0 = time.perf_counter()
+    qterms = sorted(terms(q))
+    with get_read_session() as db:
+        docs = db.scalar(select(RoutingState.docs).where(RoutingState.id == 1))
+        if docs is None:  # never built: build it now (skipped if another worker is building it)
+            refresh()
+            docs = db.scalar(select(RoutingState.docs).where(RoutingState.id == 1)) or 0
+        postings: dict[str, dict[int, int]] = defaultdict(dict)
+        if qterms:
+            for t, dep_id, n in db.execute(
+                select(RoutingTerm.term, RoutingTerm.department_id, RoutingTerm.docs).where(RoutingTerm.term.in_(qterms))
+            ):
+                postings[t][dep_id] = n
+        scores: Counter = Counter()
+        matched, total = [], 0.0
+        for t in qterms:
+            post = postings.get(t)
+            if not post:
+                continue
+            df = sum(post.values())
+            idf = math.log(1.0 + docs / df)
+            matched.append(t)
+            total += idf
+            for dep_id, n in post.items():
+                scores[dep_id] += idf * n / df
+        deps = {
+            dep_id: (name, hosp_id, hosp_name)
+            for dep_id, name, hosp_id, hosp_name in db.execute(
+                select(Department.id, Department.name, Hospital.id, Hospital.name)
+                .join(Hospital, Department.hospital_id == Hospital.id)
+                .where(Department.id.in_(list(scores)))
+            )
+        } if scores else {}
+    if hospital_id is not None:
+        scores = Counter({d: s for d, s in scores.items() if deps.get(d, (None, None))[1] == hospital_id})
+    departments = []
+    by_name: dict[str, list] = {}
+    for dep_id, s in scores.most_common():
+        name, hosp_id, hosp_name = deps.get(dep_id, (None, None, None))
+        score = round(s / total, 4)
+        if len(departments) < limit:
+            departments.append({"departmentId": dep_id, "department": name, "hospitalId": hosp_id,
+                                "hospitalName": hosp_name, "score": score})
+        if name:
+            agg = by_name.setdefault(textnorm.fold(name), [name, 0.0])
+            agg[1] += s / total
+    names = sorted(({"department": n, "score": round(s, 4)} for n, s in by_name.values()), key=lambda x: -x["score"])
+    return {
+        "departments": departments,
+        "names": names[:limit],
+        "matchedTerms": matched,
+        "unknownTerms": [t for t in qterms if t not in matched and " " not in t],
+        "docs": docs,
+        "us": round((time.perf_counter() - t0) * 1e6, 1),
+    }
+
+
+def stats() -> dict:
+    with get_read_session() as db:
+        state = db.get(RoutingState, 1)
+        if state is None:
+            return {"built": False}
+        n_terms, n_deps = db.execute(
+            select(func.count(func.distinct(RoutingTerm.term)), func.count(func.distinct(RoutingTerm.department_id)))
+        ).one()
+        return {
+            "built": True,
+            "docs": state.docs,
+            "terms": n_terms,
+            "departments": n_deps,
+            "watermark": state.watermark.isoformat() if state.watermark else None,
+            "builtAt": state.built_at.isoformat(),
+            "refreshedAt": state.refreshed_at.isoformat(),
+        }
+
+
+def _refresh_loop(interval_s: float, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            refresh()
+        except Exception as e:
+            print(f"[symptom_routing] refresh failed: {e}")
+        stop.wait(interval_s)
+
+
+def start_refresh(seconds: Optional[float] = None) -> Optional[threading.Event]:
+    """Background thread keeping the index current every `seconds`; returns its stop event (None = disabled)."""
+    seconds = ROUTING_REFRESH_S if seconds is None else seconds
+    if seconds <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_refresh_loop, args=(seconds, stop), name="symptom-routing", daemon=True).start()
+    return stop
@@ -0,0 +1,14 @@
+"""Accent/case folding for name lookups ("Tim Mạch" == "tim mach" == "TIM  MACH")."""
+import re
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def fold(s: str | None) -> str:
+    """Lowercase, strip diacritics (đ -> d), collapse whitespace."""
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFD", s.replace("đ", "d").replace("Đ", "D"))
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    return _SPACES.sub(" ", s).strip().lower()
@@ -1,6 +1,7 @@
 import contextvars
 import logging
 import os
+from contextlib import contextmanager
 from time import perf_counter
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -57,3 +58,39 @@ class TimingMiddleware(BaseHTTPMiddleware):
             request.method, request.url.path, total, agg["ms"], agg["q"]
         )
         return resp
+
+
+# --------- Load shedding (backend/admission.py) ---------
+# (reason, "METHOD /path") -> count; reason: rate_limited (429) | overloaded (503)
+SHED_COUNTS: dict[tuple[str, str], int] = {}
+
+
+def record_shed(reason: str, route: str) -> None:
+    SHED_COUNTS[(reason, route)] = SHED_COUNTS.get((reason, route), 0) + 1
+    logging.getLogger("apptime").info("%s -> shed (%s)", route, reason)
+
+
+def shed_counts(reset: bool = False) -> dict:
+    out: dict = {"total": sum(SHED_COUNTS.values()), "by_reason": {}, "by_route": {}}
+    for (reason, route), n in SHED_COUNTS.items():
+        out["by_reason"][reason] = out["by_reason"].get(reason, 0) + n
+        out["by_route"].setdefault(route, {})[reason] = n
+    if reset:
+        SHED_COUNTS.clear()
+    return out
+
+
+# --------- Startup profiling ---------
+# (stage, ms) in execution order; read by /api/_debug/startup and `python -m backend.manage profile-startup`
+STARTUP_STAGES: list[tuple[str, float]] = []
+
+
+@contextmanager
+def startup_stage(name: str):
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        dt = (perf_counter() - t0) * 1000.0
+        STARTUP_STAGES.append((name, dt))
+        logging.getLogger("apptime").info("startup stage %s -> %.1f ms", name, dt)
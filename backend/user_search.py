@@ -0,0 +1,87 @@
+"""As-you-type patient search over users (GET /api/users/search).
+
+- digits only (spaces, dots, dashes, + ignored): prefix of phone or CCCD. Two index-ordered streams,
+  (phone COLLATE "C", id) and (cccd COLLATE "C", id), are merged; a user whose phone already
+  matches is left out of the CCCD stream, so nobody appears twice
+- anything else: every word of textnorm.fold(q) must start a word of users.name_folded
+  ("ng an" finds "Nguyễn Văn An"), ordered by (name_folded, id). Words of 3+ characters also go
+  through the pg_trgm GIN index
+- keyset pagination: `nextCursor` encodes the last (sort key, id), so each page is one index range
+  scan of limit + 1 rows whatever its depth
+- hospitalId keeps users with an appointment at that hospital (EXISTS over the (user_id, "when") index)
+"""
+import base64
+import json
+import re
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, or_, tuple_
+
+from backend import textnorm
+from backend.models import Appointment, Department, Doctor, User
+
+_WORDS = re.compile(r"[a-z0-9]+")
+_DIGITS = re.compile(r"[\d\s.+-]+")
+
+
+def _encode(key: str, user_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([key, user_id]).encode()).decode().rstrip("=")
+
+
+def _decode(cursor: Optional[str]) -> Optional[tuple[str, int]]:
+    if not cursor:
+        return None
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(key), int(user_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _at_hospital(hospital_id: int):
+    return (
+        select(Appointment.id)
+        .join(Doctor, Appointment.doctor_id == Doctor.id)
+        .join(Department, Doctor.department_id == Department.id)
+        .where(Appointment.user_id == User.id, Department.hospital_id == hospital_id)
+        .exists()
+    )
+
+
+def _page(db, key, conds, after, n) -> list[tuple]:
+    q = select(key, User.id, User.name, User.phone, User.cccd).where(*conds)
+    if after is not None:
+        q = q.where(tuple_(key, User.id) > tuple_(*after))
+    return [tuple(r) for r in db.execute(q.order_by(key, User.id).limit(n))]
+
+
+def search(db, q: str, hospital_id: Optional[int] = None, limit: int = 20, cursor: Optional[str] = None) -> dict:
+    t0 = time.perf_counter()
+    after = _decode(cursor)
+    base = [_at_hospital(hospital_id)] if hospital_id is not None else []
+    q = (q or "").strip()
+    rows: list[tuple] = []
+    if q and _DIGITS.fullmatch(q):
+        digits = re.sub(r"\D", "", q)
+        if digits:  # separators only ("-", "+") match nothing rather than every phone
+            phone, cccd = User.phone.collate("C"), User.cccd.collate("C")
+            rows = [r + ("phone",) for r in _page(db, phone, base + [phone.like(f"{digits}%")], after, limit + 1)]
+            rows += [r + ("cccd",) for r in _page(db, cccd, base + [cccd.like(f"{digits}%"), ~phone.like(f"{digits}%")], after, limit + 1)]
+            rows.sort(key=lambda r: (r[0], r[1]))
+    elif words := _WORDS.findall(textnorm.fold(q)):
+        key = User.name_folded
+        conds = base + [or_(key.like(f"{w}%"), key.like(f"% {w}%")) for w in words]
+        longest = max(words, key=len)
+        if len(longest) >= 3:
+            conds.append(key.like(f"%{longest}%"))  # trigram-indexable
+        rows = [r + ("name",) for r in _page(db, key, conds, after, limit + 1)]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "results": [{"id": str(uid), "name": name, "phone": phone, "cccd": cccd, "matched": matched}
+                    for _, uid, name, phone, cccd, matched in rows],
+        "nextCursor": _encode(rows[-1][0], rows[-1][1]) if more else None,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
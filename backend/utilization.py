@@ -0,0 +1,260 @@
+"""Doctor utilization: booked 15-minute blocks over available minutes minus OOO (GET /api/analytics/utilization).
+
+Facts are precomputed per doctor-day into utilization_daily and kept current incrementally:
+- triggers on appointments, schedule_windows and schedule_rules append the touched (scope, day range)
+  to utilization_dirty, so every write path is covered, Core bulk statements included;
+- refresh() drains that table (DELETE ... RETURNING: rows committed meanwhile wait for the next run)
+  and expands each range to its doctors (a rule can be department- or hospital-wide). It then
+  recomputes only those doctor-days, plus every doctor for the days that entered the
+  UTIL_HORIZON_DAYS horizon since the last run. The first run backfills UTIL_BACKFILL_DAYS;
+- a doctor-day is computed with the vectorized interval ops keyed by doctor-day: union of available,
+  its intersection with OOO, minutes summed with np.bincount; bookings come from one GROUP BY.
+  Work is chunked per month and UTIL_BATCH_DOCTORS doctors;
+- one refresh at a time across workers (transaction advisory try-lock); start_refresh() runs it
+  every UTIL_REFRESH_S in a daemon thread.
+aggregate() reads the facts of a day range once into arrays and sums every (group, bucket) cell with
+np.bincount, so day/week/month and doctor/department/hospital views cost the same.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Date, select, delete, insert, func, text, tuple_
+
+from backend import schedule_rules
+from backend.booking import SLOT
+from backend.db import get_session
+from backend.intervals import IntervalBatch, US_PER_MINUTE, union, intersect
+from backend.models import Appointment, Department, Doctor, Hospital, UtilizationDaily, UtilizationDirty, UtilizationState
+
+UTIL_HORIZON_DAYS = int(os.getenv("UTIL_HORIZON_DAYS", "90"))
+UTIL_BACKFILL_DAYS = int(os.getenv("UTIL_BACKFILL_DAYS", "365"))
+UTIL_BATCH_DOCTORS = int(os.getenv("UTIL_BATCH_DOCTORS", "500"))
+UTIL_REFRESH_S = float(os.getenv("UTIL_REFRESH_S", "300"))
+
+SLOT_MIN = int(SLOT.total_seconds() // 60)
+GRANULARITIES = ("day", "week", "month")
+GROUPS = ("doctor", "department", "hospital", "all")
+
+_DAY_BITS = 20  # interval key = doctor_id << 20 | day ordinal (ordinals stay below 2**20 until year 2870)
+
+
+def _key(doctor_id: int, day: date) -> int:
+    return (doctor_id << _DAY_BITS) | day.toordinal()
+
+
+def _minutes(batch: IntervalBatch) -> dict[int, int]:
+    if not len(batch):
+        return {}
+    keys, inv = np.unique(batch.keys, return_inverse=True)
+    total = np.bincount(inv, weights=(batch.ends - batch.starts).astype(np.float64))
+    return dict(zip(keys.tolist(), np.rint(total / US_PER_MINUTE).astype(np.int64).tolist()))
+
+
+def compute(db, pairs: dict[int, set[date]]) -> list[dict]:
+    """Facts of these doctor-days (doctor -> days); doctor-days with no availability and no bookings are left out."""
+    if not pairs:
+        return []
+    lo = min(min(days) for days in pairs.values())
+    hi = max(max(days) for days in pairs.values())
+    start, end = datetime.combine(lo, dtime.min), datetime.combine(hi + timedelta(days=1), dtime.min)
+    av: dict[int, list] = defaultdict(list)
+    ooo: dict[int, list] = defaultdict(list)
+    for doc_id, ws in schedule_rules.effective_windows(db, sorted(pairs), start, end).items():
+        days = pairs[doc_id]
+        for w in ws:
+            target = av if w["kind"] == "available" else ooo if w["kind"] == "ooo" else None
+            if target is None:
+                continue
+            d = w["start"].date()
+            while (d0 := datetime.combine(d, dtime.min)) < w["end"]:
+                if d in days:
+                    s, e = max(w["start"], d0), min(w["end"], d0 + timedelta(days=1))
+                    if s < e:
+                        target[_key(doc_id, d)].append((s, e))
+                d += timedelta(days=1)
+    available = union(IntervalBatch.from_pairs(av))
+    available_min = _minutes(available)
+    ooo_min = _minutes(intersect(available, union(IntervalBatch.from_pairs(ooo))))
+    booked: dict[int, int] = {}
+    for doc_id, day, n in db.execute(
+        select(Appointment.doctor_id, func.date(Appointment.when, type_=Date), func.count())
+        .where(Appointment.doctor_id.in_(list(pairs)), Appointment.when >= start, Appointment.when < end)
+        .group_by(Appointment.doctor_id, func.date(Appointment.when, type_=Date))
+    ):
+        if day in pairs[doc_id]:
+            booked[_key(doc_id, day)] = int(n)
+    rows = []
+    for doc_id, days in pairs.items():
+        for d in days:
+            k = _key(doc_id, d)
+            a, o, b = available_min.get(k, 0), ooo_min.get(k, 0), booked.get(k, 0)
+            if a or b:
+                rows.append({"day": d, "doctor_id": doc_id, "available_min": a, "ooo_min": o, "booked": b})
+    return rows
+
+
+def _members(db) -> tuple[list[int], dict[tuple[str, int], list[int]]]:
+    """All doctor ids, and the doctors of every (scope_kind, scope_id)."""
+    members: dict[tuple[str, int], list[int]] = defaultdict(list)
+    doctors = []
+    for doc_id, dep_id, hosp_id in db.execute(
+        select(Doctor.id, Doctor.department_id, Department.hospital_id).join(Department, Doctor.department_id == Department.id)
+    ):
+        doctors.append(doc_id)
+        members[("doctor", doc_id)].append(doc_id)
+        members[("department", dep_id)].append(doc_id)
+        members[("hospital", hosp_id)].append(doc_id)
+    return doctors, members
+
+
+def refresh(today: Optional[date] = None) -> dict:
+    """Recompute the stale doctor-days (everything on the first run) in one transaction."""
+    t0 = time.perf_counter()
+    today = today or date.today()
+    until = today + timedelta(days=UTIL_HORIZON_DAYS)
+    with get_session() as db:
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('utilization_refresh'))")).scalar():
+            return {"skipped": True}
+        state = db.get(UtilizationState, 1)
+        dirty = db.execute(
+            delete(UtilizationDirty).returning(UtilizationDirty.scope_kind, UtilizationDirty.scope_id,
+                                               UtilizationDirty.day_from, UtilizationDirty.day_to)
+        ).all()
+        doctors, members = _members(db)
+        if state is None:
+            state = UtilizationState(id=1, computed_from=today - timedelta(days=UTIL_BACKFILL_DAYS), computed_until=until)
+            db.add(state)
+            ranges = [(doctors, state.computed_from, until)]
+        else:
+            ranges = [(members.get((kind, sid), []), max(lo, state.computed_from), min(hi or until, max(until, state.computed_until)))
+                      for kind, sid, lo, hi in dirty]
+            if until > state.computed_until:
+                ranges.append((doctors, state.computed_until + timedelta(days=1), until))
+                state.computed_until = until
+        by_month: dict[tuple[int, int], dict[int, set[date]]] = defaultdict(lambda: defaultdict(set))
+        for docs, lo, hi in ranges:
+            d = lo
+            while d <= hi:
+                month = by_month[(d.year, d.month)]
+                for doc_id in docs:
+                    month[doc_id].add(d)
+                d += timedelta(days=1)
+        doctor_days = written = 0
+        for _, month in sorted(by_month.items()):
+            ids = sorted(month)
+            for i in range(0, len(ids), UTIL_BATCH_DOCTORS):
+                part = {doc_id: month[doc_id] for doc_id in ids[i:i + UTIL_BATCH_DOCTORS]}
+                rows = compute(db, part)
+                keys = [(doc_id, d) for doc_id, days in part.items() for d in days]
+                db.execute(delete(UtilizationDaily).where(tuple_(UtilizationDaily.doctor_id, UtilizationDaily.day).in_(keys)))
+                if rows:
+                    db.execute(insert(UtilizationDaily), rows)
+                doctor_days += len(keys)
+                written += len(rows)
+        state.last_run_at = datetime.utcnow()
+        return {
+            "dirty": len(dirty),
+            "doctorDays": doctor_days,
+            "rows": written,
+            "computedFrom": state.computed_from.isoformat(),
+            "computedUntil": state.computed_until.isoformat(),
+            "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        }
+
+
+def _buckets(days: np.ndarray, granularity: str) -> np.ndarray:
+    if granularity == "week":
+        return days - (days.astype(np.int64) + 3) % 7  # Monday (1970-01-01 was a Thursday)
+    if granularity == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    return days
+
+
+def aggregate(db, doctor_ids: Optional[list[int]], day_from: date, day_to: date,
+              granularity: str = "day", group_by: str = "doctor") -> dict:
+    """Per group (doctor/department/hospital/all) and bucket (day/week/month): minutes, bookings, utilization."""
+    q = select(UtilizationDaily.doctor_id, UtilizationDaily.day, UtilizationDaily.available_min,
+               UtilizationDaily.ooo_min, UtilizationDaily.booked).where(UtilizationDaily.day >= day_from, UtilizationDaily.day <= day_to)
+    if doctor_ids is not None:
+        q = q.where(UtilizationDaily.doctor_id.in_(doctor_ids))
+    rows = db.execute(q).all()
+    state = db.get(UtilizationState, 1)
+    pending = db.scalar(select(func.count()).select_from(UtilizationDirty))
+    out = {
+        "groupBy": group_by,
+        "granularity": granularity,
+        "computedFrom": state.computed_from.isoformat() if state else None,
+        "computedUntil": state.computed_until.isoformat() if state else None,
+        "pendingChanges": int(pending or 0),
+        "groups": [],
+    }
+    if not rows:
+        return out
+    doc, day, avail, ooo, booked = (np.asarray(c) for c in zip(*rows))
+    doc = doc.astype(np.int64)
+    udoc, dinv = np.unique(doc, return_inverse=True)
+    info = {
+        r[0]: r for r in db.execute(
+            select(Doctor.id, Doctor.name, Department.id, Department.name, Hospital.id, Hospital.name)
+            .join(Department, Doctor.department_id == Department.id)
+            .join(Hospital, Department.hospital_id == Hospital.id)
+            .where(Doctor.id.in_(udoc.tolist()))
+        )
+    }
+    col = {"doctor": 0, "department": 2, "hospital": 4}.get(group_by)
+    names = {}
+    gid_of_doc = np.zeros(len(udoc), dtype=np.int64)
+    for i, d in enumerate(udoc.tolist()):
+        r = info.get(d)
+        if col is not None and r is not None:
+            gid_of_doc[i] = r[col]
+            names[r[col]] = r[col + 1]
+    groups, ginv = np.unique(gid_of_doc[dinv], return_inverse=True)
+    buckets, binv = np.unique(_buckets(np.array(day, dtype="datetime64[D]"), granularity), return_inverse=True)
+    nb = len(buckets)
+    cell = ginv * nb + binv
+    n = len(groups) * nb
+    count = np.bincount(cell, minlength=n)
+    sums = {name: np.bincount(cell, weights=arr.astype(np.float64), minlength=n).astype(np.int64)
+            for name, arr in (("available", avail), ("ooo", ooo), ("booked", booked))}
+
+    def _entry(a: int, o: int, b: int) -> dict:
+        cap = a - o
+        return {"availableMin": a, "oooMin": o, "capacityMin": cap, "bookedSlots": b, "bookedMin": b * SLOT_MIN,
+                "utilization": round(b * SLOT_MIN / cap, 4) if cap > 0 else None}
+
+    bucket_starts = [str(b) for b in buckets]
+    for gi, gid in enumerate(groups.tolist()):
+        cells = range(gi * nb, gi * nb + nb)
+        series = [{"start": bucket_starts[c - gi * nb], **_entry(int(sums["available"][c]), int(sums["ooo"][c]), int(sums["booked"][c]))}
+                  for c in cells if count[c]]
+        total = _entry(*(int(sums[m][gi * nb:(gi + 1) * nb].sum()) for m in ("available", "ooo", "booked")))
+        out["groups"].append({"id": gid if col is not None else None, "name": names.get(gid) if col is not None else "all",
+                              "total": total, "buckets": series})
+    return out
+
+
+def _refresh_loop(interval_s: float, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            res = refresh()
+            if res.get("doctorDays"):
+                print(f"[utilization] recomputed {res['doctorDays']} doctor-days in {res['ms']} ms")
+        except Exception as e:
+            print(f"[utilization] refresh failed: {e}")
+        stop.wait(interval_s)
+
+
+def start_refresh(seconds: Optional[float] = None) -> Optional[threading.Event]:
+    """Background thread running refresh() every `seconds`; returns its stop event (None = disabled)."""
+    seconds = UTIL_REFRESH_S if seconds is None else seconds
+    if seconds <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_refresh_loop, args=(seconds, stop), name="utilization-refresh", daemon=True).start()
+    return stop
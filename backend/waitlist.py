@@ -0,0 +1,184 @@
+"""Cancellation, reschedule and a per doctor-day waitlist backfilled from freed time.
+
+A waitlist entry asks for any slot of one doctor on one day. Whenever time frees up on a doctor-day
+(cancel, reschedule away, a new entry, a re-pack after a schedule change), repack() fills the free
+slots of those doctor-days from their waitlists in one pass:
+- the doctors are locked with the advisory key booking.book_slot() and the queue workers use;
+- one query loads the waiting entries of every affected doctor-day into a heap per doctor-day
+  (priority desc, then oldest); each match is one heappop, O(log n);
+- free slots come from booking.free_slot_starts() for all doctor-days at once;
+- the earliest free slot goes to the best entry, with STT = max + 1 of that doctor-day;
+- the new appointments get rooms in one rooms.assign() over their department-days.
+displace() turns appointments left outside availability (e.g. by a hospital-wide OOO change) into
+WAITLIST_DISPLACED_PRIORITY entries of the same doctor-day, keeping their original booking order,
+and re-packs all of them together.
+"""
+import heapq
+import os
+from collections import defaultdict
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, delete, func, tuple_, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from backend import booking, queue_board, rooms
+from backend.models import Appointment, WaitlistEntry
+
+WAITLIST_DISPLACED_PRIORITY = int(os.getenv("WAITLIST_DISPLACED_PRIORITY", "100"))
+SLOT = booking.SLOT
+
+
+def repack(db, pairs: Iterable[tuple[int, date]], now: Optional[datetime] = None,
+           also_rooms: Iterable[tuple[int, datetime]] = ()) -> list[dict]:
+    """Book waiting entries of these doctor-days into their free slots. Runs in the caller's transaction.
+    The new appointments and `also_rooms` ((doctor_id, when) the caller moved) get rooms in one
+    rooms.assign(), so the department locks are taken once, in order."""
+    booked = _fill(db, pairs, now or datetime.now())
+    items = list(also_rooms) + [(b["doctorId"], datetime.fromisoformat(b["when"])) for b in booked]
+    if items:
+        rooms.assign(db, *items)
+    return booked
+
+
+def _fill(db, pairs: Iterable[tuple[int, date]], now: datetime) -> list[dict]:
+    pairs = sorted({(int(d), day) for d, day in pairs if day >= now.date()})
+    if not pairs:
+        return []
+    booking.lock_doctors(db, [d for d, _ in pairs])
+    heaps: dict[tuple[int, date], list] = defaultdict(list)
+    for e in db.execute(
+        select(WaitlistEntry).where(WaitlistEntry.status == "waiting", tuple_(WaitlistEntry.doctor_id, WaitlistEntry.day).in_(pairs))
+    ).scalars():
+        heaps[(e.doctor_id, e.day)].append((-e.priority, e.created_at or now, e.id, e))
+    pairs = [p for p in pairs if p in heaps]
+    if not pairs:
+        return []
+    for h in heaps.values():
+        heapq.heapify(h)
+    slots = booking.free_slot_starts(db, [
+        (doc_id, max(datetime.combine(day, dtime.min), now), datetime.combine(day + timedelta(days=1), dtime.min))
+        for doc_id, day in pairs
+    ])
+    stt = booking.max_stt(db, pairs)
+    booked = []
+    for k, pair in enumerate(pairs):
+        heap = heaps[pair]
+        for start in slots.get(k, []):
+            if not heap:
+                break
+            entry = heapq.heappop(heap)[-1]
+            stt[pair] = n = stt.get(pair, 0) + 1
+            appt = booking.create_appointment(db, pair[0], start, n, user_id=entry.user_id, need=entry.need, symptoms=entry.symptoms)
+            entry.status, entry.appointment_id, entry.booked_at = "booked", appt.id, datetime.utcnow()
+            booked.append({"waitlistId": entry.id, "userId": entry.user_id, "doctorId": pair[0],
+                           "appointmentId": appt.id, "when": start.isoformat(), "stt": n})
+    db.flush()
+    return booked
+
+
+def join(db, entry: WaitlistEntry) -> list[dict]:
+    """Add an entry and immediately try its doctor-day (it may already have free time)."""
+    if entry.day < datetime.now().date():
+        raise HTTPException(status_code=400, detail="Ngày đã qua")
+    db.add(entry)
+    db.flush()
+    return repack(db, [(entry.doctor_id, entry.day)])
+
+
+def cancel(db, appt: Appointment) -> list[dict]:
+    """Delete the appointment (busy time is derived from rows) and backfill its doctor-day."""
+    if appt.when < datetime.now():
+        raise HTTPException(status_code=409, detail="Không thể hủy lịch đã qua")
+    booking.lock_doctors(db, [appt.doctor_id])
+    doctor_id, when, appt_id = appt.doctor_id, appt.when, appt.id
+    db.execute(delete(Appointment).where(Appointment.id == appt_id, Appointment.when == when))
+    queue_board.note_removed(db, doctor_id, when, appt_id)
+    return repack(db, [(doctor_id, when.date())])
+
+
+def reschedule(db, appt: Appointment, when: datetime, doctor_id: Optional[int] = None) -> list[dict]:
+    """Move the appointment (same validation as booking, ignoring itself), then backfill the old doctor-day.
+    STT is kept on the same doctor-day, otherwise it is the next STT of the new one."""
+    old_doc, old_when = appt.doctor_id, appt.when
+    new_doc = int(doctor_id) if doctor_id is not None else old_doc
+    booking.lock_doctors(db, [old_doc, new_doc])
+    err = booking.check_slot(db, new_doc, when, when + SLOT, exclude_id=appt.id)
+    if err:
+        raise HTTPException(status_code=409, detail=err)
+    stt = appt.stt
+    if (new_doc, when.date()) != (old_doc, old_when.date()):
+        stt = booking.next_stt(db, new_doc, when.date())
+    # Core UPDATE on (id, old when) so Postgres prunes to the old month's partition (an ORM flush
+    # would UPDATE by id alone); the loaded object is synced without being marked dirty
+    t = Appointment.__table__
+    db.execute(
+        update(t).where(t.c.id == appt.id, t.c.when == old_when).values(doctor_id=new_doc, when=when, stt=stt, room_id=None)
+    )
+    for attr, value in (("doctor_id", new_doc), ("when", when), ("stt", stt), ("room_id", None)):
+        set_committed_value(appt, attr, value)
+    queue_board.note_removed(db, old_doc, old_when, appt.id)
+    queue_board.note_booked(db, new_doc, when, appt.stt, appt.id)
+    return repack(db, [(old_doc, old_when.date())], also_rooms=[(new_doc, when)])
+
+
+def displace(db, appointment_ids: list[int]) -> dict:
+    """Move these (future) appointments to the waitlist of their doctor-day, then re-pack in one pass."""
+    now = datetime.now()
+    appts = db.execute(
+        select(Appointment).where(Appointment.id.in_(appointment_ids), Appointment.when >= now)
+    ).scalars().all() if appointment_ids else []
+    if not appts:
+        return {"displaced": 0, "rebooked": [], "waiting": 0}
+    booking.lock_doctors(db, [a.doctor_id for a in appts])
+    for a in appts:
+        db.add(WaitlistEntry(user_id=a.user_id, doctor_id=a.doctor_id, day=a.when.date(), priority=WAITLIST_DISPLACED_PRIORITY,
+                             need=a.need, symptoms=a.symptoms, created_at=a.created_at or datetime.utcnow()))
+        queue_board.note_removed(db, a.doctor_id, a.when, a.id)
+    pairs = {(a.doctor_id, a.when.date()) for a in appts}
+    db.execute(delete(Appointment).where(tuple_(Appointment.id, Appointment.when).in_([(a.id, a.when) for a in appts])))
+    db.flush()
+    rebooked = repack(db, pairs, now)
+    return {"displaced": len(appts), "rebooked": rebooked, "waiting": len(appts) - len(rebooked)}
+
+
+def entries(db, user_id: Optional[int] = None, doctor_id: Optional[int] = None, day: Optional[date] = None) -> list[dict]:
+    """Entries with their current position in their doctor-day (window function over waiting rows)."""
+    position = func.row_number().over(
+        partition_by=(WaitlistEntry.doctor_id, WaitlistEntry.day),
+        order_by=(WaitlistEntry.priority.desc(), WaitlistEntry.created_at, WaitlistEntry.id),
+    )
+    waiting = select(WaitlistEntry.id, position.label("position")).where(WaitlistEntry.status == "waiting")
+    q = select(WaitlistEntry)
+    if user_id is not None:
+        q = q.where(WaitlistEntry.user_id == user_id)
+    if doctor_id is not None:
+        q = q.where(WaitlistEntry.doctor_id == doctor_id)
+        waiting = waiting.where(WaitlistEntry.doctor_id == doctor_id)
+    if day is not None:
+        q = q.where(WaitlistEntry.day == day)
+        waiting = waiting.where(WaitlistEntry.day == day)
+    rows = db.execute(q.order_by(WaitlistEntry.day, WaitlistEntry.doctor_id, WaitlistEntry.id)).scalars().all()
+    pos = {}
+    pairs = {(e.doctor_id, e.day) for e in rows if e.status == "waiting"}
+    if pairs:
+        waiting = waiting.where(tuple_(WaitlistEntry.doctor_id, WaitlistEntry.day).in_(pairs))
+        pos = dict(db.execute(waiting).all())
+    return [entry_dict(e, pos.get(e.id)) for e in rows]
+
+
+def entry_dict(e: WaitlistEntry, position: Optional[int] = None) -> dict:
+    return {
+        "id": e.id,
+        "userId": e.user_id,
+        "doctorId": e.doctor_id,
+        "day": e.day.isoformat(),
+        "priority": e.priority,
+        "need": e.need,
+        "symptoms": e.symptoms,
+        "status": e.status,
+        "position": position,
+        "appointmentId": e.appointment_id,
+        "bookedAt": e.booked_at.isoformat() if e.booked_at else None,
+    }
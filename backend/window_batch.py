@@ -0,0 +1,255 @@
+"""Batched window edits (POST /api/dev/windows/batch) for the drag-and-drop schedule grid.
+
+apply_ops() runs in the caller's transaction:
+1. one prefetch: the rows referenced by id, the doctors, and the effective windows of every doctor-day
+   the batch touches (old and new position of each window);
+2. template-driven touched days are materialized in memory (their template windows become pending
+   rows, still addressable by their "v-..." ids), as materialize_day() does per request; a "v-..." id
+   of a day materialized earlier resolves to the row its template produced, like DELETE does;
+3. ops are validated in order against that snapshot with the same rules as PUT /api/dev/windows
+   (exact duplicate -> skipped, OOO may not overlap available); each op sees the earlier ones;
+4. the surviving changes are written with one DELETE, one executemany UPDATE and one multi-row INSERT.
+A failed op is reported in its result and leaves the snapshot unchanged; with atomic=True any failure
+aborts the whole batch before anything is written.
+"""
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, delete, insert, update
+
+from backend import schedule_rules
+from backend.models import Doctor, ScheduleWindow, ScheduleRule
+
+OPS = ("create", "update", "delete")
+KINDS = ("available", "ooo")
+
+
+class OpError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _parse_dt(value: Optional[str]) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except Exception:
+        raise OpError(400, "Invalid start/end")
+
+
+def _span_days(start: datetime, end: datetime) -> list[date]:
+    last = end - timedelta(microseconds=1) if end > start else end  # end is exclusive
+    days, d = [], start.date()
+    while d <= last.date():
+        days.append(d)
+        d += timedelta(days=1)
+    return days
+
+
+class _Snapshot:
+    """Windows of the touched doctor-days; entries are dicts with key/id/alias/doctor_id/start/end/kind/state."""
+
+    def __init__(self):
+        self.items: list[dict] = []
+        self.by_id: dict[int, dict] = {}
+        self.by_alias: dict[str, dict] = {}
+        self.materialized: set[tuple[int, date]] = set()
+
+    def add(self, item: dict) -> dict:
+        item["key"] = len(self.items)
+        self.items.append(item)
+        if item.get("id") is not None:
+            self.by_id[item["id"]] = item
+        if item.get("alias"):
+            self.by_alias[item["alias"]] = item
+        return item
+
+    def live(self, doctor_id: int):
+        return (it for it in self.items if it["state"] != "deleted" and it["doctor_id"] == doctor_id)
+
+    def resolve(self, window_id: Optional[str]) -> dict:
+        wid = str(window_id or "")
+        it = self.by_id.get(int(wid)) if wid.isdigit() else self.by_alias.get(wid)
+        if it is None or it["state"] == "deleted":
+            raise OpError(404, "Not found")
+        return it
+
+
+def _targets(op) -> tuple[Optional[int], Optional[str]]:
+    """(real id, virtual id) referenced by an update/delete."""
+    wid = str(op.id or "")
+    if wid.isdigit():
+        return int(wid), None
+    return None, wid or None
+
+
+def _prefetch(db, ops) -> tuple[_Snapshot, set[int]]:
+    ids = {rid for o in ops if o.op in ("update", "delete") for rid in [_targets(o)[0]] if rid is not None}
+    rows = db.execute(select(ScheduleWindow).where(ScheduleWindow.id.in_(ids))).scalars().all() if ids else []
+    touched: set[tuple[int, date]] = set()
+    for r in rows:
+        touched.update((r.doctor_id, d) for d in _span_days(r.start, r.end))
+    doc_ids = {r.doctor_id for r in rows}
+    for o in ops:
+        if o.op in ("update", "delete"):
+            parsed = schedule_rules.parse_virtual_id(_targets(o)[1] or "")
+            if parsed:
+                touched.add((parsed[0], parsed[1]))
+                doc_ids.add(parsed[0])
+        if o.op in ("create", "update") and o.start and o.end:
+            try:
+                s, e = datetime.fromisoformat(o.start), datetime.fromisoformat(o.end)
+            except ValueError:
+                continue
+            doc = o.doctorId
+            if doc is None and o.op == "update":
+                rid = _targets(o)[0]
+                row = next((r for r in rows if r.id == rid), None)
+                parsed = schedule_rules.parse_virtual_id(_targets(o)[1] or "")
+                doc = row.doctor_id if row else (parsed[0] if parsed else None)
+            if doc is not None and s < e:
+                touched.update((doc, d) for d in _span_days(s, e))
+                doc_ids.add(doc)
+    existing = set(db.execute(select(Doctor.id).where(Doctor.id.in_(doc_ids))).scalars().all()) if doc_ids else set()
+
+    snap = _Snapshot()
+    if touched:
+        lo = datetime.combine(min(d for _, d in touched), dtime.min)
+        hi = datetime.combine(max(d for _, d in touched) + timedelta(days=1), dtime.min)
+        wins = schedule_rules.effective_windows(db, sorted(existing), lo, hi)
+        for doc_id, ws in wins.items():
+            for w in ws:
+                parsed = schedule_rules.parse_virtual_id(w["id"]) if "ruleId" in w else None
+                if parsed is None:
+                    snap.add({"id": w["id"], "alias": None, "doctor_id": doc_id, "start": w["start"], "end": w["end"],
+                              "kind": w["kind"], "state": "orig"})
+                elif (doc_id, parsed[1]) in touched:
+                    # template day being edited: its windows become rows on write
+                    snap.materialized.add((doc_id, parsed[1]))
+                    snap.add({"id": None, "alias": w["id"], "doctor_id": doc_id, "start": w["start"], "end": w["end"],
+                              "kind": w["kind"], "state": "new"})
+    # "v-..." ids of days materialized earlier (stale in the grid): the row the template produced
+    stale = {}
+    for o in ops:
+        vid = _targets(o)[1] if o.op in ("update", "delete") else None
+        parsed = schedule_rules.parse_virtual_id(vid or "")
+        if parsed and vid not in snap.by_alias:
+            stale[vid] = parsed
+    if stale:
+        rules = {r.id: r for r in db.execute(select(ScheduleRule).where(ScheduleRule.id.in_({p[2] for p in stale.values()}))).scalars()}
+        for vid, (doc_id, day, rule_id) in stale.items():
+            rule = rules.get(rule_id)
+            if rule is None:
+                continue
+            s, e = schedule_rules.rule_window(rule, day)
+            it = next((it for it in snap.live(doc_id) if it["kind"] == rule.kind and it["start"] == s and it["end"] == e), None)
+            if it is not None:
+                snap.by_alias[vid] = it
+    return snap, existing
+
+
+def _check(snap: _Snapshot, doctor_id: int, kind: str, start: datetime, end: datetime, self_key: Optional[int]):
+    """Same rules as PUT /api/dev/windows. Returns the exact duplicate (if any)."""
+    others = [it for it in snap.live(doctor_id) if it["key"] != self_key]
+    dup = next((it for it in others if it["kind"] == kind and it["start"] == start and it["end"] == end), None)
+    if dup is not None:
+        return dup
+    if kind == "ooo" and any(it["kind"] == "available" and it["start"] < end and it["end"] > start for it in others):
+        raise OpError(409, "Out-of-office overlaps available time")
+    return None
+
+
+def _apply_op(snap: _Snapshot, doctors: set[int], op) -> dict:
+    if op.op not in OPS:
+        raise OpError(400, "op must be create|update|delete")
+    if op.op == "delete":
+        it = snap.resolve(op.id)
+        it["state"] = "deleted"
+        return {"item": it}
+    it = snap.resolve(op.id) if op.op == "update" else None
+    doctor_id = op.doctorId if op.doctorId is not None else (it["doctor_id"] if it else None)
+    kind = op.kind or (it["kind"] if it else None)
+    if doctor_id is None:
+        raise OpError(400, "doctorId is required")
+    if doctor_id not in doctors:
+        raise OpError(404, "Doctor not found")
+    if kind not in KINDS:
+        raise OpError(400, "Invalid kind")
+    start = _parse_dt(op.start) if op.start or not it else it["start"]
+    end = _parse_dt(op.end) if op.end or not it else it["end"]
+    if end <= start:
+        raise OpError(400, "end must be after start")
+    dup = _check(snap, doctor_id, kind, start, end, it["key"] if it else None)
+    if dup is not None:
+        # moving a window onto an identical one merges them (PUT + DELETE did the same)
+        if it is not None:
+            it["state"] = "deleted"
+        return {"item": dup, "skipped": True}
+    if it is None:
+        it = snap.add({"id": None, "alias": None, "doctor_id": doctor_id, "start": start, "end": end, "kind": kind, "state": "new"})
+    else:
+        it.update(doctor_id=doctor_id, start=start, end=end, kind=kind)
+        if it["state"] == "orig":
+            it["state"] = "dirty"
+    return {"item": it}
+
+
+def _result(i: int, op, out: dict) -> dict:
+    it = out["item"]
+    res = {"index": i, "op": op.op, "ok": True, "id": it["id"] if it["id"] is not None else it["alias"]}
+    if op.ref is not None:
+        res["ref"] = op.ref
+    if out.get("skipped"):
+        res["skipped"] = True
+    return res
+
+
+def apply_ops(db, ops: list, atomic: bool = False) -> tuple[list[dict], bool]:
+    """Validate and write the batch. Returns (per-op results, anything written)."""
+    snap, doctors = _prefetch(db, ops)
+    results: list[dict] = []
+    pending: list[tuple[dict, dict]] = []  # (result, snapshot item) whose id is assigned on INSERT
+    for i, op in enumerate(ops):
+        try:
+            out = _apply_op(snap, doctors, op)
+        except OpError as e:
+            res = {"index": i, "op": op.op, "ok": False, "status": e.status_code, "detail": e.detail}
+            if op.ref is not None:
+                res["ref"] = op.ref
+            results.append(res)
+            continue
+        res = _result(i, op, out)
+        if op.op != "delete" and out["item"]["id"] is None:
+            pending.append((res, out["item"]))
+        results.append(res)
+    if atomic and not all(r["ok"] for r in results):
+        for res, _ in pending:
+            res["id"] = None
+        return results, False
+
+    deleted = [it["id"] for it in snap.items if it["state"] == "deleted" and it["id"] is not None]
+    dirty = [it for it in snap.items if it["state"] == "dirty"]
+    new = [it for it in snap.items if it["state"] == "new"]
+    # a template day left without any window keeps a marker so the template stays hidden
+    for doctor_id, day in sorted(snap.materialized):
+        lo, hi = datetime.combine(day, dtime.min), datetime.combine(day + timedelta(days=1), dtime.min)
+        if not any(it["start"] < hi and (it["end"] > lo or it["start"] == lo) for it in snap.live(doctor_id)):
+            new.append({"id": None, "doctor_id": doctor_id, "start": lo, "end": lo, "kind": schedule_rules.CLEARED_KIND})
+    if deleted:
+        db.execute(delete(ScheduleWindow).where(ScheduleWindow.id.in_(deleted)))
+    if dirty:
+        db.execute(update(ScheduleWindow), [
+            {"id": it["id"], "doctor_id": it["doctor_id"], "start": it["start"], "end": it["end"], "kind": it["kind"]}
+            for it in dirty
+        ])
+    if new:
+        ids = db.scalars(
+            insert(ScheduleWindow).returning(ScheduleWindow.id, sort_by_parameter_order=True),
+            [{"doctor_id": it["doctor_id"], "start": it["start"], "end": it["end"], "kind": it["kind"]} for it in new],
+        ).all()
+        for it, new_id in zip(new, ids):
+            it["id"] = new_id
+    for res, it in pending:
+        res["id"] = it["id"]
+    return results, bool(deleted or dirty or new)
@@ -363,28 +363,24 @@ function DoctorRowGrid({ doc, hours, days, onSelect, selection, department, hosp
     end.setMinutes(end.getMinutes() + endMins);
     const kind = el.classList.contains("avail-block") ? "available" : "ooo";
     const existingId = el.getAttribute("data-id");
-  const createRes = await fetch(devApi(`/api/dev/windows`), {
-      method: "PUT",
+    // one request: move/resize the existing window in place (or create it), validated server-side
+    const op = existingId
+      ? { op: "update", id: existingId, start: toLocalNaiveISO(start), end: toLocalNaiveISO(end), kind }
+      : { op: "create", doctorId: doc.id, start: toLocalNaiveISO(start), end: toLocalNaiveISO(end), kind };
+    const res = await fetch(devApi(`/api/dev/windows/batch`), {
+      method: "POST",
       headers: { "Content-Type": "application/json" },
-     body: JSON.stringify({ doctorId: doc.id, start: toLocalNaiveISO(start), end: toLocalNaiveISO(end), kind }),
+      body: JSON.stringify({ ops: [op] }),
     });
-    if (!createRes.ok) {
-      const t = await createRes.text();
-      alert(`Lưu block lỗi: ${t}`);
+    const body = res.ok ? await res.json() : null;
+    const j = body?.results?.[0];
+    if (!j?.ok) {
+      alert(`Lưu block lỗi: ${j?.detail || (await res.text().catch(() => res.statusText))}`);
       // revert visual
       el.style.transform = "";
       el.setAttribute("data-x", "0");
       return;
     }
-    const j = await createRes.json();
-    // If we had an existing window id, delete it after successful create
-    if (existingId) {
-      const del = await fetch(devApi(`/api/dev/windows/${existingId}`), { method: "DELETE" });
-      if (!del.ok) {
-        // Not fatal for the user flow; log and continue
-        console.warn('Failed to delete old window', await del.text());
-      }
-    }
     el.setAttribute("data-id", String(j.id));
   // Reset transform and sync absolute positioning to avoid drift in subsequent drags
   el.style.transform = "";